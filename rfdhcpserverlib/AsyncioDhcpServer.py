@@ -0,0 +1,457 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Minimal DHCPv4 server (RFC 2131) running on an asyncio event loop in a background thread
+It handles DISCOVER/OFFER/REQUEST/ACK/NAK/RELEASE/DECLINE/INFORM, allocates addresses from a single pool and expires leases using timers
+Lease events are delivered in-process to listeners, using the same names as the D-Bus signals of dnsmasq (DhcpLeaseAdded, DhcpLeaseUpdated and DhcpLeaseDeleted)
+"""
+
+import asyncio
+import collections
+import errno
+import fcntl
+import socket
+import struct
+import threading
+import time
+
+try:
+    from rfdhcpserverlib.DhcpPacket import DHCP_SERVER_PORT, DHCP_CLIENT_PORT, BOOTREQUEST, INFINITE_LEASE_TIME, ip_to_int, int_to_ip, DhcpPacket
+    from rfdhcpserverlib.DhcpPacket import DHCPDISCOVER, DHCPOFFER, DHCPREQUEST, DHCPDECLINE, DHCPACK, DHCPNAK, DHCPRELEASE, DHCPINFORM
+    from rfdhcpserverlib.DhcpPacket import OPTION_SUBNET_MASK, OPTION_REQUESTED_IP, OPTION_LEASE_TIME, OPTION_SERVER_ID, OPTION_RENEWAL_TIME, OPTION_REBINDING_TIME
+except ImportError: # When run as standalone, we are not imported as part of the rfdhcpserverlib package
+    from DhcpPacket import DHCP_SERVER_PORT, DHCP_CLIENT_PORT, BOOTREQUEST, INFINITE_LEASE_TIME, ip_to_int, int_to_ip, DhcpPacket
+    from DhcpPacket import DHCPDISCOVER, DHCPOFFER, DHCPREQUEST, DHCPDECLINE, DHCPACK, DHCPNAK, DHCPRELEASE, DHCPINFORM
+    from DhcpPacket import OPTION_SUBNET_MASK, OPTION_REQUESTED_IP, OPTION_LEASE_TIME, OPTION_SERVER_ID, OPTION_RENEWAL_TIME, OPTION_REBINDING_TIME
+
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891b
+
+def get_interface_ipv4(ifname, request = SIOCGIFADDR):
+    """
+    Get the IPv4 address (or the netmask if request is SIOCGIFNETMASK) configured on network interface ifname, or None if there is none
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        result = fcntl.ioctl(sock.fileno(), request, struct.pack('256s', ifname[:15].encode()))
+    except (IOError, OSError):
+        return None
+    finally:
+        sock.close()
+    return socket.inet_ntoa(result[20:24])
+
+
+class _DhcpServerProtocol(asyncio.DatagramProtocol):
+    """
+    asyncio protocol forwarding received datagrams to an AsyncioDhcpServer
+    """
+
+    def __init__(self, server):
+        self._server = server
+
+    def connection_made(self, transport):
+        self._server._transport = transport
+
+    def datagram_received(self, data, addr):
+        self._server._handleDatagram(data, addr)
+
+    def error_received(self, exc):
+        self._server._log('warn', 'Error on DHCP server socket: %s', exc)
+
+
+class AsyncioDhcpServer:
+    """
+    DHCPv4 server allocating addresses between pool_start and pool_end (inclusive) for lease_time seconds (None for infinite leases)
+    The server listens on UDP port port (67 by default). When using another port (eg for tests), replies are sent back to the source address and port of each request
+    If bind_to_device is True, the socket only receives and sends on network interface ifname (this requires CAP_NET_RAW)
+    server_address (the DHCP server identifier) and netmask default to the address and netmask configured on ifname
+    Listeners are callables invoked from the server thread as listener(signal, ipaddr, hwaddr, hostname), where signal is one of 'DhcpLeaseAdded', 'DhcpLeaseUpdated' or 'DhcpLeaseDeleted'
+    If provided, logger should be thread-safe (eg a DeferredLogger)
+    """
+
+    OFFER_HOLD_TIME = 30    # Duration (in s) during which an offered address is reserved for the client
+    DECLINE_HOLD_TIME = 600 # Duration (in s) during which an address declined by a client is not allocated
+    START_TIMEOUT = 5
+
+    def __init__(self, ifname, pool_start, pool_end, lease_time = 3600, server_address = None, netmask = None, port = DHCP_SERVER_PORT, bind_address = '0.0.0.0', bind_to_device = True, logger = None):
+        self._ifname = ifname
+        self._pool_start = ip_to_int(pool_start)
+        self._pool_end = ip_to_int(pool_end)
+        if self._pool_end < self._pool_start:
+            raise ValueError('Invalid address pool ' + pool_start + '-' + pool_end)
+        self.lease_time = lease_time
+        if server_address is None:
+            server_address = get_interface_ipv4(ifname)
+            if server_address is None:
+                raise Exception('NoServerAddress')
+        self._server_address = server_address
+        if netmask is None:
+            netmask = get_interface_ipv4(ifname, SIOCGIFNETMASK) or '255.255.255.0'
+        self._netmask = netmask
+        self._port = int(port)
+        self._bind_address = bind_address
+        self._bind_to_device = bind_to_device
+        self._logger = logger
+        self.listeners = []
+
+        self._loop = None
+        self._thread = None
+        self._transport = None
+        self._start_error = None    # Exception raised by the server thread while starting (see _run())
+        self._resetLeases()
+
+    def _resetLeases(self):
+        """
+        Discard all leases and offers, so that the whole pool is free again
+        """
+        self._leases = {}   # Current leases, as hwaddr: [ip (as int), hostname, expiry timer handle]
+        self._offers = {}   # Pending offers, as hwaddr: [ip (as int), timer handle]
+        self._ip_owner = {} # Addresses currently not free, as ip (as int): hwaddr (or None for declined addresses)
+        self._ack_times = {}    # Time (as returned by time.time()) at which the last DHCPACK has been sent to each leased client, as hwaddr: time
+        self._free = collections.OrderedDict((ip, None) for ip in range(self._pool_start, self._pool_end + 1))    # Free addresses, in allocation order (used as an ordered set, so that any address can be removed when it is reserved)
+
+    def start(self):
+        """
+        Bind the server socket and start serving from a background thread
+        A stopped server can be started again, its listeners are kept
+        If the server fails to start, the error is raised and the server is left stopped (so that it can be started again)
+        """
+        if not self._thread is None:
+            raise Exception('DhcpServerAlreadyStarted')
+        sock = self._createSocket()
+        self._loop = asyncio.new_event_loop()
+        self._start_error = None
+        ready = threading.Event()
+        self._thread = threading.Thread(target = self._run, args = (sock, ready))
+        self._thread.daemon = True
+        self._thread.start()
+        started = ready.wait(AsyncioDhcpServer.START_TIMEOUT)
+        if started and self._start_error is None:
+            return
+        if not started:
+            try:
+                self._loop.call_soon_threadsafe(self._loop.stop)   # Abort the endpoint creation, the server thread then cleans up (see _run())
+            except RuntimeError:    # The server thread has failed (and closed the loop) in the meantime
+                pass
+        self._thread.join(AsyncioDhcpServer.START_TIMEOUT)
+        error = self._start_error
+        if not started or error is None:
+            error = Exception('TimeoutOnDhcpServerStart')
+        self._thread = None
+        self._loop = None
+        self._transport = None
+        self._start_error = None
+        raise error
+
+    def stop(self):
+        """
+        Stop serving and wait for the server thread to terminate
+        Leases are discarded without emitting DhcpLeaseDeleted events
+        """
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+        self._transport = None
+        self._resetLeases()
+
+    def isRunning(self):
+        return not self._thread is None and self._thread.is_alive()
+
+    def getPort(self):
+        """
+        Get the UDP port the server is bound to (useful when created with port 0)
+        """
+        if self._transport is None:
+            return self._port
+        return self._transport.get_extra_info('sockname')[1]
+
+    def callLater(self, delay, callback):
+        """
+        Run callback (without argument) from the server thread after delay seconds (this can be invoked from any thread)
+        """
+        self._loop.call_soon_threadsafe(self._loop.call_later, delay, callback)
+
+    def getLeases(self):
+        """
+        Returns a list of (hwaddr, ipaddr, hostname) tuples for all current leases
+        """
+        return [(hwaddr, int_to_ip(lease[0]), lease[1]) for (hwaddr, lease) in list(self._leases.items())]
+
+    def getAckTime(self, hwaddr):
+        """
+        Get the time (as returned by time.time()) at which the last DHCPACK has been sent to hwaddr, or None if it has no lease
+        """
+        return self._ack_times.get(hwaddr)
+
+    def _createSocket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            if self._bind_to_device:
+                sock.setsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_BINDTODEVICE', 25), self._ifname.encode())
+            sock.bind((self._bind_address, self._port))
+        except (IOError, OSError) as e:
+            sock.close()
+            if e.errno == errno.EADDRINUSE:
+                raise Exception('DhcpPortAlreadyUsed')
+            raise
+        sock.setblocking(False)
+        return sock
+
+    def _run(self, sock, ready):
+        """
+        This method should be run within a thread... It runs the asyncio event loop serving DHCP requests until stop() is called
+        """
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._loop.create_datagram_endpoint(lambda: _DhcpServerProtocol(self), sock = sock))
+        except Exception as e:  # Report the failure to start()
+            self._start_error = e
+            if not self._transport is None:
+                self._transport.close()
+            sock.close()
+            self._loop.close()
+            ready.set()
+            return
+        ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._transport.close()
+            for lease in self._leases.values():
+                if not lease[2] is None:
+                    lease[2].cancel()
+            for offer in self._offers.values():
+                offer[1].cancel()
+            self._loop.run_until_complete(asyncio.sleep(0))    # Let the transport close
+            self._loop.close()
+
+    def _log(self, level, fmt, *args):
+        if not self._logger is None:
+            getattr(self._logger, level)(fmt, *args)
+
+    def _emit(self, signal, ip, hwaddr, hostname):
+        """
+        Deliver a lease event to all listeners
+        """
+        ipaddr = int_to_ip(ip)
+        for listener in self.listeners:
+            try:
+                listener(signal, ipaddr, hwaddr, hostname)
+            except Exception as e:
+                self._log('warn', 'Error in listener for %s: %s', signal, e)
+
+    # Address pool management
+    def _isAvailable(self, ip, hwaddr):
+        """
+        Can ip be allocated to hwaddr
+        """
+        if ip < self._pool_start or ip > self._pool_end:
+            return False
+        owner = self._ip_owner.get(ip, hwaddr)
+        return owner == hwaddr
+
+    def _reserve(self, ip, hwaddr):
+        self._ip_owner[ip] = hwaddr
+        self._free.pop(ip, None)
+
+    def _unreserve(self, ip):
+        if self._ip_owner.pop(ip, False) is not False:
+            self._free[ip] = None
+
+    def _allocate(self, hwaddr, requested_ip = None):
+        """
+        Find an address to offer to hwaddr: its current lease or offer, then the address it requested, then the next free address
+        Returns None if the pool is exhausted
+        """
+        lease = self._leases.get(hwaddr)
+        if not lease is None:
+            return lease[0]
+        offer = self._offers.get(hwaddr)
+        if not offer is None:
+            return offer[0]
+        if not requested_ip is None and self._isAvailable(requested_ip, hwaddr):
+            return requested_ip
+        if self._free:
+            return next(iter(self._free))   # The address is removed from the free addresses when it is reserved for the offer
+        return None
+
+    def _offer(self, hwaddr, ip):
+        offer = self._offers.get(hwaddr)
+        if not offer is None:
+            offer[1].cancel()
+            if offer[0] != ip:
+                self._unreserve(offer[0])
+        self._reserve(ip, hwaddr)
+        self._offers[hwaddr] = [ip, self._loop.call_later(AsyncioDhcpServer.OFFER_HOLD_TIME, self._expireOffer, hwaddr, ip)]
+
+    def _expireOffer(self, hwaddr, ip):
+        offer = self._offers.get(hwaddr)
+        if offer is None or offer[0] != ip:
+            return
+        del self._offers[hwaddr]
+        if not hwaddr in self._leases or self._leases[hwaddr][0] != ip:
+            self._unreserve(ip)
+
+    def _commitLease(self, hwaddr, ip, hostname):
+        """
+        Record (or renew) the lease of ip for hwaddr
+        Returns the lease event to emit ('DhcpLeaseAdded' or 'DhcpLeaseUpdated'), once the client has been acknowledged
+        """
+        offer = self._offers.pop(hwaddr, None)
+        if not offer is None:
+            offer[1].cancel()
+            if offer[0] != ip:
+                self._unreserve(offer[0])
+        lease = self._leases.get(hwaddr)
+        if lease is None:
+            signal = 'DhcpLeaseAdded'
+        else:
+            if not lease[2] is None:
+                lease[2].cancel()
+            if lease[0] == ip:
+                signal = 'DhcpLeaseUpdated'
+            else:
+                self._unreserve(lease[0])
+                signal = 'DhcpLeaseAdded'
+        self._reserve(ip, hwaddr)
+        timer = None
+        if not self.lease_time is None:
+            timer = self._loop.call_later(self.lease_time, self._expireLease, hwaddr, ip)
+        self._leases[hwaddr] = [ip, hostname, timer]
+        return signal
+
+    def _removeLease(self, hwaddr, ip):
+        """
+        Remove the lease of ip for hwaddr (if it still exists) and emit a DhcpLeaseDeleted event
+        Returns False if there was no such lease
+        """
+        lease = self._leases.get(hwaddr)
+        if lease is None or lease[0] != ip:
+            return False
+        del self._leases[hwaddr]
+        self._ack_times.pop(hwaddr, None)
+        if not lease[2] is None:
+            lease[2].cancel()
+        self._unreserve(ip)
+        self._emit('DhcpLeaseDeleted', ip, hwaddr, lease[1])
+        return True
+
+    def _expireLease(self, hwaddr, ip):
+        self._removeLease(hwaddr, ip)
+
+    def _releaseDeclined(self, ip):
+        if ip in self._ip_owner and self._ip_owner[ip] is None:
+            self._unreserve(ip)
+
+    # Protocol handling
+    def _handleDatagram(self, data, addr):
+        try:
+            packet = DhcpPacket.parse(data)
+        except (ValueError, struct.error):
+            return
+        if packet.op != BOOTREQUEST:
+            return
+        handler = {DHCPDISCOVER: self._handleDiscover,
+                   DHCPREQUEST: self._handleRequest,
+                   DHCPDECLINE: self._handleDecline,
+                   DHCPRELEASE: self._handleRelease,
+                   DHCPINFORM: self._handleInform}.get(packet.getMessageType())
+        if not handler is None:
+            handler(packet, addr)
+
+    def _handleDiscover(self, packet, addr):
+        hwaddr = packet.getMacAddress()
+        requested = packet.getIpOption(OPTION_REQUESTED_IP)
+        ip = self._allocate(hwaddr, None if requested is None else ip_to_int(requested))
+        if ip is None:
+            self._log('warn', 'No address available in pool for %s', hwaddr)
+            return
+        self._offer(hwaddr, ip)
+        self._sendReply(packet, self._makeLeaseReply(packet, DHCPOFFER, ip), addr)
+
+    def _handleRequest(self, packet, addr):
+        hwaddr = packet.getMacAddress()
+        server_id = packet.getIpOption(OPTION_SERVER_ID)
+        requested = packet.getIpOption(OPTION_REQUESTED_IP)
+        if not server_id is None:   # SELECTING state
+            if server_id != self._server_address:   # The client has chosen another server
+                offer = self._offers.get(hwaddr)
+                if not offer is None:
+                    self._expireOffer(hwaddr, offer[0])
+                return
+            if requested is None:
+                return
+            ip = ip_to_int(requested)
+        elif not requested is None: # INIT-REBOOT state
+            ip = ip_to_int(requested)
+        elif packet.ciaddr != '0.0.0.0':    # RENEWING or REBINDING state
+            ip = ip_to_int(packet.ciaddr)
+        else:
+            return
+        if not self._isAvailable(ip, hwaddr):
+            self._sendReply(packet, packet.makeReply(DHCPNAK), addr)    # We are authoritative on this subnet
+            return
+        hostname = packet.getHostname()
+        signal = self._commitLease(hwaddr, ip, hostname)
+        self._sendReply(packet, self._makeLeaseReply(packet, DHCPACK, ip), addr)
+        self._ack_times[hwaddr] = time.time()
+        self._emit(signal, ip, hwaddr, hostname)    # Listeners are only notified once the ACK has been sent, so that they never see a lease before its client could
+
+    def _handleDecline(self, packet, addr):
+        hwaddr = packet.getMacAddress()
+        requested = packet.getIpOption(OPTION_REQUESTED_IP)
+        if requested is None:
+            return
+        ip = ip_to_int(requested)
+        self._removeLease(hwaddr, ip)
+        offer = self._offers.pop(hwaddr, None)
+        if not offer is None:
+            offer[1].cancel()
+        if self._ip_owner.get(ip, hwaddr) == hwaddr:
+            self._reserve(ip, None) # Quarantine this address, it is probably in use by another host
+            self._loop.call_later(AsyncioDhcpServer.DECLINE_HOLD_TIME, self._releaseDeclined, ip)
+        self._log('warn', 'Address %s declined by %s', requested, hwaddr)
+
+    def _handleRelease(self, packet, addr):
+        self._removeLease(packet.getMacAddress(), ip_to_int(packet.ciaddr))
+
+    def _handleInform(self, packet, addr):
+        reply = packet.makeReply(DHCPACK)
+        reply.ciaddr = packet.ciaddr
+        reply.setIpOption(OPTION_SERVER_ID, self._server_address)
+        reply.setIpOption(OPTION_SUBNET_MASK, self._netmask)
+        self._sendReply(packet, reply, addr)
+
+    def _makeLeaseReply(self, packet, message_type, ip):
+        reply = packet.makeReply(message_type)
+        reply.ciaddr = packet.ciaddr
+        reply.yiaddr = int_to_ip(ip)
+        reply.siaddr = self._server_address
+        reply.setIpOption(OPTION_SERVER_ID, self._server_address)
+        if self.lease_time is None:
+            reply.setUint32Option(OPTION_LEASE_TIME, INFINITE_LEASE_TIME)
+        else:
+            reply.setUint32Option(OPTION_LEASE_TIME, self.lease_time)
+            reply.setUint32Option(OPTION_RENEWAL_TIME, self.lease_time // 2)
+            reply.setUint32Option(OPTION_REBINDING_TIME, self.lease_time * 7 // 8)
+        reply.setIpOption(OPTION_SUBNET_MASK, self._netmask)
+        return reply
+
+    def _sendReply(self, packet, reply, addr):
+        """
+        Send reply to the client that sent packet from address addr (see RFC 2131, section 4.1)
+        """
+        if self._port != DHCP_SERVER_PORT:  # Not running on the standard port (eg tests), answer to the sender
+            destination = addr
+        elif packet.giaddr != '0.0.0.0':
+            destination = (packet.giaddr, DHCP_SERVER_PORT)
+        elif reply.getMessageType() != DHCPNAK and packet.ciaddr != '0.0.0.0':
+            destination = (packet.ciaddr, DHCP_CLIENT_PORT)
+        else:   # The client has no address yet (we cannot unicast to yiaddr without an ARP entry, so broadcast)
+            destination = ('255.255.255.255', DHCP_CLIENT_PORT)
+        self._transport.sendto(reply.pack(), destination)
@@ -0,0 +1,263 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+DHCP client swarm load generator
+Emulates many DHCP clients (each with its own MAC address) performing DISCOVER/OFFER/REQUEST/ACK handshakes, optional renewals and releases, and measures the handshake latencies
+It can run against the UDP port of a DHCP server (eg the asyncio backend on a high port), or broadcast on a network interface (eg one end of a veth pair in a network namespace)
+"""
+
+from __future__ import print_function
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import struct
+import sys
+import time
+
+try:
+    from rfdhcpserverlib import DhcpPacket
+    from rfdhcpserverlib.Statistics import percentiles
+except ImportError: # When run as a script, we are not imported as part of the rfdhcpserverlib package
+    import DhcpPacket
+    from Statistics import percentiles
+
+
+class _SwarmProtocol(asyncio.DatagramProtocol):
+    """
+    asyncio protocol dispatching DHCP replies to the client waiting for their transaction ID
+    """
+
+    def __init__(self, swarm):
+        self._swarm = swarm
+
+    def datagram_received(self, data, addr):
+        try:
+            packet = DhcpPacket.DhcpPacket.parse(data)
+        except (ValueError, struct.error):
+            return
+        if packet.op != DhcpPacket.BOOTREPLY:
+            return
+        waiter = self._swarm._waiters.get(packet.xid)
+        if not waiter is None and not waiter.done():
+            waiter.set_result(packet)
+
+
+class DhcpClientSwarm:
+    """
+    A swarm of emulated DHCP clients
+    clients is the number of clients, that are started at a rate of rate clients per second
+    Each client performs a DORA handshake, then renews its lease renews times (every renew_interval seconds), and releases it if release is True
+    Requests are sent to server_address:server_port. If server_address is the broadcast address, the socket is bound to the DHCP client port and replies are expected to be broadcast, and renewals are sent in the INIT-REBOOT form (the client has no usable address)
+    interface, if provided, is the network interface to bind to (this requires CAP_NET_RAW)
+    Each request is retransmitted up to retries times if no reply is received within timeout seconds
+    MAC addresses are built from mac_prefix (3 bytes) followed by the client index
+    """
+
+    def __init__(self, server_address = '255.255.255.255', server_port = DhcpPacket.DHCP_SERVER_PORT, clients = 100, rate = 100.0, renews = 0, renew_interval = 1.0, release = True, timeout = 2.0, retries = 3, bind_address = '0.0.0.0', client_port = None, interface = None, mac_prefix = '02:00:00'):
+        self._server = (server_address, int(server_port))
+        self._broadcast = (server_address == '255.255.255.255')
+        self._clients = int(clients)
+        self._rate = float(rate)
+        self._renews = int(renews)
+        self._renew_interval = float(renew_interval)
+        self._release = release
+        self._timeout = float(timeout)
+        self._retries = int(retries)
+        self._bind_address = bind_address
+        if client_port is None:
+            client_port = DhcpPacket.DHCP_CLIENT_PORT if self._broadcast else 0
+        self._client_port = int(client_port)
+        self._interface = interface
+        self._mac_prefix = bytearray(int(byte, 16) for byte in mac_prefix.split(':'))
+        self._waiters = {}  # Pending transactions, as xid: asyncio.Future
+        self._transport = None
+
+    def run(self):
+        """
+        Run the whole swarm and return a tuple (summary, results) where results contains one dict per client (see _runClient()) and summary aggregates them
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self._run())
+        finally:
+            loop.close()
+
+    def getMacAddress(self, index):
+        """
+        Get the MAC address of the client with index index, as a lowercase colon-separated string
+        """
+        return ':'.join('%02x' % byte for byte in bytes(self._mac_prefix) + struct.pack('!I', index)[1:])
+
+    def _createSocket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        if not self._interface is None:
+            sock.setsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_BINDTODEVICE', 25), self._interface.encode())
+        sock.bind((self._bind_address, self._client_port))
+        sock.setblocking(False)
+        return sock
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        (self._transport, protocol) = await loop.create_datagram_endpoint(lambda: _SwarmProtocol(self), sock = self._createSocket())
+        start = time.time()
+        try:
+            tasks = []
+            for index in range(self._clients):
+                delay = start + index / self._rate - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(loop.create_task(self._runClient(index)))
+            results = await asyncio.gather(*tasks)
+        finally:
+            self._transport.close()
+        return (self._summarize(results, time.time() - start), results)
+
+    async def _transaction(self, packet, expected_types, result):
+        """
+        Send packet and wait for a reply with a message type in expected_types, retransmitting packet on timeout
+        Returns the reply, or None if there was no reply after all retransmissions (result['retransmissions'] is updated accordingly)
+        """
+        waiter = None
+        try:
+            for attempt in range(self._retries + 1):
+                if attempt > 0:
+                    result['retransmissions'] += 1
+                waiter = asyncio.get_event_loop().create_future()
+                self._waiters[packet.xid] = waiter
+                self._transport.sendto(packet.pack(), self._server)
+                try:
+                    reply = await asyncio.wait_for(waiter, self._timeout)
+                except asyncio.TimeoutError:
+                    continue
+                if reply.getMessageType() in expected_types:
+                    return reply
+        finally:
+            self._waiters.pop(packet.xid, None)
+        return None
+
+    def _newRequest(self, message_type, index):
+        packet = DhcpPacket.DhcpPacket()
+        packet.xid = random.getrandbits(32)
+        while packet.xid in self._waiters:
+            packet.xid = random.getrandbits(32)
+        packet.chaddr = bytes(self._mac_prefix) + struct.pack('!I', index)[1:]
+        if self._broadcast:
+            packet.flags = 0x8000   # Ask the server to broadcast its replies
+        packet.setOption(DhcpPacket.OPTION_MESSAGE_TYPE, struct.pack('!B', message_type))
+        return packet
+
+    async def _runClient(self, index):
+        """
+        Run one emulated client and return a dict with its results:
+        - 'mac' and 'ip' (None if no lease was obtained)
+        - 'discover_time' and 'ack_time' (in seconds since the epoch)
+        - 'offer_latency' and 'dora_latency' (in s, from the first DISCOVER)
+        - 'retransmissions' and 'renew_latencies' (one per successful renewal)
+        - 'error' (None on success)
+        """
+        result = {'mac': self.getMacAddress(index), 'ip': None, 'discover_time': time.time(), 'ack_time': None,
+                  'offer_latency': None, 'dora_latency': None, 'retransmissions': 0, 'renew_latencies': [], 'error': None}
+        discover = self._newRequest(DhcpPacket.DHCPDISCOVER, index)
+        offer = await self._transaction(discover, [DhcpPacket.DHCPOFFER], result)
+        if offer is None:
+            result['error'] = 'NoOffer'
+            return result
+        result['offer_latency'] = time.time() - result['discover_time']
+        server_id = offer.getIpOption(DhcpPacket.OPTION_SERVER_ID)
+        request = self._newRequest(DhcpPacket.DHCPREQUEST, index)
+        request.xid = discover.xid
+        request.setIpOption(DhcpPacket.OPTION_REQUESTED_IP, offer.yiaddr)
+        if not server_id is None:
+            request.setIpOption(DhcpPacket.OPTION_SERVER_ID, server_id)
+        ack = await self._transaction(request, [DhcpPacket.DHCPACK, DhcpPacket.DHCPNAK], result)
+        if ack is None or ack.getMessageType() != DhcpPacket.DHCPACK:
+            result['error'] = 'NoAck' if ack is None else 'Nak'
+            return result
+        result['ack_time'] = time.time()
+        result['dora_latency'] = result['ack_time'] - result['discover_time']
+        result['ip'] = ack.yiaddr
+
+        for renew in range(self._renews):
+            await asyncio.sleep(self._renew_interval)
+            request = self._newRequest(DhcpPacket.DHCPREQUEST, index)
+            if self._broadcast:
+                request.setIpOption(DhcpPacket.OPTION_REQUESTED_IP, result['ip'])
+            else:
+                request.ciaddr = result['ip']
+            renew_start = time.time()
+            ack = await self._transaction(request, [DhcpPacket.DHCPACK, DhcpPacket.DHCPNAK], result)
+            if ack is None or ack.getMessageType() != DhcpPacket.DHCPACK:
+                result['error'] = 'RenewFailed'
+                return result
+            result['renew_latencies'].append(time.time() - renew_start)
+
+        if self._release:
+            release = self._newRequest(DhcpPacket.DHCPRELEASE, index)
+            release.flags = 0
+            release.ciaddr = result['ip']
+            if not server_id is None:
+                release.setIpOption(DhcpPacket.OPTION_SERVER_ID, server_id)
+            self._transport.sendto(release.pack(), self._server)
+        return result
+
+    def _summarize(self, results, duration):
+        bound = [result for result in results if not result['ack_time'] is None]
+        errors = {}
+        for result in results:
+            if not result['error'] is None:
+                errors[result['error']] = errors.get(result['error'], 0) + 1
+        return {'clients': len(results),
+                'bound': len(bound),
+                'errors': errors,
+                'duration': duration,
+                'handshakes_per_second': len(bound) / duration if duration > 0 else None,
+                'retransmissions': sum(result['retransmissions'] for result in results),
+                'offer_latency': percentiles([result['offer_latency'] for result in bound]),
+                'dora_latency': percentiles([result['dora_latency'] for result in bound]),
+                'renew_latency': percentiles([latency for result in results for latency in result['renew_latencies']])}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Emulate a swarm of DHCP clients and measure DHCP handshake latencies')
+    parser.add_argument('-s', '--server', default = '255.255.255.255', help = 'DHCP server address (default: broadcast)')
+    parser.add_argument('-p', '--port', type = int, default = DhcpPacket.DHCP_SERVER_PORT, help = 'DHCP server UDP port (default: 67)')
+    parser.add_argument('-n', '--clients', type = int, default = 100, help = 'number of emulated clients')
+    parser.add_argument('-r', '--rate', type = float, default = 100.0, help = 'number of clients started per second')
+    parser.add_argument('--renews', type = int, default = 0, help = 'number of renewals performed by each client')
+    parser.add_argument('--renew-interval', type = float, default = 1.0, help = 'interval between renewals (in s)')
+    parser.add_argument('--no-release', dest = 'release', action = 'store_false', help = 'do not release leases at the end')
+    parser.add_argument('--timeout', type = float, default = 2.0, help = 'timeout before retransmitting a request (in s)')
+    parser.add_argument('--retries', type = int, default = 3, help = 'maximum number of retransmissions per request')
+    parser.add_argument('-i', '--interface', help = 'network interface to bind to')
+    parser.add_argument('--client-port', type = int, help = 'local UDP port (default: 68 when broadcasting, ephemeral otherwise)')
+    parser.add_argument('--mac-prefix', default = '02:00:00', help = 'first 3 bytes of the MAC addresses of emulated clients')
+    parser.add_argument('--json', metavar = 'FILE', help = "write the summary and per-client results as JSON to FILE ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    swarm = DhcpClientSwarm(server_address = args.server, server_port = args.port, clients = args.clients, rate = args.rate,
+                            renews = args.renews, renew_interval = args.renew_interval, release = args.release,
+                            timeout = args.timeout, retries = args.retries, client_port = args.client_port,
+                            interface = args.interface, mac_prefix = args.mac_prefix)
+    (summary, results) = swarm.run()
+    if args.json == '-':
+        json.dump({'summary': summary, 'clients': results}, sys.stdout)
+        return 0
+    if not args.json is None:
+        with open(args.json, 'w') as f:
+            json.dump({'summary': summary, 'clients': results}, f)
+    print('%d/%d clients bound in %.3fs (%.1f handshakes/s), %d retransmission(s)' % (summary['bound'], summary['clients'], summary['duration'], summary['handshakes_per_second'] or 0, summary['retransmissions']))
+    for name in ['offer_latency', 'dora_latency', 'renew_latency']:
+        if not summary[name] is None:
+            print('%s: %s' % (name, ', '.join('%s=%.6fs' % (key, summary[name][key]) for key in ['min', 'p50', 'p90', 'p99', 'max'])))
+    if summary['errors']:
+        print('errors: ' + str(summary['errors']))
+    return 0 if summary['bound'] == summary['clients'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+DHCPv4 (BOOTP) message encoding and decoding, shared by the asyncio DHCP server, the DHCP client swarm and the handshake capture
+This module must stay importable by Python 2 (handshake capture is also used with the dnsmasq backend, which relies on gobject), so it should not depend on asyncio
+"""
+
+import collections
+import socket
+import struct
+
+DHCP_SERVER_PORT = 67
+DHCP_CLIENT_PORT = 68
+
+BOOTREQUEST = 1
+BOOTREPLY = 2
+
+DHCPDISCOVER = 1
+DHCPOFFER = 2
+DHCPREQUEST = 3
+DHCPDECLINE = 4
+DHCPACK = 5
+DHCPNAK = 6
+DHCPRELEASE = 7
+DHCPINFORM = 8
+
+OPTION_PAD = 0
+OPTION_SUBNET_MASK = 1
+OPTION_HOSTNAME = 12
+OPTION_REQUESTED_IP = 50
+OPTION_LEASE_TIME = 51
+OPTION_MESSAGE_TYPE = 53
+OPTION_SERVER_ID = 54
+OPTION_RENEWAL_TIME = 58
+OPTION_REBINDING_TIME = 59
+OPTION_END = 255
+
+INFINITE_LEASE_TIME = 0xffffffff
+
+MAGIC_COOKIE = b'\x63\x82\x53\x63'
+BOOTP_HEADER = struct.Struct('!BBBBIHH4s4s4s4s16s64s128s')
+
+def ip_to_int(ipaddr):
+    """
+    Convert a dotted IPv4 address string to an integer
+    """
+    return struct.unpack('!I', socket.inet_aton(ipaddr))[0]
+
+def int_to_ip(value):
+    """
+    Convert an integer to a dotted IPv4 address string
+    """
+    return socket.inet_ntoa(struct.pack('!I', value))
+
+
+class DhcpPacket:
+    """
+    A DHCPv4 (BOOTP) message
+    Addresses are stored as dotted strings, chaddr as raw bytes, and options as a dict of code: raw bytes value
+    """
+
+    def __init__(self):
+        self.op = BOOTREQUEST
+        self.htype = 1  # Ethernet
+        self.hlen = 6
+        self.hops = 0
+        self.xid = 0
+        self.secs = 0
+        self.flags = 0
+        self.ciaddr = '0.0.0.0'
+        self.yiaddr = '0.0.0.0'
+        self.siaddr = '0.0.0.0'
+        self.giaddr = '0.0.0.0'
+        self.chaddr = b'\x00' * 6
+        self.options = collections.OrderedDict()
+
+    @classmethod
+    def parse(cls, data):
+        """
+        Build a DhcpPacket from the raw bytes data received on the wire
+        Raises ValueError if data is not a valid DHCP message
+        """
+        if len(data) < BOOTP_HEADER.size + len(MAGIC_COOKIE) or data[BOOTP_HEADER.size:BOOTP_HEADER.size + 4] != MAGIC_COOKIE:
+            raise ValueError('Not a DHCP message')
+        packet = cls()
+        (packet.op, packet.htype, packet.hlen, packet.hops, packet.xid, packet.secs, packet.flags,
+         ciaddr, yiaddr, siaddr, giaddr, chaddr, sname, bootfile) = BOOTP_HEADER.unpack_from(data)
+        packet.ciaddr = socket.inet_ntoa(ciaddr)
+        packet.yiaddr = socket.inet_ntoa(yiaddr)
+        packet.siaddr = socket.inet_ntoa(siaddr)
+        packet.giaddr = socket.inet_ntoa(giaddr)
+        if packet.hlen > 16:
+            raise ValueError('Invalid hardware address length')
+        packet.chaddr = chaddr[:packet.hlen]
+        octets = bytearray(data)    # Indexing bytes gives an int on Python 3 but a 1-character str on Python 2
+        offset = BOOTP_HEADER.size + 4
+        while offset < len(data):
+            code = octets[offset]
+            if code == OPTION_END:
+                break
+            if code == OPTION_PAD:
+                offset += 1
+                continue
+            if offset + 1 >= len(data):
+                raise ValueError('Truncated option')
+            length = octets[offset + 1]
+            packet.options[code] = data[offset + 2:offset + 2 + length]
+            offset += 2 + length
+        return packet
+
+    def pack(self):
+        """
+        Serialize this DhcpPacket to raw bytes
+        """
+        header = BOOTP_HEADER.pack(self.op, self.htype, self.hlen, self.hops, self.xid, self.secs, self.flags,
+                                   socket.inet_aton(self.ciaddr), socket.inet_aton(self.yiaddr),
+                                   socket.inet_aton(self.siaddr), socket.inet_aton(self.giaddr),
+                                   self.chaddr.ljust(16, b'\x00'), b'', b'')
+        options = bytearray(MAGIC_COOKIE)
+        for (code, value) in self.options.items():
+            options += struct.pack('!BB', code, len(value)) + value
+        options.append(OPTION_END)
+        packet = header + bytes(options)
+        return packet.ljust(300, b'\x00')   # Some clients drop replies smaller than a BOOTP message
+
+    def getMacAddress(self):
+        """
+        Get the client hardware address as a lowercase colon-separated string
+        """
+        return ':'.join('%02x' % byte for byte in bytearray(self.chaddr))
+
+    def getMessageType(self):
+        value = self.options.get(OPTION_MESSAGE_TYPE)
+        if not value:
+            return None
+        return bytearray(value)[0]
+
+    def getIpOption(self, code):
+        """
+        Get the value of an IPv4 address option as a dotted string, or None if this option is not present
+        """
+        value = self.options.get(code)
+        if value is None or len(value) != 4:
+            return None
+        return socket.inet_ntoa(value)
+
+    def getHostname(self):
+        value = self.options.get(OPTION_HOSTNAME)
+        if value is None:
+            return ''
+        return value.decode('ascii', 'replace')
+
+    def setOption(self, code, value):
+        self.options[code] = value
+
+    def setIpOption(self, code, ipaddr):
+        self.options[code] = socket.inet_aton(ipaddr)
+
+    def setUint32Option(self, code, value):
+        self.options[code] = struct.pack('!I', value)
+
+    def makeReply(self, message_type):
+        """
+        Build a BOOTREPLY to this packet, with the same transaction and client identification
+        """
+        reply = DhcpPacket()
+        reply.op = BOOTREPLY
+        reply.htype = self.htype
+        reply.hlen = self.hlen
+        reply.xid = self.xid
+        reply.flags = self.flags
+        reply.giaddr = self.giaddr
+        reply.chaddr = self.chaddr
+        reply.setOption(OPTION_MESSAGE_TYPE, struct.pack('!B', message_type))
+        return reply
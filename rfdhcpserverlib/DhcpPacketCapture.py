@@ -0,0 +1,260 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+DHCP handshake timing capture
+Captures DHCP traffic on a network interface using an AF_PACKET socket with a kernel BPF filter (only IPv4 UDP packets on ports 67 or 68 reach userspace) and a memory-mapped receive ring (TPACKET_V2)
+DHCP messages are matched by client MAC address and transaction ID to compute per-client handshake timings (DISCOVER to ACK, retransmissions...)
+This requires CAP_NET_RAW
+"""
+
+import collections
+import ctypes
+import mmap
+import select
+import socket
+import struct
+import threading
+import time
+
+try:
+    from rfdhcpserverlib import DhcpPacket
+except ImportError: # When run as standalone, we are not imported as part of the rfdhcpserverlib package
+    import DhcpPacket
+
+ETH_P_ALL = 0x0003  # Only ETH_P_ALL packet sockets also receive the frames transmitted by the host (eg the replies of our DHCP server)
+ETH_P_IP = 0x0800
+ETH_HEADER_LENGTH = 14
+
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+TPACKET_V2 = 1
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+TPACKET2_HEADER = struct.Struct('IIIHHII')  # tp_status, tp_len, tp_snaplen, tp_mac, tp_net, tp_sec, tp_nsec (followed by VLAN info and padding, 32 bytes in total)
+TPACKET2_HEADER_LENGTH = 32
+SOCKADDR_LL = struct.Struct('HHiHBB')   # sll_family, sll_protocol, sll_ifindex, sll_hatype, sll_pkttype, sll_halen
+PACKET_OUTGOING = 4
+ARPHRD_LOOPBACK = 772
+
+SO_ATTACH_FILTER = 26
+
+# Classic BPF program equivalent to tcpdump's 'ip and udp and (port 67 or port 68)' (non-first fragments are dropped)
+DHCP_BPF_FILTER = [
+    (0x28, 0, 0, 12),       # ldh [12]                   ; Ethertype
+    (0x15, 0, 12, ETH_P_IP),# jeq #0x800, next, drop
+    (0x30, 0, 0, 23),       # ldb [23]                   ; IP protocol
+    (0x15, 0, 10, 17),      # jeq #17 (UDP), next, drop
+    (0x28, 0, 0, 20),       # ldh [20]                   ; IP fragment offset
+    (0x45, 8, 0, 0x1fff),   # jset #0x1fff, drop, next
+    (0xb1, 0, 0, 14),       # ldxb 4*([14]&0xf)          ; IP header length
+    (0x48, 0, 0, 14),       # ldh [x+14]                 ; UDP source port
+    (0x15, 4, 0, 67),       # jeq #67, accept, next
+    (0x15, 3, 0, 68),       # jeq #68, accept, next
+    (0x48, 0, 0, 16),       # ldh [x+16]                 ; UDP destination port
+    (0x15, 1, 0, 67),       # jeq #67, accept, next
+    (0x15, 0, 1, 68),       # jeq #68, accept, drop
+    (0x06, 0, 0, 0x40000),  # accept: ret #262144
+    (0x06, 0, 0, 0),        # drop: ret #0
+]
+
+
+def attach_bpf_filter(sock, program):
+    """
+    Attach the classic BPF program (a list of (code, jt, jf, k) tuples) to socket sock
+    """
+    instructions = b''.join(struct.pack('HBBI', *instruction) for instruction in program)
+    buf = ctypes.create_string_buffer(instructions)
+    fprog = struct.pack('HL', len(program), ctypes.addressof(buf))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+class HandshakeTracker:
+    """
+    Match DHCP messages by client MAC address and transaction ID, and invoke callback(hwaddr, timing) each time a handshake completes (on ACK or NAK)
+    timing is a dict with keys:
+    - 'kind': 'dora' (starting with a DISCOVER), 'renew' (REQUEST with a client address) or 'reboot' (REQUEST without client address)
+    - 'xid', 'ip' and 'result' ('ACK' or 'NAK')
+    - 'discover_time', 'offer_time', 'request_time' and 'ack_time' (timestamps in seconds since the epoch, or None)
+    - 'duration' (from the first DISCOVER, or first REQUEST if there was no DISCOVER, to the ACK), 'offer_latency' and 'request_latency' (from the first REQUEST to the ACK), in s
+    - 'discover_retransmissions' and 'request_retransmissions'
+    At most max_pending incomplete handshakes are kept (the oldest ones are discarded)
+    """
+
+    def __init__(self, callback, max_pending = 65536):
+        self._callback = callback
+        self._max_pending = max_pending
+        self._pending = collections.OrderedDict()   # Incomplete handshakes, as hwaddr: dict
+
+    def process(self, timestamp, packet):
+        """
+        Process a DHCP message packet (a DhcpPacket.DhcpPacket) captured at timestamp
+        """
+        message_type = packet.getMessageType()
+        hwaddr = packet.getMacAddress()
+        pending = self._pending.get(hwaddr)
+        if message_type == DhcpPacket.DHCPDISCOVER:
+            if not pending is None and pending['kind'] == 'dora' and pending['request_time'] is None:   # Retransmission (some clients change xid when retransmitting)
+                pending['discovers'] += 1
+                pending['xid'] = packet.xid
+            else:
+                self._addPending(hwaddr, {'kind': 'dora', 'xid': packet.xid, 'discover_time': timestamp, 'offer_time': None,
+                                          'request_time': None, 'discovers': 1, 'requests': 0})
+        elif message_type == DhcpPacket.DHCPOFFER:
+            if not pending is None and pending['xid'] == packet.xid and pending['offer_time'] is None:
+                pending['offer_time'] = timestamp
+        elif message_type == DhcpPacket.DHCPREQUEST:
+            if not pending is None and (pending['xid'] == packet.xid or pending['kind'] != 'dora'):
+                if pending['request_time'] is None:
+                    pending['request_time'] = timestamp
+                pending['requests'] += 1
+                pending['xid'] = packet.xid
+            else:
+                self._addPending(hwaddr, {'kind': 'renew' if packet.ciaddr != '0.0.0.0' else 'reboot', 'xid': packet.xid, 'discover_time': None,
+                                          'offer_time': None, 'request_time': timestamp, 'discovers': 0, 'requests': 1})
+        elif message_type in [DhcpPacket.DHCPACK, DhcpPacket.DHCPNAK]:
+            if pending is None or pending['xid'] != packet.xid or pending['request_time'] is None:
+                return
+            del self._pending[hwaddr]
+            start = pending['discover_time'] if not pending['discover_time'] is None else pending['request_time']
+            timing = {'kind': pending['kind'],
+                      'xid': packet.xid,
+                      'ip': packet.yiaddr,
+                      'result': 'ACK' if message_type == DhcpPacket.DHCPACK else 'NAK',
+                      'discover_time': pending['discover_time'],
+                      'offer_time': pending['offer_time'],
+                      'request_time': pending['request_time'],
+                      'ack_time': timestamp,
+                      'duration': timestamp - start,
+                      'offer_latency': None if pending['offer_time'] is None else pending['offer_time'] - pending['discover_time'],
+                      'request_latency': timestamp - pending['request_time'],
+                      'discover_retransmissions': max(0, pending['discovers'] - 1),
+                      'request_retransmissions': max(0, pending['requests'] - 1)}
+            self._callback(hwaddr, timing)
+
+    def _addPending(self, hwaddr, pending):
+        self._pending.pop(hwaddr, None)
+        self._pending[hwaddr] = pending
+        if len(self._pending) > self._max_pending:
+            self._pending.popitem(last = False)
+
+
+class DhcpPacketCapture:
+    """
+    Capture of DHCP messages on network interface ifname, from a background thread
+    Each captured DHCP message is fed to a HandshakeTracker that invokes callback(hwaddr, timing) for each completed handshake (see HandshakeTracker)
+    ring_frames is the number of frames of the receive ring shared with the kernel. If the ring cannot be set up, we fall back to reading packets one by one
+    If provided, logger should be thread-safe (eg a DeferredLogger)
+    """
+
+    FRAME_SIZE = 2048
+    FRAMES_PER_BLOCK = 32
+    POLL_INTERVAL = 0.5 # Maximum duration (in s) between two checks that the capture should stop
+
+    def __init__(self, ifname, callback, ring_frames = 1024, logger = None):
+        self._ifname = ifname
+        self._tracker = HandshakeTracker(callback)
+        self._ring_frames = ring_frames - ring_frames % DhcpPacketCapture.FRAMES_PER_BLOCK or DhcpPacketCapture.FRAMES_PER_BLOCK
+        self._logger = logger
+        self._sock = None
+        self._ring = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.counters = {'captured': 0, 'dhcp': 0}
+
+    def start(self):
+        """
+        Open the capture socket and start capturing from a background thread
+        """
+        if not self._thread is None:
+            raise Exception('CaptureAlreadyStarted')
+        self._sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))   # Non-IPv4 frames are dropped by the BPF filter
+        try:
+            attach_bpf_filter(self._sock, DHCP_BPF_FILTER)
+            try:
+                self._setupRing()
+            except (IOError, OSError) as e:
+                self._log('warn', 'Could not set up packet capture ring on %s (%s), falling back to reading packets one by one', self._ifname, e)
+                self._ring = None
+            self._sock.bind((self._ifname, ETH_P_ALL))   # Python converts the protocol of AF_PACKET addresses to network byte order itself
+        except:
+            self._sock.close()
+            self._sock = None
+            raise
+        self._stop_event.clear()
+        self._thread = threading.Thread(target = self._captureRing if not self._ring is None else self._captureSocket)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop capturing and wait for the capture thread to terminate
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        if not self._ring is None:
+            self._ring.close()
+            self._ring = None
+        self._sock.close()
+        self._sock = None
+
+    def _log(self, level, fmt, *args):
+        if not self._logger is None:
+            getattr(self._logger, level)(fmt, *args)
+
+    def _setupRing(self):
+        self._sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V2)
+        block_size = DhcpPacketCapture.FRAME_SIZE * DhcpPacketCapture.FRAMES_PER_BLOCK
+        block_nr = self._ring_frames // DhcpPacketCapture.FRAMES_PER_BLOCK
+        self._sock.setsockopt(SOL_PACKET, PACKET_RX_RING, struct.pack('IIII', block_size, block_nr, DhcpPacketCapture.FRAME_SIZE, self._ring_frames))
+        self._ring = mmap.mmap(self._sock.fileno(), block_size * block_nr, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+    def _captureRing(self):
+        """
+        This method should be run within a thread... It reads frames from the receive ring until stop() is called
+        """
+        frame = 0
+        while not self._stop_event.is_set():
+            offset = frame * DhcpPacketCapture.FRAME_SIZE
+            (status, length, snaplen, mac_offset, net_offset, sec, nsec) = TPACKET2_HEADER.unpack_from(self._ring, offset)
+            if not status & TP_STATUS_USER: # No more frame ready, wait for the kernel
+                select.select([self._sock], [], [], DhcpPacketCapture.POLL_INTERVAL)
+                continue
+            (family, protocol, ifindex, hatype, pkttype, halen) = SOCKADDR_LL.unpack_from(self._ring, offset + TPACKET2_HEADER_LENGTH)
+            if not (hatype == ARPHRD_LOOPBACK and pkttype == PACKET_OUTGOING): # On loopback, each packet is seen both outgoing and incoming
+                self._handleFrame(sec + nsec * 1e-9, self._ring[offset + mac_offset:offset + mac_offset + snaplen])
+            struct.pack_into('I', self._ring, offset, TP_STATUS_KERNEL)   # Give the frame back to the kernel
+            frame = (frame + 1) % self._ring_frames
+
+    def _captureSocket(self):
+        """
+        This method should be run within a thread... It reads packets from the socket until stop() is called
+        """
+        self._sock.settimeout(DhcpPacketCapture.POLL_INTERVAL)
+        while not self._stop_event.is_set():
+            try:
+                (data, address) = self._sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            if not (address[3] == ARPHRD_LOOPBACK and address[2] == PACKET_OUTGOING):
+                self._handleFrame(time.time(), data)
+
+    def _handleFrame(self, timestamp, frame):
+        self.counters['captured'] += 1
+        if len(frame) < ETH_HEADER_LENGTH + 20:
+            return
+        ip_header_length = (bytearray(frame[ETH_HEADER_LENGTH:ETH_HEADER_LENGTH + 1])[0] & 0xf) * 4
+        payload = frame[ETH_HEADER_LENGTH + ip_header_length + 8:]  # Skip the UDP header
+        try:
+            packet = DhcpPacket.DhcpPacket.parse(payload)
+        except (ValueError, struct.error):
+            return
+        self.counters['dhcp'] += 1
+        try:
+            self._tracker.process(timestamp, packet)
+        except Exception as e:
+            self._log('warn', 'Error while processing captured DHCP message: %s', e)
@@ -4,71 +4,423 @@
 from __future__ import print_function
 
 import os
+import errno
+import select
+import socket
+import struct
 
 import threading
-import atexit
-
-import gobject
-import dbus
-import dbus.mainloop.glib
+import collections
+import array
+import importlib
+import csv
+import json
+import sys
 
 import time
 import subprocess
 
-if __name__ != '__main__':
-    from robot.api import logger
-else:
+try:
+    from robot.api import logger   # When run as a standalone lease monitor, LeaseMonitor replaces this logger
+except ImportError: # RobotFramework is not installed (eg when this library is embedded in Python code), so log using Python's logging
+    import logging
+    logger = logging.getLogger('rfdhcpserverlib')
+
+gobject = None  # gobject and dbus modules are only imported when the dnsmasq backend is loaded (see _import_dbus())
+dbus = None
+
+DHCP_SERVER_BACKENDS = {}   # Registered DHCP server backends, as name: loader (see register_backend())
+_loaded_backends = {}   # Backends that have already been loaded, as name: (process_class, wrapper_class)
+BACKEND_LOAD_TIMES = {} # Time taken to load each backend (in seconds), as name: duration
+
+def register_backend(name, loader):
+    """
+    Register a DHCP server backend under name
+    loader is a callable without argument that will only be invoked when this backend is first used. It should import the backend dependencies and return a tuple (process_class, wrapper_class) where:
+    - process_class is instantiated as process_class(dhcp_server_daemon_exec_path, ifname, logger = logger) and runs the DHCP server (see SlaveDhcpServerProcess)
+    - wrapper_class is instantiated as wrapper_class(ifname, coalesce_window = window, profiler = profiler) and monitors the leases of this DHCP server (see DnsmasqDhcpServerWrapper)
+    """
+    DHCP_SERVER_BACKENDS[name] = loader
+    _loaded_backends.pop(name, None)
+
+def load_backend(name):
+    """
+    Load (if not done yet) the DHCP server backend registered under name and return its tuple (process_class, wrapper_class)
+    """
     try:
-        from console_logger import LOGGER as logger
-    except ImportError:
-        import logging
+        return _loaded_backends[name]
+    except KeyError:
+        pass
+    try:
+        loader = DHCP_SERVER_BACKENDS[name]
+    except KeyError:
+        raise Exception('UnknownBackend ' + str(name))
+    load_start = time.time()
+    backend = loader()
+    BACKEND_LOAD_TIMES[name] = time.time() - load_start
+    _loaded_backends[name] = backend
+    return backend
 
-        logger = logging.getLogger('console_logger')
-        logger.setLevel(logging.DEBUG)
-        
-        handler = logging.StreamHandler()
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        logger.addHandler(handler)
+def _import_dbus():
+    """
+    Import the gobject and dbus modules, and set Glib's mainloop as the default loop for D-Bus
+    This is only done once, when the dnsmasq backend is first used, so that importing this library (eg for dry-runs or libdoc) does not require dbus-python
+    """
+    global gobject, dbus
+    if dbus is not None:
+        return
+    import gobject
+    import dbus
+    import dbus.mainloop.glib
+    
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)    # Use Glib's mainloop as the default loop for all subsequent code
+
+def _load_dnsmasq_backend():
+    """
+    Loader for the dnsmasq backend (see register_backend())
+    """
+    _import_dbus()
+    return (SlaveDhcpServerProcess, DnsmasqDhcpServerWrapper)
+
+AsyncioDhcpServer = None   # The AsyncioDhcpServer module is only imported when the asyncio backend is loaded (see _load_asyncio_backend())
+
+def _import_submodule(name):
+    """
+    Import and return the module name from the rfdhcpserverlib package
+    """
+    try:
+        return importlib.import_module('rfdhcpserverlib.' + name)
+    except ImportError: # When run as standalone, we are not imported as part of the rfdhcpserverlib package
+        return importlib.import_module(name)
+
+def _load_asyncio_backend():
+    """
+    Loader for the asyncio (embedded DHCP server) backend (see register_backend())
+    """
+    global AsyncioDhcpServer
+    AsyncioDhcpServer = _import_submodule('AsyncioDhcpServer')
+    return (EmbeddedDhcpServerProcess, EmbeddedDhcpServerWrapper)
 
-client = None
+def parse_lease_time(lease_time):
+    """
+    Convert a lease duration in dnsmasq syntax (eg: 120, 45m, 1h, 2d, 1w or infinite) into a number of seconds (or None for infinite)
+    """
+    lease_time = str(lease_time).strip().lower()
+    if lease_time == 'infinite':
+        return None
+    multipliers = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    if lease_time and lease_time[-1] in multipliers:
+        return int(lease_time[:-1]) * multipliers[lease_time[-1]]
+    return int(lease_time)
+
+def ipv4_to_int(ipaddr):
+    """
+    Convert a dotted IPv4 address string into an integer (so that address ranges can be compared without parsing)
+    """
+    return struct.unpack('!I', socket.inet_aton(ipaddr))[0]
 
-# This cleanup handler is not used when this library is imported in RF, only when run as standalone
-if __name__ == '__main__':
-    def cleanupAtExit():
+DEFER_HANDLER_LOGS = True  # Messages logged from the event threads are queued and sent from the main thread, as RobotFramework requires (the standalone lease monitor disables this)
+
+class DeferredLogger:
+    """
+    This class queues log messages emitted from a background thread (typically the D-Bus loop thread), so that they are sent to the real logger later on, from the main thread
+    RobotFramework indeed drops or misattributes messages logged from threads other than the main thread
+    Queuing a message is lock-free (collections.deque.append() is atomic) and formatting the message is deferred until the queue is drained
+    If immediate is set to True, messages are sent directly to the real logger (this is useful when the real logger is thread-safe, eg when run as standalone)
+    """
+    def __init__(self, logger, summary_threshold = 100, immediate = False):
+        self._logger = logger
+        self._queue = collections.deque()
+        self.summary_threshold = summary_threshold  # When draining more than this number of lease events, they will be summarized instead of logged one by one (None disables summaries)
+        self.immediate = immediate
+    
+    def log(self, level, fmt, *args):
         """
-        Called when this program is terminated, to perform the same cleanup as expected in Teardown when run within Robotframework
+        Queue a log message at the specified level ('debug', 'info' or 'warn'), that will be computed as fmt % args when drained
         """
+        if self.immediate:
+            getattr(self._logger, level)(fmt % args)
+        else:
+            self._queue.append((level, fmt, args))
+    
+    def debug(self, fmt, *args):
+        self.log('debug', fmt, *args)
+    
+    def info(self, fmt, *args):
+        self.log('info', fmt, *args)
+    
+    def warn(self, fmt, *args):
+        self.log('warn', fmt, *args)
+    
+    def leaseEvent(self, level, signal, ipaddr, hwaddr):
+        """
+        Queue a message for a lease event (D-Bus signal) received for IP ipaddr and MAC hwaddr
+        Lease events can be summarized per signal when drained in large numbers
+        """
+        if self.immediate:
+            getattr(self._logger, level)('Got signal ' + signal + ' for IP=' + ipaddr + ', MAC=' + hwaddr)
+        else:
+            self._queue.append((level, None, (signal, ipaddr, hwaddr)))
+    
+    def drain(self):
+        """
+        Send all queued messages to the real logger
+        This must be invoked from the main thread
+        """
+        entries = []
+        try:
+            while True:
+                entries.append(self._queue.popleft())
+        except IndexError:  # Queue is now empty
+            pass
+        if not entries:
+            return
         
-        global client
-        
-        client.stop()
+        lease_events = [entry for entry in entries if entry[1] is None]
+        summarize = self.summary_threshold is not None and len(lease_events) > self.summary_threshold
+        for (level, fmt, args) in entries:
+            if fmt is not None:
+                getattr(self._logger, level)(fmt % args)
+            elif not summarize:
+                getattr(self._logger, level)('Got signal %s for IP=%s, MAC=%s' % args)
+        
+        if summarize:
+            macs_per_signal = collections.OrderedDict()
+            count_per_signal = {}
+            for (level, fmt, (signal, ipaddr, hwaddr)) in lease_events:
+                macs_per_signal.setdefault(signal, set()).add(hwaddr)
+                count_per_signal[signal] = count_per_signal.get(signal, 0) + 1
+            for signal in macs_per_signal:
+                self._logger.info('Got %d %s signal(s) for %d MAC(s)' % (count_per_signal[signal], signal, len(macs_per_signal[signal])))
 
 class DhcpServerLeaseList:
     """
     This class stores the information of all leases as published by the DHCP server
     """
-    def __init__(self):
+    def __init__(self, logger = None):
+        self._logger = logger   # Logger to use for warnings (this can be a DeferredLogger if the database is updated from a background thread)
         self.leases_dict_mutex = threading.Lock()    # This mutex protects writes to the leases_list attribute
+        self.leases_changed = threading.Condition(self.leases_dict_mutex)  # Notified each time leases are added, changed or deleted (see waitFor())
+        self._pool_ranges = ()  # Address pool of the DHCP server, as a tuple of (first, last, base) integers where base is the index of first in the occupancy map (see setPool())
+        self.pool_size = 0
         self.reset()
         
     def reset(self):
         """
         Reset the database to empty
         """
-        self.leases_dict = {}
+        with self.leases_dict_mutex:
+            self.leases_dict = {}
+            self.renewal_time_dict = {} # Last time (as returned by time.time()) at which each hw_address has been allocated or has renewed its lease
+            self.synced_hw_addresses = set()    # hw_address entries installed by replaceLeases() and not renewed since, whose renewal time is the time of the sync rather than of their allocation (see renewLease())
+            self.handshake_timing_dict = {} # Timings of the last DHCP handshakes captured for each hw_address, as hw_address: {kind: timing} (see DhcpPacketCapture.HandshakeTracker)
+            self.renewal_stats_dict = {}    # Streaming statistics on the intervals between two renewals of each hw_address, as hw_address: [count, mean, m2, min, max] (see _recordRenewalInterval())
+            self._occupancy = self._newOccupancyMap()   # Occupancy map of the pool, holding the number of hw_address entries bound to each pool address
+            self.pool_used = 0  # Number of pool addresses bound to at least one hw_address
     
     def addLease(self, ipv4_address, hw_address):
         """
         Add a new entry in the database with ipv4_address allocated to entry hw_address
         """
         with self.leases_dict_mutex:
-            self.leases_dict[hw_address] = ipv4_address
+            self._rebind(hw_address, ipv4_address)
+            self.renewal_time_dict[hw_address] = time.time()
+            self.synced_hw_addresses.discard(hw_address)
+            self.leases_changed.notify_all()
+    
+    def addLeases(self, leases):
+        """
+        Add (or update) several entries in the database at once, while taking the mutex only once
+        leases is an iterable of (hw_address, ipv4_address) tuples
+        """
+        now = time.time()
+        with self.leases_dict_mutex:
+            for (hw_address, ipv4_address) in leases:
+                self._rebind(hw_address, ipv4_address)
+                self.renewal_time_dict[hw_address] = now
+                self.synced_hw_addresses.discard(hw_address)
+            self.leases_changed.notify_all()
+    
+    def replaceLeases(self, leases):
+        """
+        Replace the whole content of the database by leases at once (readers either see the previous content or the new one)
+        leases is an iterable of (hw_address, ipv4_address) tuples
+        Renewal time and renewal statistics are kept for the entries whose binding is unchanged
+        The other entries get the current time as renewal time, but as their allocation time is unknown, their next renewal does not count as an interval in the renewal statistics
+        """
+        now = time.time()
+        with self.leases_dict_mutex:
+            leases_dict = {}
+            renewal_time_dict = {}
+            synced_hw_addresses = set()
+            for (hw_address, ipv4_address) in leases:
+                leases_dict[hw_address] = ipv4_address
+                if self.leases_dict.get(hw_address) == ipv4_address and hw_address in self.renewal_time_dict:
+                    renewal_time_dict[hw_address] = self.renewal_time_dict[hw_address]
+                    if hw_address in self.synced_hw_addresses:
+                        synced_hw_addresses.add(hw_address)
+                else:
+                    renewal_time_dict[hw_address] = now
+                    synced_hw_addresses.add(hw_address)
+            self.renewal_stats_dict = dict((hw_address, stats) for (hw_address, stats) in self.renewal_stats_dict.items() if hw_address in leases_dict and leases_dict[hw_address] == self.leases_dict.get(hw_address))
+            self.leases_dict = leases_dict
+            self.renewal_time_dict = renewal_time_dict
+            self.synced_hw_addresses = synced_hw_addresses
+            self._rebuildOccupancy()
+            self.leases_changed.notify_all()
+    
+    def setPool(self, ranges):
+        """
+        Set the address pool of the DHCP server, whose occupancy is tracked by the database
+        ranges is a list of (first, last) IPv4 addresses as integers (see ipv4_to_int())
+        """
+        pool_ranges = []
+        pool_size = 0
+        for (first, last) in ranges:
+            pool_ranges.append((first, last, pool_size))
+            pool_size += last - first + 1
+        with self.leases_dict_mutex:
+            self._pool_ranges = tuple(pool_ranges)
+            self.pool_size = pool_size
+            self._rebuildOccupancy()
+            self.leases_changed.notify_all()
+    
+    def _poolIndex(self, ipv4_address):
+        """
+        Get the index of ipv4_address in the occupancy map, or None if this address is not in the pool
+        """
+        if not self._pool_ranges:
+            return None
+        try:
+            address = ipv4_to_int(ipv4_address)
+        except (socket.error, ValueError):
+            return None
+        for (first, last, base) in self._pool_ranges:
+            if first <= address <= last:
+                return base + address - first
+        return None
+    
+    def _occupy(self, ipv4_address, delta):
+        """
+        Add delta (1 or -1) to the number of entries bound to ipv4_address in the occupancy map, and update the number of pool addresses used accordingly
+        This must be invoked with the mutex held
+        """
+        index = self._poolIndex(ipv4_address)
+        if index is None:
+            return
+        holders = self._occupancy[index]
+        if delta > 0:
+            if holders == 0:
+                self.pool_used += 1
+            self._occupancy[index] = holders + 1
+        elif holders > 0:
+            self._occupancy[index] = holders - 1
+            if holders == 1:
+                self.pool_used -= 1
+    
+    def _rebind(self, hw_address, ipv4_address):
+        """
+        Bind hw_address to ipv4_address, updating the occupancy map
+        This must be invoked with the mutex held
+        """
+        previous = self.leases_dict.get(hw_address)
+        if previous != ipv4_address:
+            if not previous is None:
+                self._occupy(previous, -1)
+            self._occupy(ipv4_address, 1)
+        self.leases_dict[hw_address] = ipv4_address
+    
+    def _newOccupancyMap(self):
+        """
+        Build an empty occupancy map for the pool
+        Counters are unsigned longs (at least 32 bits): several entries can be bound to the same address (eg when the deletion of a stale entry has been missed), and their number is only bounded by the size of the database, so a counter must never saturate (otherwise decrementing it would free the address too early)
+        """
+        return array.array('L', [0]) * self.pool_size
+    
+    def _rebuildOccupancy(self):
+        """
+        Recompute the occupancy map from scratch
+        This must be invoked with the mutex held
+        """
+        self._occupancy = self._newOccupancyMap()
+        self.pool_used = 0
+        for ipv4_address in self.leases_dict.values():
+            self._occupy(ipv4_address, 1)
+    
+    def waitFor(self, predicate, timeout):
+        """
+        Wait until predicate (a callable without argument, that is invoked with the mutex held) returns True, or until timeout seconds have elapsed
+        predicate is only evaluated again when leases are added, changed or deleted (there is no polling)
+        Returns the last value returned by predicate
+        """
+        deadline = time.time() + timeout
+        with self.leases_changed:
+            while True:
+                result = predicate()
+                if result:
+                    return result
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return result
+                self.leases_changed.wait(remaining)
+    
+    def get_pool_occupancy(self):
+        """
+        Get a snapshot of the lease counters as a dict with keys 'leases' (number of entries in the database), 'pool_size', 'used' and 'free' (number of pool addresses bound or not to an entry) and 'utilisation' (percentage of the pool used, or None if there is no pool)
+        """
+        with self.leases_dict_mutex:
+            leases = len(self.leases_dict)
+            pool_size = self.pool_size
+            used = self.pool_used
+        if pool_size:
+            utilisation = 100.0 * used / pool_size
+        else:
+            utilisation = None
+        return {'leases': leases, 'pool_size': pool_size, 'used': used, 'free': pool_size - used, 'utilisation': utilisation}
+    
+    def renewLease(self, ipv4_address, hw_address):
+        """
+        Refresh the renewal time of hw_address if it is already bound to ipv4_address in the database
+        Returns True if the binding was unchanged (and the renewal time has been refreshed), False otherwise (the database is then left untouched)
+        This does not take the mutex: when the binding is unchanged, only the renewal time is written, and a single dict item assignment is atomic
+        """
+        if self.leases_dict.get(hw_address) != ipv4_address:
+            return False
+        now = time.time()
+        previous = self.renewal_time_dict.get(hw_address)
+        self.renewal_time_dict[hw_address] = now
+        if hw_address in self.synced_hw_addresses:
+            self.synced_hw_addresses.discard(hw_address)    # previous is the time at which the lease has been synced, not allocated, so this renewal only starts the first interval
+        elif previous is not None:
+            self._recordRenewalInterval(hw_address, now - previous)
+        return True
+    
+    def _recordRenewalInterval(self, hw_address, interval):
+        """
+        Add interval (the time in seconds since the previous renewal of hw_address) to the renewal statistics of hw_address
+        Mean and variance are updated incrementally using Welford's algorithm, so that memory usage does not grow with the number of renewals
+        This is only invoked from the event thread, so statistics are updated without taking the mutex
+        """
+        stats = self.renewal_stats_dict.get(hw_address)
+        if stats is None:
+            self.renewal_stats_dict[hw_address] = [1, interval, 0.0, interval, interval]
+            return
+        stats[0] += 1
+        delta = interval - stats[1]
+        stats[1] += delta / stats[0]
+        stats[2] += delta * (interval - stats[1])
+        stats[3] = min(stats[3], interval)
+        stats[4] = max(stats[4], interval)
     
     def updateLease(self, ipv4_address, hw_address):
         """
         Update an existing entry in the database with ipv4_address allocated to entry hw_address
+        Returns True if the MAC to IP binding has changed, or False if this was a renewal of an unchanged binding (in which case only the renewal time is updated)
         """
+        if self.renewLease(ipv4_address, hw_address):
+            return False
         self.addLease(ipv4_address, hw_address)
+        return True
         
     def deleteLease(self, hw_address, raise_exceptions = False):
         """
@@ -77,12 +429,17 @@ class DhcpServerLeaseList:
         """
         try:
             with self.leases_dict_mutex:
-                del self.leases_dict[hw_address]
+                self.renewal_time_dict.pop(hw_address, None)
+                self.synced_hw_addresses.discard(hw_address)
+                self.renewal_stats_dict.pop(hw_address, None)
+                self._occupy(self.leases_dict.pop(hw_address), -1)
+                self.leases_changed.notify_all()
         except TypeError:
             if raise_exceptions:
                 raise
         except KeyError:
-            logger.warning('Entry for MAC address ' + hw_address + ' cannot be deleted because it does not exist (maybe database has been reset in the meantime)')
+            if self._logger is not None:
+                self._logger.warn('Entry for MAC address %s cannot be deleted because it does not exist (maybe database has been reset in the meantime)', hw_address)
     
     def get_ipv4address_for_hwaddress(self, hw_address):
         """
@@ -92,6 +449,56 @@ class DhcpServerLeaseList:
             return self.leases_dict[hw_address]
         except KeyError:
             return None
+    
+    def setHandshakeTiming(self, hw_address, timing):
+        """
+        Record the timing of the last handshake of hw_address (timing is a dict, see DhcpPacketCapture.HandshakeTracker)
+        """
+        self.handshake_timing_dict.setdefault(hw_address, {})[timing['kind']] = timing
+    
+    def get_handshake_timing_for_hwaddress(self, hw_address, kind):
+        """
+        Get the timing of the last handshake of kind kind ('dora', 'renew' or 'reboot') captured for hw_address, or None if there is none
+        """
+        return self.handshake_timing_dict.get(hw_address, {}).get(kind)
+    
+    def get_renewal_stats_for_hwaddress(self, hw_address):
+        """
+        Get the statistics on the intervals between renewals of hw_address (the first one starting at the allocation, or at the first renewal for leases installed by replaceLeases()), as a dict with keys 'count' (the number of renewals), 'mean', 'variance', 'min' and 'max' (intervals are in seconds), or None if hw_address has not renewed its lease yet
+        """
+        stats = self.renewal_stats_dict.get(hw_address)
+        if stats is None:
+            return None
+        (count, mean, m2, minimum, maximum) = stats   # Unpacking copies the values at once, even if the event thread is updating them
+        if count > 1:
+            variance = m2 / (count - 1)
+        else:
+            variance = 0.0
+        return {'count': count, 'mean': mean, 'variance': variance, 'min': minimum, 'max': maximum}
+    
+    def iter_leases(self, mac_prefix = None, ip_prefix = None, max_age = None):
+        """
+        Generator yielding (hw_address, ipv4_address, renewal_time) tuples for the leases in our database, sorted by hw_address
+        If mac_prefix (lowercase) or ip_prefix are provided, only leases whose hw_address or ipv4_address start with these prefixes are yielded
+        If max_age is provided, only leases allocated or renewed less than max_age seconds ago are yielded
+        Leases are read from a snapshot of the database, so that it can be updated while iterating
+        """
+        with self.leases_dict_mutex:
+            snapshot = list(self.leases_dict.items())
+        if max_age is not None:
+            oldest = time.time() - max_age
+        for (hw_address, ipv4_address) in sorted(snapshot):
+            if mac_prefix is not None and not hw_address.startswith(mac_prefix):
+                continue
+            if ip_prefix is not None and not ipv4_address.startswith(ip_prefix):
+                continue
+            renewal_time = self.renewal_time_dict.get(hw_address)
+            if max_age is not None and (renewal_time is None or renewal_time < oldest):
+                continue
+            yield (hw_address, ipv4_address, renewal_time)
+    
+    def __len__(self):
+        return len(self.leases_dict)
         
     def to_tuple_list(self):
         """
@@ -99,7 +506,402 @@ class DhcpServerLeaseList:
         """ 
         return self.leases_dict.items()
 
-class DnsmasqDhcpServerWrapper:
+class DhcpServerWrapper:
+    
+    """
+    DHCP server monitoring (backend independent part)
+    This class maintains a lease database from the lease events DhcpLeaseAdded, DhcpLeaseUpdated and DhcpLeaseDeleted (named after the D-Bus signals of dnsmasq) published by a DHCP server
+    Subclasses deliver these events by invoking the _handleDhcpLease*() methods from their event thread, and implement _scheduleCall() and exit()
+    """
+    
+    def __init__(self, ifname, coalesce_window = None, profiler = None):
+        """
+        Instantiate a new DhcpServerWrapper object with an empty lease database
+        If coalesce_window is provided (in seconds), DhcpLeaseUpdated events that change a MAC to IP binding are batched during this delay and published to the lease database at once
+        If profiler is provided (see KeywordProfiler), the duration of each lease event delivered by the DHCP server is recorded (see _entryPoint())
+        """
+        self.handler_log = DeferredLogger(logger, immediate = not DEFER_HANDLER_LOGS)   # Logger for all messages emitted from the event thread, to be drained from the main thread using self.handler_log.drain()
+        self._lease_database = DhcpServerLeaseList(logger = self.handler_log)
+        self._coalesce_window = coalesce_window
+        self._coalesced_updates = {}    # Pending (not yet published) bindings, as hwaddr: [ipaddr, number of DhcpLeaseUpdated signals merged into this binding], when coalescing is enabled
+        self._coalesce_flush_scheduled = False  # Whether a flush is scheduled on the event thread (this is only reset by this scheduled flush, see _coalesceWindowExpired())
+        self._update_counters = {'received': 0,     # Total number of DhcpLeaseUpdated signals handled
+                                 'deduplicated': 0, # Signals for which the MAC to IP binding was unchanged (only the renewal time was updated)
+                                 'coalesced': 0,    # Signals superseded by a later signal for the same MAC address before being published to the database
+                                 'published': 0}    # Number of coalesced batches published to the database
+        self._coalesced_updates_mutex = threading.Lock()    # This mutex protects the 3 attributes above (they are also accessed from the main thread when flushing or reading the counters)
+        self._ifname = ifname
+        
+        self.owner_changed_callback = None  # If not None, this callable is invoked (from the event thread) with a boolean argument telling whether the DHCP server is reachable, each time this changes
+        self._watched_macaddr = None    # The MAC address on which we are currently waiting for a lease to be allocated (or renewed)
+        self.watched_macaddr_got_lease_event = threading.Event() # At initialisation, event is cleared
+        self.lease_listeners = []   # Callables invoked (from the event thread) as listener(ipaddr, hwaddr) each time a lease allocation or renewal has been recorded in the database
+        self._served_ranges = None  # IPv4 address ranges served by the DHCP server, as a tuple of (first, last) integers (see setServedRanges()), or None to accept leases for any address
+        self._filtered_counters = {'DhcpLeaseAdded': 0, 'DhcpLeaseUpdated': 0, 'DhcpLeaseDeleted': 0}  # Number of lease events dropped because their address is outside of the served ranges
+        self._sync_backlog = collections.deque()    # Lease events received while the database is being synchronised with the DHCP server (see syncLeases()), or None once synchronised
+        self.synced_event = threading.Event()   # Set when the database has been synchronised with the DHCP server
+        self._profiler = profiler
+        
+    def reset(self):
+        """
+        Reset the internal database of leases
+        """
+        
+        with self._coalesced_updates_mutex:
+            self._coalesced_updates = {}    # Pending coalesced updates are discarded as well
+        self._lease_database.reset()   # Empty internal database
+
+    def exit(self):
+        """
+        Stop receiving lease events
+        """
+        raise NotImplementedError()
+    
+    def _scheduleCall(self, delay, callback):
+        """
+        Run callback (without argument) from the event thread after delay seconds
+        """
+        raise NotImplementedError()
+    
+    def _entryPoint(self, handler):
+        """
+        Returns the callable that subclasses should hand over to the event source (eg connect to a D-Bus signal) for handler, one of the _handleDhcpLease*() methods
+        When profiling, the calls made through this callable are timed. Calls made internally (eg when replaying the events queued during a sync) are not, so that each event is only accounted once
+        """
+        if self._profiler is None:
+            return handler
+        return self._profiler.wrap('handler', self.__class__.__name__ + '.' + handler.__name__, handler)
+    
+    def setServedRanges(self, ranges):
+        """
+        Only accept lease events for addresses within ranges (the address ranges served by our DHCP server), and drop events concerning other addresses (eg published by another dnsmasq instance running on the same D-Bus)
+        ranges is a list of (first, last) dotted IPv4 addresses, or None to accept all events
+        The occupancy of these ranges is tracked by the lease database (see getPoolOccupancy())
+        """
+        if ranges is None:
+            self._served_ranges = None
+            self._lease_database.setPool(())
+        else:
+            self._served_ranges = tuple((ipv4_to_int(first), ipv4_to_int(last)) for (first, last) in ranges)
+            self._lease_database.setPool(self._served_ranges)
+    
+    def _isServedAddress(self, ipaddr):
+        """
+        Is ipaddr within the address ranges served by our DHCP server (see setServedRanges())
+        This only performs integer comparisons against the precomputed ranges, so that foreign events can be dropped as early as possible
+        """
+        served_ranges = self._served_ranges
+        if served_ranges is None:
+            return True
+        try:
+            address = ipv4_to_int(str(ipaddr))
+        except (socket.error, ValueError):  # Not an IPv4 address (eg a DHCPv6 lease)
+            return False
+        for (first, last) in served_ranges:
+            if first <= address <= last:
+                return True
+        return False
+    
+    def syncLeases(self, read_leases):
+        """
+        Synchronise the lease database with the DHCP server, without relying on the server to announce its leases again
+        read_leases is a callable without argument returning all current leases of the DHCP server as a list of (hwaddr, ipaddr) tuples (eg SlaveDhcpServerProcess.getLeases)
+        Lease events received from now on are queued. The leases read are then installed in the database at once from the event thread, and the queued events are replayed on top of them, so no event is lost between the read and the install
+        synced_event is set when this is done
+        If the leases cannot be read, the failure is logged and the exception is raised, but the queued events are replayed anyway (synced_event is not set)
+        This can be invoked from any thread
+        """
+        self.synced_event.clear()
+        if self._sync_backlog is None:
+            self._sync_backlog = collections.deque()
+        leases = None
+        try:
+            leases = read_leases()
+        except Exception as e:
+            self.handler_log.warn('Failed reading the leases of the DHCP server, lease database not synced: %s', e)
+            raise
+        finally:    # Whatever happens, we must stop queueing events
+            try:
+                self._scheduleCall(0, lambda: self._installSyncedLeases(leases))
+            except Exception as e:
+                self.handler_log.warn('Failed scheduling the lease database sync: %s', e)
+                self._installSyncedLeases(None) # The event thread cannot be reached (eg the DHCP server is stopped), so replay the queued events from here rather than queueing events forever
+                raise
+    
+    def _installSyncedLeases(self, leases):
+        """
+        Install the leases read by syncLeases() into the database, then replay the lease events queued in the meantime
+        This is run from the event thread (see _scheduleCall()), so that no other event is handled during the switch
+        If leases is None, the database is left untouched and only the queued events are replayed
+        Returns False so that a gobject timeout is not rescheduled
+        """
+        backlog = self._sync_backlog
+        self._sync_backlog = None   # From now on, events are handled directly
+        if not leases is None:
+            leases = [(str(hwaddr).lower(), str(ipaddr)) for (hwaddr, ipaddr) in leases if self._isServedAddress(ipaddr)]
+            self._flushCoalescedUpdates()   # Pending coalesced updates are older than the leases read, which win
+            self._lease_database.replaceLeases(leases)
+        replayed = 0
+        if not backlog is None:
+            for (handler, ipaddr, hwaddr, hostname) in backlog:
+                handler(ipaddr, hwaddr, hostname)
+            replayed = len(backlog)
+        if not leases is None:
+            self.handler_log.info('Lease database synced with %d lease(s) (%d lease event(s) received during sync)', len(leases), replayed)
+            if not self._watched_macaddr is None and self._watched_macaddr in dict(leases):
+                self.watched_macaddr_got_lease_event.set()
+            self.synced_event.set()
+        return False
+    
+    def _queueDuringSync(self, handler, ipaddr, hwaddr, hostname):
+        """
+        Queue a lease event to be handled later by handler if the database is being synchronised (see syncLeases())
+        Returns True if the event has been queued, False if it should be handled now
+        """
+        backlog = self._sync_backlog
+        if backlog is None:
+            return False
+        backlog.append((handler, ipaddr, hwaddr, hostname))
+        return True
+    
+    def _handleDhcpLeaseAdded(self, ipaddr, hwaddr, hostname, **kwargs):
+        """
+        Callback method called when receiving the DhcpLeaseAdded event (D-Bus signal for dnsmasq) from the DHCP server
+        """
+        if not self._isServedAddress(ipaddr):
+            self._filtered_counters['DhcpLeaseAdded'] += 1
+            return
+        if self._queueDuringSync(self._handleDhcpLeaseAdded, ipaddr, hwaddr, hostname):
+            return
+        # Note: ipaddr and hwaddr are of type dbus.String, so convert them to python native str
+        ipaddr = str(ipaddr)
+        hwaddr = str(hwaddr).lower()
+        self.handler_log.leaseEvent('info', 'DhcpLeaseAdded', ipaddr, hwaddr)
+        self._dropCoalescedUpdate(hwaddr)
+        self._lease_database.addLease(ipaddr, hwaddr)
+        for listener in self.lease_listeners:
+            listener(ipaddr, hwaddr)
+        if not self._watched_macaddr is None:    # We are currently waiting for a lease to be allocated (or renewed) on a specific MAC address
+            if self._watched_macaddr == hwaddr:   # Both MAC addresses match, so trigger the corresponding event
+                self.watched_macaddr_got_lease_event.set()
+          
+    def _handleDhcpLeaseUpdated(self, ipaddr, hwaddr, hostname, **kwargs):
+        """
+        Callback method called when receiving the DhcpLeaseUpdated event (D-Bus signal for dnsmasq) from the DHCP server
+        """
+        if not self._isServedAddress(ipaddr):
+            self._filtered_counters['DhcpLeaseUpdated'] += 1
+            return
+        if self._queueDuringSync(self._handleDhcpLeaseUpdated, ipaddr, hwaddr, hostname):
+            return
+        ipaddr = str(ipaddr)
+        hwaddr = str(hwaddr).lower()
+        # Note: ipaddr and hwaddr are of type dbus.String, so convert them to python native str
+        with self._coalesced_updates_mutex:
+            self._update_counters['received'] += 1
+        if self._coalesce_window is None:
+            if self._lease_database.updateLease(ipaddr, hwaddr):
+                self.handler_log.leaseEvent('debug', 'DhcpLeaseUpdated', ipaddr, hwaddr)
+            else:
+                with self._coalesced_updates_mutex:
+                    self._update_counters['deduplicated'] += 1
+            for listener in self.lease_listeners:
+                listener(ipaddr, hwaddr)
+        else:
+            self._coalesceLeaseUpdate(ipaddr, hwaddr)
+        if not self._watched_macaddr is None:    # We are currently waiting for a lease to be allocated (or renewed) on a specific MAC address
+            if self._watched_macaddr == hwaddr:   # Both MAC addresses match, so trigger the corresponding event
+                self._flushCoalescedUpdates()   # Make sure the database is up to date before the waiter is woken up
+                self.watched_macaddr_got_lease_event.set()
+    
+    def _coalesceLeaseUpdate(self, ipaddr, hwaddr):
+        """
+        Queue a MAC to IP binding received in a DhcpLeaseUpdated signal, to be published to the database when the coalescing window expires
+        Renewals of an unchanged binding are not queued, only their renewal time is updated
+        """
+        with self._coalesced_updates_mutex:
+            pending = self._coalesced_updates.get(hwaddr)
+            if pending is None:
+                if self._lease_database.renewLease(ipaddr, hwaddr):
+                    self._update_counters['deduplicated'] += 1
+                    for listener in self.lease_listeners:
+                        listener(ipaddr, hwaddr)
+                    return
+                self._coalesced_updates[hwaddr] = [ipaddr, 1]
+            else:   # A binding is already pending for this MAC, we must overwrite it, even if the database still holds the same IP address
+                pending[0] = ipaddr
+                pending[1] += 1
+            if not self._coalesce_flush_scheduled:
+                self._coalesce_flush_scheduled = True
+                self._scheduleCall(self._coalesce_window, self._coalesceWindowExpired)
+    
+    def _dropCoalescedUpdate(self, hwaddr):
+        """
+        Discard the pending coalesced binding of hwaddr (if any), because a newer DhcpLeaseAdded or DhcpLeaseDeleted event supersedes it
+        Otherwise, the next flush would overwrite the newer binding (or resurrect the deleted lease)
+        The signals merged into this binding are not accounted as coalesced, as they are never published
+        """
+        with self._coalesced_updates_mutex:
+            self._coalesced_updates.pop(hwaddr, None)
+    
+    def _coalesceWindowExpired(self):
+        """
+        Flush scheduled by _coalesceLeaseUpdate(), run from the event thread when the coalescing window expires
+        Only this scheduled flush allows a new one to be scheduled, so that at most one is pending at a time, even if the main thread flushes in the meantime
+        Returns False so that a gobject timeout is not rescheduled
+        """
+        with self._coalesced_updates_mutex:
+            self._coalesce_flush_scheduled = False
+        return self._flushCoalescedUpdates()
+    
+    def _flushCoalescedUpdates(self):
+        """
+        Publish all pending coalesced bindings to the database in one go
+        This is run from the event thread when the coalescing window expires (see _coalesceWindowExpired()), but can also be invoked from the main thread before reading the database
+        Returns False so that a gobject timeout is not rescheduled
+        """
+        with self._coalesced_updates_mutex:
+            if not self._coalesced_updates:
+                return False
+            pending = self._coalesced_updates
+            self._coalesced_updates = {}
+            events = sum(signals for (ipaddr, signals) in pending.values())
+            self._update_counters['coalesced'] += events - len(pending)
+            self._update_counters['published'] += 1
+        bindings = [(hwaddr, ipaddr) for (hwaddr, (ipaddr, signals)) in pending.items()]
+        self._lease_database.addLeases(bindings)
+        for listener in self.lease_listeners:
+            for (hwaddr, ipaddr) in bindings:
+                listener(ipaddr, hwaddr)
+        self.handler_log.debug('Published %d lease update(s) coalesced from %d DhcpLeaseUpdated signal(s)', len(bindings), events)
+        return False
+        
+    def _handleDhcpLeaseDeleted(self, ipaddr, hwaddr, hostname, **kwargs):
+        """
+        Method called when receiving the DhcpLeaseDeleted event (D-Bus signal for dnsmasq) from the DHCP server
+        """
+        if not self._isServedAddress(ipaddr):
+            self._filtered_counters['DhcpLeaseDeleted'] += 1
+            return
+        if self._queueDuringSync(self._handleDhcpLeaseDeleted, ipaddr, hwaddr, hostname):
+            return
+        ipaddr = str(ipaddr)
+        hwaddr = str(hwaddr).lower()
+        # Note: ipaddr and hwaddr are of type dbus.String, so convert them to python native str
+        self.handler_log.leaseEvent('info', 'DhcpLeaseDeleted', ipaddr, hwaddr)
+        self._dropCoalescedUpdate(hwaddr)
+        self._lease_database.deleteLease(hwaddr)
+        
+    def setMacAddrToWatch(self, mac):
+        """
+        Sets a MAC address to monitor.
+        When this MAC address has renews/gets a lease after this method has been called, self.watched_macaddr_got_lease_event threading event will be set  
+        """
+        self.watched_macaddr_got_lease_event.clear()    # Make sure the threading event is cleared (will be set in _handleDhcpLeaseAdded and _handleDhcpLeaseUpdated)
+        self._watched_macaddr = str(mac).lower()    # Store the expected MAC address in lowercase
+        
+    def getLeasesList(self):
+        """
+        Returns a list containing each lease object currently in our database as tuples containing:
+        - the MAC address as the first element
+        - the IPv4 address as the second element
+        """
+        self._flushCoalescedUpdates()
+        return self._lease_database.to_tuple_list()
+    
+    def iterLeases(self, mac_prefix = None, ip_prefix = None, max_age = None):
+        """
+        Returns an iterator on the leases currently in our database, as (hwaddr, ipaddr, renewal_time) tuples sorted by MAC address
+        Leases can be filtered by MAC address prefix (case insensitive), IP address prefix, and by maximum age in seconds (time since allocation or last renewal)
+        """
+        self._flushCoalescedUpdates()
+        if mac_prefix is not None:
+            mac_prefix = str(mac_prefix).lower()
+        return self._lease_database.iter_leases(mac_prefix = mac_prefix, ip_prefix = ip_prefix, max_age = max_age)
+    
+    def getLeasesCount(self):
+        """
+        Returns the number of leases currently in our database
+        """
+        self._flushCoalescedUpdates()
+        return len(self._lease_database)
+    
+    def recordHandshakeTiming(self, hwaddr, timing):
+        """
+        Record the timing of a DHCP handshake captured on the wire for hwaddr (see DhcpPacketCapture.HandshakeTracker)
+        """
+        self._lease_database.setHandshakeTiming(str(hwaddr).lower(), timing)
+    
+    def getHandshakeTiming(self, mac, kind = 'dora'):
+        """
+        Returns the timing of the last handshake of kind kind captured for the host whose MAC address matches the provided argument mac, or None if no such handshake has been captured
+        MAC address is case insensitive
+        """
+        return self._lease_database.get_handshake_timing_for_hwaddress(str(mac).lower(), kind)
+    
+    def getRenewalStatistics(self, mac):
+        """
+        Returns the statistics on the intervals between two renewals of the host whose MAC address matches the provided argument mac (see DhcpServerLeaseList.get_renewal_stats_for_hwaddress()), or None if this host has not renewed its lease yet
+        MAC address is case insensitive
+        """
+        return self._lease_database.get_renewal_stats_for_hwaddress(str(mac).lower())
+    
+    def getUpdateCounters(self):
+        """
+        Returns a copy of the counters related to DhcpLeaseUpdated signals, as a dict with keys:
+        - 'received': the number of DhcpLeaseUpdated signals handled
+        - 'deduplicated': the number of signals that renewed an unchanged MAC to IP binding
+        - 'coalesced': the number of signals superseded by a later signal for the same MAC address before being published to the database
+        - 'published': the number of coalesced batches published to the database
+        """
+        with self._coalesced_updates_mutex:
+            return dict(self._update_counters)
+    
+    def waitLeaseCount(self, count, timeout):
+        """
+        Wait until there are at least count leases in our database, or until timeout seconds have elapsed
+        Returns True if there are enough leases, False on timeout
+        """
+        self._flushCoalescedUpdates()
+        database = self._lease_database
+        return database.waitFor(lambda: len(database.leases_dict) >= count, timeout)
+    
+    def waitPoolUtilisation(self, percentage, timeout):
+        """
+        Wait until at least percentage % of the address pool is bound to a lease in our database, or until timeout seconds have elapsed
+        Returns True if the pool utilisation has been reached, False on timeout
+        """
+        self._flushCoalescedUpdates()
+        database = self._lease_database
+        if not database.pool_size:
+            raise Exception('NoPoolKnown')
+        needed = percentage * database.pool_size / 100.0
+        return database.waitFor(lambda: database.pool_used >= needed, timeout)
+    
+    def getPoolOccupancy(self):
+        """
+        Returns the lease counters and the occupancy of the address pool (see DhcpServerLeaseList.get_pool_occupancy())
+        """
+        self._flushCoalescedUpdates()
+        return self._lease_database.get_pool_occupancy()
+    
+    def getFilteredCounters(self):
+        """
+        Returns a copy of the number of lease events dropped because their address was outside of the served ranges (see setServedRanges()), as a dict with one key per event name (DhcpLeaseAdded, DhcpLeaseUpdated and DhcpLeaseDeleted)
+        """
+        return dict(self._filtered_counters)
+    
+    def getIpForMac(self, mac):
+        """
+        Returns the IP address allocated by the DHCP server to the host whose MAC address matches the provided argument mac
+        If this MAC address is unknown, will return None
+        MAC address is case insensitive
+        """
+        mac = str(mac).lower()
+        self._flushCoalescedUpdates()
+        return self._lease_database.get_ipv4address_for_hwaddress(mac)
+
+class DnsmasqDhcpServerWrapper(DhcpServerWrapper):
 
     """
     DHCP server monitoring
@@ -111,17 +913,16 @@ class DnsmasqDhcpServerWrapper:
     DNSMASQ_DBUS_SERVICE_INTERFACE = 'uk.org.thekelleys.dnsmasq'
     DNSMASQ_DEFAULT_PID_FILE = '/var/run/dnsmasq/dnsmasq.pid'   # Default value on Debian
     
-    def __init__(self, ifname):
+    def __init__(self, ifname, coalesce_window = None, profiler = None):
         """
         Instantiate a new DnsmasqDhcpServerWrapper object that observes a dnsmasq DHCP server via D-Bus
+        If coalesce_window is provided (in seconds), DhcpLeaseUpdated signals that change a MAC to IP binding are batched during this delay and published to the lease database at once
+        If profiler is provided (see KeywordProfiler), the duration of each call to the D-Bus signal handlers is recorded
         """
-        self._lease_database = DhcpServerLeaseList()
-        self._ifname = ifname   # We store the interface but dnsmasq does not provide information concerning the interface in its D-Bus announcements... so we cannot use it for now
-        # This also means that we can have only one instance of dnsmasq on the machine, or leases for all interfaces will mix in our database
+        _import_dbus()
+        DhcpServerWrapper.__init__(self, ifname, coalesce_window = coalesce_window, profiler = profiler)
+        # Note: dnsmasq does not provide information concerning the interface in its D-Bus announcements, so we can have only one instance of dnsmasq on the machine, or leases for all interfaces will mix in our database
         
-        self._watched_macaddr = None    # The MAC address on which we are currently waiting for a lease to be allocated (or renewed)
-        self.watched_macaddr_got_lease_event = threading.Event() # At initialisation, event is cleared 
-
         self._dbus_loop = gobject.MainLoop()
         self._bus = dbus.SystemBus()
         wait_bus_owner_timeout = 5  # Wait for 5s to have an owner for the bus name we are expecting
@@ -138,22 +939,23 @@ class DnsmasqDhcpServerWrapper:
         
         dbus_object_name = DnsmasqDhcpServerWrapper.DNSMASQ_DBUS_OBJECT_PATH
         logger.debug('Going to communicate with object ' + dbus_object_name)
-        self._dnsmasq_proxy = self._bus.get_object(DnsmasqDhcpServerWrapper.DNSMASQ_DBUS_SERVICE_INTERFACE, dbus_object_name)   # Required to attach to signals
+        # The proxy is required to attach to signals. It follows name owner changes, so that signals and method calls are bound to the well-known bus name instead of the unique name of the current dnsmasq instance (when the DHCP server is restarted, eg by the supervision, the new instance gets a new unique name)
+        self._dnsmasq_proxy = self._bus.get_object(DnsmasqDhcpServerWrapper.DNSMASQ_DBUS_SERVICE_INTERFACE, dbus_object_name, follow_name_owner_changes = True)
         self._dbus_iface = dbus.Interface(self._dnsmasq_proxy, DnsmasqDhcpServerWrapper.DNSMASQ_DBUS_SERVICE_INTERFACE) # Required to invoke methods
         
         logger.debug("Connected to D-Bus")
         self._dnsmasq_proxy.connect_to_signal("DhcpLeaseAdded",
-                                              self._handleDhcpLeaseAdded,
+                                              self._entryPoint(self._handleDhcpLeaseAdded),
                                               dbus_interface = DnsmasqDhcpServerWrapper.DNSMASQ_DBUS_SERVICE_INTERFACE,
                                               message_keyword='dbus_message')   # Handle the IpConfigApplied signal
 
         self._dnsmasq_proxy.connect_to_signal("DhcpLeaseUpdated",
-                                              self._handleDhcpLeaseUpdated,
+                                              self._entryPoint(self._handleDhcpLeaseUpdated),
                                               dbus_interface = DnsmasqDhcpServerWrapper.DNSMASQ_DBUS_SERVICE_INTERFACE,
                                               message_keyword='dbus_message')   # Handle the IpConfigApplied signal
 
         self._dnsmasq_proxy.connect_to_signal("DhcpLeaseDeleted",
-                                              self._handleDhcpLeaseDeleted,
+                                              self._entryPoint(self._handleDhcpLeaseDeleted),
                                               dbus_interface = DnsmasqDhcpServerWrapper.DNSMASQ_DBUS_SERVICE_INTERFACE,
                                               message_keyword='dbus_message')   # Handle the IpConfigApplied signal
         
@@ -177,13 +979,6 @@ class DnsmasqDhcpServerWrapper:
         self.reset()
 
         
-    def reset(self):
-        """
-        Reset the internal database of leases by sending a SIGHUP to dnsmasq
-        """
-        
-        self._lease_database.reset()   # Empty internal database
-
     def exit(self):
         """
         Terminate the D-Bus handlers and the D-Bus loop
@@ -196,15 +991,21 @@ class DnsmasqDhcpServerWrapper:
         
         self._dbus_loop = None
     
+    def _scheduleCall(self, delay, callback):
+        """
+        Run callback (without argument) from the D-Bus loop thread after delay seconds
+        """
+        gobject.timeout_add(int(delay * 1000), callback)
+    
     # D-Bus-related methods
     def _loopHandleDbus(self):
         """
         This method should be run within a thread... This thread's aim is to run the Glib's main loop while the main thread does other actions in the meantime
         This methods will loop infinitely to receive and send D-Bus messages and will only stop looping when the value of self._loopDbus is set to False (or when the Glib's main loop is stopped using .quit()) 
         """
-        logger.debug("Starting dbus mainloop")
+        self.handler_log.debug('Starting dbus mainloop')
         self._dbus_loop.run()
-        logger.debug("Stopping dbus mainloop")
+        self.handler_log.debug('Stopping dbus mainloop')
     
     def _getVersionUnlock(self, return_value):
         """
@@ -220,79 +1021,63 @@ class DnsmasqDhcpServerWrapper:
         This method is used as a callback for asynchronous D-Bus method call to GetVersion()
         It is run as an error_handler to raise an exception when the call to GetVersion() failed
         """
-        logger.warn('Error on invocation of GetVersion() to slave, via D-Bus')
+        self.handler_log.warn('Error on invocation of GetVersion() to slave, via D-Bus')
         raise Exception('ErrorOnDBusGetVersion')
         
-    def _handleDhcpLeaseAdded(self, ipaddr, hwaddr, hostname, **kwargs):
-        """
-        Callback method called when receiving the DhcpLeaseAdded D-Bus signal from dnsmasq
-        """
-        # Note: ipaddr and hwaddr are of type dbus.String, so convert them to python native str
-        ipaddr = str(ipaddr)
-        hwaddr = str(hwaddr).lower()
-        logger.info('Got signal DhcpLeaseAdded for IP=' + ipaddr + ', MAC=' + hwaddr)
-        self._lease_database.addLease(ipaddr, hwaddr)
-        if not self._watched_macaddr is None:    # We are currently waiting for a lease to be allocated (or renewed) on a specific MAC address
-            if self._watched_macaddr == hwaddr:   # Both MAC addresses match, so trigger the corresponding event
-                self.watched_macaddr_got_lease_event.set()
-          
-    def _handleDhcpLeaseUpdated(self, ipaddr, hwaddr, hostname, **kwargs):
-        """
-        Callback method called when receiving the DhcpLeaseUpdated D-Bus signal from dnsmasq
-        """
-        ipaddr = str(ipaddr)
-        hwaddr = str(hwaddr).lower()
-        # Note: ipaddr and hwaddr are of type dbus.String, so convert them to python native str
-        logger.debug('Got signal DhcpLeaseUpdated for IP=' + ipaddr + ', MAC=' + hwaddr)
-        self._lease_database.updateLease(ipaddr, hwaddr)
-        if not self._watched_macaddr is None:    # We are currently waiting for a lease to be allocated (or renewed) on a specific MAC address
-            if self._watched_macaddr == hwaddr:   # Both MAC addresses match, so trigger the corresponding event
-                self.watched_macaddr_got_lease_event.set()
-        
-    def _handleDhcpLeaseDeleted(self, ipaddr, hwaddr, hostname, **kwargs):
-        """
-        Method called when receiving the DhcpLeaseDeleted D-Bus signal from dnsmasq
-        """
-        ipaddr = str(ipaddr)
-        hwaddr = str(hwaddr).lower()
-        # Note: ipaddr and hwaddr are of type dbus.String, so convert them to python native str
-        logger.info('Got signal DhcpLeaseDeleted for IP=' + ipaddr + ', MAC=' + hwaddr)
-        self._lease_database.deleteLease(hwaddr)
-        
     def _handleBusOwnerChanged(self, new_owner):
         """
         Callback called when our D-Bus bus owner changes 
         """
         if new_owner == '':
-            logger.warn('No owner anymore for bus name ' + DnsmasqDhcpServerWrapper.DNSMASQ_DBUS_NAME)
-            raise Exception('LostDhcpSlave')
+            self.handler_log.warn('No owner anymore for bus name %s', DnsmasqDhcpServerWrapper.DNSMASQ_DBUS_NAME)
         else:
             pass # Owner exists
+        if not self.owner_changed_callback is None: # Notify the supervisor (if any) so that it can restart the slave DHCP server (raising an exception here would be lost inside the D-Bus loop)
+            self.owner_changed_callback(new_owner != '')
     
-    def setMacAddrToWatch(self, mac):
+
+class EmbeddedDhcpServerWrapper(DhcpServerWrapper):
+
+    """
+    DHCP server monitoring
+    This is based on an embedded DHCP server (see EmbeddedDhcpServerProcess) running in the current process. Lease events are received directly from the server thread
+    """
+    
+    def __init__(self, ifname, coalesce_window = None, profiler = None):
         """
-        Sets a MAC address to monitor.
-        When this MAC address has renews/gets a lease after this method has been called, self.watched_macaddr_got_lease_event threading event will be set  
+        Instantiate a new EmbeddedDhcpServerWrapper object that observes the embedded DHCP server running on ifname
+        If coalesce_window is provided (in seconds), DhcpLeaseUpdated events that change a MAC to IP binding are batched during this delay and published to the lease database at once
+        If profiler is provided (see KeywordProfiler), the duration of each call to the lease event handlers is recorded
         """
-        self.watched_macaddr_got_lease_event.clear()    # Make sure the threading event is cleared (will be set in _handleDhcpLeaseAdded and _handleDhcpLeaseUpdated)
-        self._watched_macaddr = str(mac).lower()    # Store the expected MAC address in lowercase
-        
-    def getLeasesList(self):
+        DhcpServerWrapper.__init__(self, ifname, coalesce_window = coalesce_window, profiler = profiler)
+        try:
+            self._server = EmbeddedDhcpServerProcess.RUNNING_SERVERS[ifname]
+        except KeyError:
+            raise Exception('No embedded DHCP server running on ' + str(ifname))
+        self._event_handlers = {'DhcpLeaseAdded': self._entryPoint(self._handleDhcpLeaseAdded),
+                                'DhcpLeaseUpdated': self._entryPoint(self._handleDhcpLeaseUpdated),
+                                'DhcpLeaseDeleted': self._entryPoint(self._handleDhcpLeaseDeleted)}
+        self._server.listeners.append(self._handleLeaseEvent)
+        self.reset()
+    
+    def exit(self):
         """
-        Returns a list containing each lease object currently in our database as tuples containing:
-        - the MAC address as the first element
-        - the IPv4 address as the second element
+        Stop receiving lease events from the embedded DHCP server
         """
-        return self._lease_database.to_tuple_list()
+        if self._handleLeaseEvent in self._server.listeners:
+            self._server.listeners.remove(self._handleLeaseEvent)
     
-    def getIpForMac(self, mac):
+    def _scheduleCall(self, delay, callback):
         """
-        Returns the IP address allocated by the DHCP server to the host whose MAC address matches the provided argument mac
-        If this MAC address is unknown, will return None
-        MAC address is case insensitive
+        Run callback (without argument) from the server thread after delay seconds
+        """
+        self._server.callLater(delay, callback)
+    
+    def _handleLeaseEvent(self, signal, ipaddr, hwaddr, hostname):
         """
-        mac = str(mac).lower()
-        return self._lease_database.get_ipv4address_for_hwaddress(mac)
+        Listener invoked by the embedded DHCP server (from its thread) for each lease event
+        """
+        self._event_handlers[signal](ipaddr, hwaddr, hostname)
     
     
 class SlaveDhcpServerProcess:
@@ -310,6 +1095,11 @@ class SlaveDhcpServerProcess:
     # This matches the PID file for Debian (this should thus be updated according to your distribution)
     # Having the same PID file as your distribution allows to make sure only one instance of dnsmasq runs on the host (between instances launched by system V and by RF during tests) 
     DNSMASQ_PIDFILE = '/var/run/dnsmasq/dnsmasq.pid'
+    # Private lease file, read in one go to synchronise the lease database (see getLeases())
+    DNSMASQ_LEASEFILE = '/var/run/dnsmasq/rfdhcpserverlib.leases'
+    # Range of IPv4 addresses allocated by dnsmasq
+    DEFAULT_POOL_START = '192.168.0.128'
+    DEFAULT_POOL_END = '192.168.0.254'
     
     def __init__(self, dhcp_server_daemon_exec_path, ifname, logger = None):
         self._slave_dhcp_server_path = dhcp_server_daemon_exec_path
@@ -329,9 +1119,10 @@ class SlaveDhcpServerProcess:
         else:
             self._lease_time = lease_time
     
-    def start(self):
+    def start(self, keep_leases = False):
         """
         Start the slave process
+        Leases left in the lease file by a previous slave process are discarded, unless keep_leases is True
         """
         if self.isRunning():
             raise Exception('DhcpServerAlreadyStarted')
@@ -368,19 +1159,19 @@ class SlaveDhcpServerProcess:
             cmd += ['-g', dnsmasq_group]
         
         cmd += ['--no-resolv']  # Do not use the host's /etc/resolv.conf
-        ipv4_dhcp_start_addr = '192.168.0.128'
-        ipv4_dhcp_end_addr = '192.168.0.254'
-        dhcp_range_arg = '--dhcp-range=' + 'interface:' + self._ifname + ',' + ipv4_dhcp_start_addr + ',' + ipv4_dhcp_end_addr
+        dhcp_range_arg = '--dhcp-range=' + 'interface:' + self._ifname + ',' + ','.join(self.getDhcpRanges()[0])
         if not self._lease_time is None:
             dhcp_range_arg += ',' + str(self._lease_time)
         cmd += [dhcp_range_arg]
         cmd += ['--port=0'] # We disable DNS (only allow DHCP)
         cmd += ['--dhcp-authoritative'] # We are the only DHCP server on this test subnet
         cmd += ['--log-dhcp']   # Log DHCP events to syslog
-        cmd += ['--leasefile-ro']   # Do not write to a lease file
+        cmd += ['--dhcp-leasefile=' + SlaveDhcpServerProcess.DNSMASQ_LEASEFILE]   # Use a private lease file (see getLeases())
         cmd += ['-C', '-']  # Read config from stdin
         cmd += ['-x', SlaveDhcpServerProcess.DNSMASQ_PIDFILE]
         
+        if not keep_leases:
+            subprocess.call(['sudo', 'rm', '-f', SlaveDhcpServerProcess.DNSMASQ_LEASEFILE])
         subprocess.check_call(cmd + ['--test'], stdin=open(os.devnull, 'rb'))    # Dry-run to check the config (stdin is EOFed in order for -C arg to read no additional config)
         # Note: the only option that we need to provide as a configuration file (here directly on stdin) is enable-dbus
         # This allows D-Bus signals to be sent out when leases are added/deleted
@@ -432,6 +1223,82 @@ class SlaveDhcpServerProcess:
         else:
             return True
     
+    def getPid(self):
+        """
+        Get the PID of the slave DHCP server process, or None if it has not been started
+        """
+        return self._slave_dhcp_server_pid
+    
+    def isSlaveAlive(self):
+        """
+        Is the slave DHCP server process still alive
+        Contrary to isRunning(), this also works when the slave process runs as another user (root)
+        """
+        if self._slave_dhcp_server_pid is None:
+            return False
+        try:
+            os.kill(self._slave_dhcp_server_pid, 0)
+        except OSError as e:
+            return e.errno == errno.EPERM   # The process exists but is not ours
+        return True
+    
+    def restart(self, logger = None, slave_dead = False):
+        """
+        Restart the slave process with the same arguments (eg after it has died unexpectedly)
+        If slave_dead is True, the caller knows that the slave process has terminated, so it is not killed (its PID may already have been reused by another process)
+        If logger is provided, messages are logged on it instead of the logger of this object (eg a DeferredLogger when restarting from a background thread, as the RobotFramework logger can only be used from the main thread)
+        """
+        main_logger = self._logger
+        if not logger is None:
+            self._logger = logger
+        try:
+            if slave_dead:
+                if self._logger is not None:
+                    self._logger.debug('Slave PID ' + str(self._slave_dhcp_server_pid) + ' has terminated, not killing it')
+                self._all_processes_pid = []
+                self._slave_dhcp_server_pid = None
+            else:
+                self.killSlavePids()
+            self.start(keep_leases = True)
+        finally:
+            self._logger = main_logger
+    
+    def getDhcpRanges(self):
+        """
+        Get the ranges of IPv4 addresses allocated by the slave DHCP server, as a list of (first, last) tuples
+        """
+        return [(SlaveDhcpServerProcess.DEFAULT_POOL_START, SlaveDhcpServerProcess.DEFAULT_POOL_END)]
+    
+    def getAckTime(self, hwaddr):
+        """
+        dnsmasq does not report when it sends its replies, so this always returns None
+        """
+        return None
+    
+    def getLeases(self):
+        """
+        Read all current leases of the slave DHCP server at once from its lease file
+        Returns a list of (hwaddr, ipaddr) tuples
+        """
+        try:
+            with open(SlaveDhcpServerProcess.DNSMASQ_LEASEFILE, 'r') as f:
+                content = f.read()
+        except IOError as e:
+            if e.errno == errno.ENOENT: # No lease file (yet)
+                return []
+            elif e.errno == errno.EACCES:   # The lease file is only readable by root
+                content = subprocess.check_output(['sudo', 'cat', SlaveDhcpServerProcess.DNSMASQ_LEASEFILE])
+                if not isinstance(content, str):
+                    content = content.decode('ascii', 'replace')
+            else:
+                raise
+        leases = []
+        for line in content.splitlines():
+            fields = line.split()   # Each IPv4 lease is: expiry hwaddr ipaddr hostname client-id
+            if len(fields) >= 3 and ':' in fields[1] and '.' in fields[2]:  # Skip IPv6 leases and the duid line
+                leases.append((fields[1].lower(), fields[2]))
+        return leases
+    
     def _sudoKillSubprocessFromPid(self, pid, log = True, force = False, timeout = 1):
         """
         Kill a process from it PID (first send a SIGINT)
@@ -508,6 +1375,255 @@ class SlaveDhcpServerProcess:
         return (not self._slave_dhcp_server_pid is None)
 
 
+class EmbeddedDhcpServerProcess:
+    """
+    Embedded DHCP server manipulation (asyncio backend)
+    This class exposes the same interface as SlaveDhcpServerProcess, but runs an AsyncioDhcpServer in a background thread of the current process, so no subprocess is needed
+    dhcp_server_daemon_exec_path is ignored
+    port, server_address, netmask, bind_address and bind_to_device are passed to the AsyncioDhcpServer. By default, bind_to_device is only enabled when serving on the standard DHCP server port
+    Note: serving on the standard DHCP server port (or binding to a device) requires the appropriate capabilities (CAP_NET_BIND_SERVICE and CAP_NET_RAW)
+    """
+    
+    DEFAULT_POOL_START = '192.168.0.128'
+    DEFAULT_POOL_END = '192.168.0.254'
+    DEFAULT_LEASE_TIME = '1h'   # Same default as dnsmasq
+    RUNNING_SERVERS = {}    # Servers currently running in this process, as ifname: AsyncioDhcpServer (EmbeddedDhcpServerWrapper attaches to these)
+    
+    def __init__(self, dhcp_server_daemon_exec_path, ifname, logger = None, port = 67, server_address = None, netmask = None, bind_address = '0.0.0.0', bind_to_device = None):
+        self._ifname = ifname
+        self._lease_time = None
+        self._port = int(port)
+        self._server_address = server_address
+        self._netmask = netmask
+        self._bind_address = bind_address
+        if bind_to_device is None:
+            bind_to_device = (self._port == 67)
+        self._bind_to_device = (str(bind_to_device).lower() not in ['false', '0', 'no', 'off'])
+        self.handler_log = DeferredLogger(logger, immediate = not DEFER_HANDLER_LOGS)   # Logger for messages emitted from the server thread
+        self._server = None
+    
+    def setLeaseTime(self, lease_time):
+        """
+        Specify the lease duration (in dnsmasq syntax)
+        This must be done prior to call start or we will raise an exception
+        """
+        if not self._server is None:
+            raise Exception('DhcpServerAlreadyStarted')
+        else:
+            self._lease_time = lease_time
+    
+    def start(self):
+        """
+        Start the embedded DHCP server
+        """
+        if self.isRunning():
+            raise Exception('DhcpServerAlreadyStarted')
+        if self._ifname in EmbeddedDhcpServerProcess.RUNNING_SERVERS:
+            raise Exception('DhcpPortAlreadyUsed')
+        lease_time = self._lease_time
+        if lease_time is None:
+            lease_time = EmbeddedDhcpServerProcess.DEFAULT_LEASE_TIME
+        server = AsyncioDhcpServer.AsyncioDhcpServer(self._ifname,
+                                                     EmbeddedDhcpServerProcess.DEFAULT_POOL_START,
+                                                     EmbeddedDhcpServerProcess.DEFAULT_POOL_END,
+                                                     lease_time = parse_lease_time(lease_time),
+                                                     server_address = self._server_address,
+                                                     netmask = self._netmask,
+                                                     port = self._port,
+                                                     bind_address = self._bind_address,
+                                                     bind_to_device = self._bind_to_device,
+                                                     logger = self.handler_log)
+        server.start()
+        self._server = server
+        EmbeddedDhcpServerProcess.RUNNING_SERVERS[self._ifname] = server
+    
+    def kill(self):
+        """
+        Stop the embedded DHCP server
+        """
+        if self._server is None:
+            return
+        if EmbeddedDhcpServerProcess.RUNNING_SERVERS.get(self._ifname) is self._server:
+            del EmbeddedDhcpServerProcess.RUNNING_SERVERS[self._ifname]
+        self._server.stop()
+        self._server = None
+    
+    def restart(self, logger = None, slave_dead = False):
+        """
+        Restart the embedded DHCP server with the same arguments (its leases are lost)
+        The same AsyncioDhcpServer object is restarted in place, so that the EmbeddedDhcpServerWrapper observing it keeps receiving its lease events
+        logger and slave_dead are ignored: the embedded server always logs on self.handler_log, and has no process to kill
+        """
+        if self._server is None:
+            self.start()
+            return
+        self._server.stop()
+        self._server.start()
+    
+    def getDhcpRanges(self):
+        """
+        Get the ranges of IPv4 addresses allocated by the embedded DHCP server, as a list of (first, last) tuples
+        """
+        return [(EmbeddedDhcpServerProcess.DEFAULT_POOL_START, EmbeddedDhcpServerProcess.DEFAULT_POOL_END)]
+    
+    def getLeases(self):
+        """
+        Get all current leases of the embedded DHCP server, as a list of (hwaddr, ipaddr) tuples
+        """
+        if self._server is None:
+            return []
+        return [(hwaddr, ipaddr) for (hwaddr, ipaddr, hostname) in self._server.getLeases()]
+    
+    def getAckTime(self, hwaddr):
+        """
+        Get the time (as returned by time.time()) at which the embedded DHCP server has sent its last DHCPACK to hwaddr, or None if hwaddr has no lease
+        """
+        if self._server is None:
+            return None
+        return self._server.getAckTime(hwaddr)
+    
+    def getPid(self):
+        """
+        There is no separate process for the embedded DHCP server, so this always returns None
+        """
+        return None
+    
+    def isSlaveAlive(self):
+        return self.isRunning()
+    
+    def isRunning(self):
+        return not self._server is None and self._server.isRunning()
+    
+    def hasBeenStarted(self):
+        return not self._server is None
+
+
+class SlaveDhcpServerSupervisor:
+    """
+    Slave DHCP server process supervision
+    This class runs a background thread that restarts the slave DHCP server process (with the same arguments) when it dies unexpectedly, and then invokes resync_callback to repopulate the lease database
+    The death of the slave process is detected via a pidfd when available (Linux with python 3.9+), by polling its PID otherwise, or when notifyOwnerChanged() reports that the DHCP server has lost its D-Bus name
+    If max_restarts is not None, we give up supervising after this number of restarts
+    All messages are logged on self.log, a DeferredLogger that must be drained from the main thread
+    """
+    
+    POLL_INTERVAL = 0.5 # Interval (in s) between two checks of the slave process when no pidfd is available (or between two restart attempts)
+    OWNER_WAIT_TIMEOUT = 5  # Maximum duration (in s) to wait for the restarted slave process to own its D-Bus name again
+    
+    def __init__(self, process, resync_callback = None, max_restarts = None, logger = None):
+        self._process = process
+        self._resync_callback = resync_callback
+        self._max_restarts = max_restarts
+        self.log = DeferredLogger(logger, immediate = not DEFER_HANDLER_LOGS)
+        self._stop_event = threading.Event()
+        self._wakeup_event = threading.Event()  # Set when the supervising thread should check the slave process (owner lost or stop requested)
+        self._owner_present_event = threading.Event()
+        self._owner_lost = False
+        self._metrics = {'restarts': 0,         # Number of successful restarts of the slave process
+                         'failed_restarts': 0,  # Number of restart attempts that raised an exception
+                         'downtime': 0.0,       # Total duration (in s) during which the slave process was down
+                         'last_downtime': None} # Duration (in s) of the last outage
+        self._thread = threading.Thread(target = self._supervise)
+        self._thread.setDaemon(True)    # Supervision should not prevent the main program from exiting
+        self._thread.start()
+    
+    def notifyOwnerChanged(self, has_owner):
+        """
+        Notify the supervisor that the D-Bus name of the DHCP server has (has_owner is True) or has not (has_owner is False) an owner anymore
+        This is meant to be used as DnsmasqDhcpServerWrapper.owner_changed_callback
+        """
+        if has_owner:
+            self._owner_lost = False
+            self._owner_present_event.set()
+        else:
+            self._owner_present_event.clear()
+            self._owner_lost = True
+            self._wakeup_event.set()
+    
+    def stop(self):
+        """
+        Stop supervising (this must be done before the slave process is killed on purpose)
+        """
+        self._stop_event.set()
+        self._wakeup_event.set()
+        self._owner_present_event.set() # Do not let the supervising thread wait for a D-Bus name owner anymore
+        self._thread.join()
+    
+    def getMetrics(self):
+        """
+        Returns a copy of the supervision metrics, as a dict with keys 'restarts', 'failed_restarts', 'downtime' (total, in s) and 'last_downtime' (in s)
+        """
+        return dict(self._metrics)
+    
+    def _waitForSlaveDeath(self):
+        """
+        Block until the slave process dies, loses its D-Bus name, or until supervision is stopped
+        Returns True if the slave process has been seen dead
+        """
+        pidfd = None
+        pid = self._process.getPid()
+        if not pid is None and hasattr(os, 'pidfd_open'):
+            try:
+                pidfd = os.pidfd_open(pid)
+            except OSError:
+                pidfd = None
+        try:
+            while not self._wakeup_event.is_set():
+                if pidfd is not None:
+                    (readable, _, _) = select.select([pidfd], [], [], SlaveDhcpServerSupervisor.POLL_INTERVAL)
+                    if readable:    # A pidfd becomes readable when the process terminates
+                        return True
+                else:
+                    if not self._process.isSlaveAlive():
+                        return True
+                    self._wakeup_event.wait(SlaveDhcpServerSupervisor.POLL_INTERVAL)
+        finally:
+            if pidfd is not None:
+                os.close(pidfd)
+        return not self._process.isSlaveAlive()
+    
+    def _supervise(self):
+        """
+        This method should be run within a thread... It restarts the slave process each time it dies, until supervision is stopped
+        """
+        while not self._stop_event.is_set():
+            slave_dead = self._waitForSlaveDeath()
+            if self._stop_event.is_set():
+                break
+            if not slave_dead:
+                if not self._owner_lost or self._owner_present_event.wait(SlaveDhcpServerSupervisor.OWNER_WAIT_TIMEOUT): # Spurious wakeup, or the slave process got its D-Bus name back (eg late notification concerning a previous instance)
+                    self._wakeup_event.clear()
+                    continue
+            down_since = time.time()
+            self.log.warn('Slave DHCP server (PID %s) is down', self._process.getPid())
+            while not self._stop_event.is_set():
+                if not self._max_restarts is None and self._metrics['restarts'] + self._metrics['failed_restarts'] >= self._max_restarts:
+                    self.log.warn('Giving up restarting slave DHCP server after %d attempt(s)', self._max_restarts)
+                    return
+                try:
+                    self._process.restart(logger = self.log, slave_dead = slave_dead)   # The RobotFramework logger cannot be used from this thread
+                    break
+                except Exception as e:
+                    self._metrics['failed_restarts'] += 1
+                    self.log.warn('Failed restarting slave DHCP server: %s', e)
+                    self._stop_event.wait(SlaveDhcpServerSupervisor.POLL_INTERVAL)
+            else:   # Supervision stopped while we were trying to restart
+                break
+            self._wakeup_event.clear()
+            if self._owner_lost:    # Make sure we don't take the loss of the previous instance's D-Bus name for a new failure
+                self._owner_present_event.wait(SlaveDhcpServerSupervisor.OWNER_WAIT_TIMEOUT)
+            downtime = time.time() - down_since
+            self._metrics['restarts'] += 1
+            self._metrics['downtime'] += downtime
+            self._metrics['last_downtime'] = downtime
+            self.log.info('Slave DHCP server restarted (PID %s) after %.3fs', self._process.getPid(), downtime)
+            if not self._resync_callback is None:
+                try:
+                    self._resync_callback()
+                except Exception as e:
+                    self.log.warn('Failed resynchronising leases after restart: %s', e)
+
+
 class DhcpServerLibrary:
     """ Robot Framework DHCP server Library
 
@@ -528,6 +1644,7 @@ class DhcpServerLibrary:
     - `Specifying environment to the library`
     - `Requirements for Setup/Teardown`
     - `Warning on dnsmasq concurrent execution`
+    - `DHCP server backends`
 
     = Requirement on the test machine =
     
@@ -594,6 +1711,25 @@ class DhcpServerLibrary:
     code only stores one instance of DHCP wrapper, and thus only one lease
     database  
     
+    = DHCP server backends =
+    
+    The DHCP server implementation is selected by the optional backend
+    argument when importing the library (dnsmasq is the default, and is
+    monitored via D-Bus).
+    The dependencies of a backend (eg dbus-python and gobject for dnsmasq)
+    are only imported when `Start` or `Restart Monitoring Server` is first
+    run, so importing the library (eg for dry-runs or libdoc) does not
+    require them.
+    The asyncio backend runs a pure-python DHCP server inside the
+    RobotFramework process (no sudo nor dnsmasq needed), and its lease events
+    are delivered directly to the lease database. Additional named arguments
+    when importing the library are passed to this backend (port, server_address,
+    netmask, bind_address and bind_to_device), eg to serve on a high UDP port
+    for tests:
+    | Library    DhcpServerLibrary    ${None}    backend=asyncio    port=6767    server_address=127.0.0.1
+    Additional backends can be registered using the register_backend()
+    function of this module.
+    
     = Troubleshooting =
     
     When starting dnsmasq, we first perform a --test dry-run of the config
@@ -627,17 +1763,68 @@ class DhcpServerLibrary:
     ROBOT_LIBRARY_VERSION = '1.0'
     LEASE_DURATION_MARGIN = float(10/100)   # The margin for a lease to expire (we allow the renew to be 10% late comparing to the normal lease expiry
 
-    def __init__(self, dhcp_server_daemon_exec_path, ifname = None):
+    CLIENT_SWARM_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DhcpClientSwarm.py')  # Run in a subprocess by Run Dhcp Client Swarm when the clients cannot run within this process
+    PROFILING_REPORT_FILE = 'dhcpserverlibrary-profile.txt'  # Name of the profiling report, written in RobotFramework's output directory (see profiling argument when importing the library)
+    
+    def __init__(self, dhcp_server_daemon_exec_path, ifname = None, backend = 'dnsmasq', profiling = False, profiling_sample_interval = None, **backend_options):
         """Initialise the library
         dhcp_server_daemon_exec_path is a PATH to the DHCP server executable program (will be run as root via sudo)
         ifname is the interface on which we are observing the DHCP server status. If not provided, it will be mandatory to set it using Set Interface and before (or when) running Start
-        """
+        backend is the name of the DHCP server backend to use. Its dependencies are only loaded when the DHCP server is first started or monitored
+        If profiling is True, the duration of each keyword, of each lease event handler and of each DHCP server process operation is measured, and a report is written next to output.xml when the library goes out of scope (see Get Profiling Report)
+        If profiling_sample_interval is also provided (in seconds), the Python stack of the lease event handlers is sampled at this interval, and the most frequent functions are added to the report
+        Any additional named argument is passed to the backend when starting the DHCP server (eg port=6767 for the asyncio backend)
+        """
+        if not backend in DHCP_SERVER_BACKENDS:
+            raise Exception('UnknownBackend ' + str(backend))
+        self._backend = backend
+        self._backend_options = backend_options
         self._dhcp_server_daemon_exec_path =  dhcp_server_daemon_exec_path
         self._ifname = ifname   # The interface on which we are currently observing the DHCP server (there could be several DHCP servers on several interfaces, but we are working on only one at a time, and it is kept in this variable)
         self._slave_dhcp_process = None # Slave DHCP server process not started
         self._dnsmasq_wrapper = None    # Underlying dnsmasq observer object
+        self.lease_listeners = []   # Callables invoked (from the event thread) as listener(ipaddr, hwaddr) each time a lease allocation or renewal is recorded in the lease database, kept when the monitoring is restarted (this is meant for Python code embedding this library, eg LeaseMonitor)
         self._lease_time = None
-        
+        self._coalesce_window = None    # Coalescing window for DhcpLeaseUpdated signals (None means no coalescing)
+        self._handler_log_summary_threshold = 100   # Above this number of lease events logged between two keywords, the events are summarized in the logs
+        self._supervision_enabled = False
+        self._supervision_max_restarts = None
+        self._supervisor = None # Supervisor of the slave DHCP server process (only when supervision is enabled)
+        self._last_supervision_metrics = None   # Metrics of the last supervisor, kept after Stop
+        self._capture = None    # Capture of DHCP handshakes on the wire (see Start Handshake Capture)
+        self._capture_log = DeferredLogger(logger, immediate = not DEFER_HANDLER_LOGS)  # Logger for messages emitted from the capture thread
+        self._profiler = None   # Profiler recording the durations of keywords and lease event handlers (only when profiling is enabled)
+        if str(profiling).lower() not in ['false', '0', 'no', 'off', 'none']:
+            self._enable_profiling(profiling_sample_interval)
+    
+    def _enable_profiling(self, sample_interval = None):
+        """
+        Private method wrapping all keywords of this instance with timers, and registering this instance as a RobotFramework listener so that the profiling report is written at the end of the execution
+        """
+        KeywordProfiler = _import_submodule('KeywordProfiler')
+        if not sample_interval is None:
+            sample_interval = float(sample_interval)
+        self._profiler = KeywordProfiler.KeywordProfiler(sample_interval = sample_interval)
+        for name in dir(self.__class__):   # Not type(self): on Python 2, this is an old-style class, whose instances all have type instance
+            if name.startswith('_') or name.isupper() or not callable(getattr(self, name)):
+                continue
+            keyword_name = ' '.join(word.capitalize() for word in name.split('_'))
+            setattr(self, name, self._profiler.wrap('keyword', keyword_name, getattr(self, name)))
+        self.ROBOT_LISTENER_API_VERSION = 2
+        self.ROBOT_LIBRARY_LISTENER = self
+    
+    def _close(self):
+        """
+        Listener method invoked by RobotFramework when this library goes out of scope (at the end of the execution), to write the profiling report
+        """
+        if self._profiler is None:
+            return
+        self._profiler.stop()
+        output_dir = self._get_robot_output_dir()
+        if output_dir is None:
+            output_dir = os.getcwd()
+        self._profiler.writeReport(os.path.join(output_dir, DhcpServerLibrary.PROFILING_REPORT_FILE))
+    
     def set_interface(self, ifname):
         """Set the current DHCP server interface on which we are working
         This must be done prior (or when) the Start keyword is called or subsequent actions will fail
@@ -660,6 +1847,17 @@ class DhcpServerLibrary:
         """
         
         return self._ifname
+    
+    def get_dhcp_server_settings(self):
+        """Get the settings of the DHCP server, as a dictionary with keys 'interface', 'backend' and 'lease_time' (as provided to Set Lease Time or Start, or None for the default lease time)
+        
+        Example:
+        | ${settings}= | Get Dhcp Server Settings |
+        =>
+        | {'interface': 'eth1', 'backend': 'dnsmasq', 'lease_time': '1h'} |
+        """
+        
+        return {'interface': self._ifname, 'backend': self._backend, 'lease_time': self._lease_time}
 
     def set_lease_time(self, lease_time='120'):
         """Set the lease duration of the DHCP server.
@@ -671,6 +1869,61 @@ class DhcpServerLibrary:
         | Set Lease Time | 1h |
         """
         self._lease_time = str(lease_time)
+    
+    def set_lease_update_coalescing(self, window = None):
+        """Batch lease renewals carrying a new MAC to IP binding, and publish them to the lease database at most once every window seconds
+        This reduces the load when many DHCP clients renew at the same time. Renewals that do not change the IP address are never batched (only their renewal time is updated)
+        Lease lookups (eg: Find IP For Mac, Wait Lease) always see pending batched updates
+        If window is not provided (or is 0), coalescing is disabled
+        This needs to be done before the lease monitoring is started (using Start or Restart Monitoring Server) or it will have no effect
+        
+        Example:
+        | Set Lease Update Coalescing | 0.5 |
+        """
+        if window is None or float(window) <= 0:
+            self._coalesce_window = None
+        else:
+            self._coalesce_window = float(window)
+    
+    def set_dhcp_server_supervision(self, enabled = True, max_restarts = None):
+        """Enable (or disable) supervision of the DHCP server
+        When supervision is enabled, if the DHCP server dies unexpectedly, it is automatically restarted with the same arguments (keeping its lease file), and the lease database is synced again from this lease file (see Wait Lease Database Synced).
+        The lease database is kept (so that keywords waiting for a lease keep waiting), and the lease events of the restarted DHCP server are received as before
+        If max_restarts is provided, we stop restarting the DHCP server after this number of attempts
+        This needs to be done before the DHCP server is started or it will have no effect
+        
+        Example:
+        | Set Dhcp Server Supervision | True | max_restarts=5 |
+        """
+        self._supervision_enabled = (str(enabled).lower() not in ['false', '0', 'no', 'off', 'none'])
+        if max_restarts is None:
+            self._supervision_max_restarts = None
+        else:
+            self._supervision_max_restarts = int(max_restarts)
+    
+    def get_dhcp_server_supervision_metrics(self):
+        """Get the metrics of the DHCP server supervision (see Set Dhcp Server Supervision) as a dictionary with the following keys:
+        - 'restarts': the number of automatic restarts of the DHCP server
+        - 'failed_restarts': the number of restart attempts that failed
+        - 'downtime': the total duration (in s) during which the DHCP server was down
+        - 'last_downtime': the duration (in s) of the last outage (or None)
+        If supervision is not active, the metrics of the last supervised DHCP server are returned (or None)
+        
+        Example:
+        | ${metrics}= | Get Dhcp Server Supervision Metrics |
+        """
+        self._drain_handler_logs()
+        if not self._supervisor is None:
+            return self._supervisor.getMetrics()
+        return self._last_supervision_metrics
+    
+    def _resync_leases_after_restart(self):
+        """
+        Private method invoked by the supervisor (from its own thread) once the DHCP server has been restarted, to repopulate the lease database
+        """
+        wrapper = self._dnsmasq_wrapper
+        if not wrapper is None:
+            wrapper.syncLeases(self._slave_dhcp_process.getLeases)
         
     
     def start(self, ifname = None, lease_time = None):
@@ -692,10 +1945,19 @@ class DhcpServerLibrary:
         if not lease_time is None:
             self.set_lease_time(lease_time)
         
-        self._slave_dhcp_process = SlaveDhcpServerProcess(self._dhcp_server_daemon_exec_path, self._ifname, logger = logger)
+        (process_class, wrapper_class) = load_backend(self._backend)
+        self._slave_dhcp_process = process_class(self._dhcp_server_daemon_exec_path, self._ifname, logger = logger, **self._backend_options)
+        if not self._profiler is None:
+            self._profiler.instrument(self._slave_dhcp_process, [name for name in ['start', 'kill', 'restart', 'getLeases'] if hasattr(self._slave_dhcp_process, name)], 'process')
         if not self._lease_time is None:
             self._slave_dhcp_process.setLeaseTime(self._lease_time)
         self._slave_dhcp_process.start()
+        
+        if self._supervision_enabled:
+            self._supervisor = SlaveDhcpServerSupervisor(self._slave_dhcp_process,
+                                                         resync_callback = self._resync_leases_after_restart,
+                                                         max_restarts = self._supervision_max_restarts,
+                                                         logger = logger)
 
         self._monitor_dhcp_server()
         
@@ -715,10 +1977,19 @@ class DhcpServerLibrary:
         if self._ifname is None:
             raise Exception('NoInterfaceProvided')
 
-        self._dnsmasq_wrapper = DnsmasqDhcpServerWrapper(self._ifname)
+        (process_class, wrapper_class) = load_backend(self._backend)
+        self._dnsmasq_wrapper = wrapper_class(self._ifname, coalesce_window = self._coalesce_window, profiler = self._profiler)
+        self._dnsmasq_wrapper.lease_listeners = self.lease_listeners
+        self._dnsmasq_wrapper.handler_log.summary_threshold = self._handler_log_summary_threshold
+        if not self._supervisor is None:
+            self._dnsmasq_wrapper.owner_changed_callback = self._supervisor.notifyOwnerChanged
         logger.debug('DHCP server is now being observed on ' + self._ifname)
         if not self._slave_dhcp_process is None:
-            self._slave_dhcp_process.killLastPid('SIGHUP')  # Send sighup to repopulate lease database 
+            self._dnsmasq_wrapper.setServedRanges(self._slave_dhcp_process.getDhcpRanges())  # Ignore leases published by other DHCP servers
+            self._dnsmasq_wrapper.syncLeases(self._slave_dhcp_process.getLeases)   # Repopulate the lease database from the current leases of the DHCP server
+        else:
+            self._dnsmasq_wrapper.syncLeases(list)  # No known DHCP server process, start with an empty lease database
+        self.wait_lease_database_synced()
 
 
     def _monitor_dhcp_server(self, ifname = None):
@@ -728,6 +1999,21 @@ class DhcpServerLibrary:
         self.restart_monitoring_server(ifname)
         
         
+    def wait_lease_database_synced(self, timeout = 5):
+        """Wait until the lease database has been synchronised with the current leases of the DHCP server
+        This is done automatically by Start and Restart Monitoring Server, but it can be useful after the DHCP server has been restarted by the supervision (see Set Dhcp Server Supervision)
+        Will fail if the lease database is not synchronised within timeout seconds
+        Returns the number of leases in the database
+        
+        Example:
+        | Wait Lease Database Synced | 10 |
+        """
+        synced = self._dnsmasq_wrapper.synced_event.wait(float(timeout))
+        self._drain_handler_logs()
+        if not synced:
+            raise Exception('Lease database not synced within ' + str(timeout) + 's')
+        return self._dnsmasq_wrapper.getLeasesCount()
+    
     def stop_monitoring_server(self):
         """ Stop monitoring the leases of the currently observed DHCP server (but don't stop the DHCP server itself).
         If the server needs to be stopped, use the keyword Stop
@@ -738,6 +2024,7 @@ class DhcpServerLibrary:
         
         if not self._dnsmasq_wrapper is None:
             self._dnsmasq_wrapper.exit()
+            self._dnsmasq_wrapper.handler_log.drain()
             logger.debug('DHCP server not observed anymore on ' + self._ifname)
         self._dnsmasq_wrapper = None
         
@@ -749,6 +2036,12 @@ class DhcpServerLibrary:
         | Stop |
         """
 
+        self.stop_handshake_capture()
+        if not self._supervisor is None:   # Stop supervision first, so that the DHCP server is not restarted when we kill it below
+            self._supervisor.stop()
+            self._supervisor.log.drain()
+            self._last_supervision_metrics = self._supervisor.getMetrics()
+            self._supervisor = None
         self.stop_monitoring_server()
         if not self._slave_dhcp_process is None:
             self._slave_dhcp_process.kill()
@@ -767,18 +2060,475 @@ class DhcpServerLibrary:
         self.start()
         
         
-    def log_leases(self):
+    def log_leases(self, max_leases = 50):
         """ Print all current leases to the log
         
         Example:
         | Log Leases |
         
         The list of current leases will be dumped into RobotFramework logs
+        If there are more than max_leases leases, only a summary is logged, and the whole lease table is exported to a CSV file in the output directory instead (see Export Leases)
+        """
+        
+        self._drain_handler_logs()
+        max_leases = int(max_leases)
+        leases_count = self._dnsmasq_wrapper.getLeasesCount()
+        if leases_count <= max_leases:
+            logger.info('Current leases in DHCP server database (printed as [(hwaddr, ipv4addr),...] tuple list):\n' + str([(hwaddr, ipaddr) for (hwaddr, ipaddr, renewal_time) in self._dnsmasq_wrapper.iterLeases()]))
+            return
+        
+        output_dir = self._get_robot_output_dir()
+        export_path = os.path.join(output_dir or os.getcwd(), 'dhcp_leases_' + time.strftime('%Y%m%d-%H%M%S') + '.csv')
+        exported = self.export_leases(export_path)
+        if output_dir is None:  # Not running within RobotFramework (eg standalone), so we cannot log HTML
+            logger.info(str(exported) + ' leases in DHCP server database, exported to ' + export_path)
+        else:
+            logger.info(str(exported) + ' leases in DHCP server database, exported to <a href="' + os.path.basename(export_path) + '">' + os.path.basename(export_path) + '</a>', html=True)
+    
+    def _get_robot_output_dir(self):
+        """
+        Private method returning the RobotFramework output directory, or None if we are not running within RobotFramework
+        """
+        try:
+            from robot.libraries.BuiltIn import BuiltIn
+            return BuiltIn().get_variable_value('${OUTPUT DIR}')
+        except Exception:   # ImportError or RobotNotRunningError
+            return None
+    
+    def export_leases(self, path, format = 'csv', mac_prefix = None, ip_prefix = None, max_age = None):
+        """ Write the current leases to the file path, one lease per line, and return the number of leases written
+        format can be either csv (with a header line) or jsonl (one JSON object per line). Each lease contains the MAC address, the IP address and the time of its allocation or last renewal (in seconds since the epoch)
+        Leases can be filtered using mac_prefix (case insensitive) and ip_prefix (only leases starting with these prefixes are exported), and max_age (only leases allocated or renewed less than max_age seconds ago are exported)
+        Leases are streamed to the file and are not logged
+        
+        Example:
+        | Export Leases | ${OUTPUT DIR}/leases.csv |
+        | Export Leases | ${OUTPUT DIR}/leases.jsonl | jsonl | mac_prefix=00:04:74 | max_age=60 |
+        =>
+        | 12 |
+        """
+        self._drain_handler_logs()
+        if max_age is not None:
+            max_age = float(max_age)
+        leases = self._dnsmasq_wrapper.iterLeases(mac_prefix = mac_prefix, ip_prefix = ip_prefix, max_age = max_age)
+        exported = 0
+        with open(path, 'w') as f:
+            if format == 'csv':
+                writer = csv.writer(f)
+                writer.writerow(['mac', 'ip', 'renewed'])
+                for (hwaddr, ipaddr, renewal_time) in leases:
+                    writer.writerow([hwaddr, ipaddr, renewal_time])
+                    exported += 1
+            elif format == 'jsonl':
+                for (hwaddr, ipaddr, renewal_time) in leases:
+                    f.write(json.dumps({'mac': hwaddr, 'ip': ipaddr, 'renewed': renewal_time}) + '\n')
+                    exported += 1
+            else:
+                raise Exception('UnsupportedExportFormat')
+        logger.debug('Exported ' + str(exported) + ' leases to ' + str(path))
+        return exported
+    
+    def get_leases(self, offset = 0, limit = None, mac_prefix = None, ip_prefix = None, max_age = None):
+        """ Get a page of the current leases, sorted by MAC address, as a list of dictionaries with keys 'mac', 'ip' and 'renewed' (time of allocation or last renewal, in seconds since the epoch)
+        offset is the index of the first lease to return, and limit is the maximum number of leases to return (all remaining leases if not provided)
+        Leases can be filtered using mac_prefix, ip_prefix and max_age (see Export Leases)
+        
+        Example:
+        | ${page}= | Get Leases | offset=0 | limit=100 |
+        =>
+        | [{'mac': '00:04:74:02:19:77', 'ip': '192.168.0.130', 'renewed': 1444400000.0}] |
+        """
+        self._drain_handler_logs()
+        offset = int(offset)
+        if limit is not None:
+            limit = int(limit)
+        if max_age is not None:
+            max_age = float(max_age)
+        leases = self._dnsmasq_wrapper.iterLeases(mac_prefix = mac_prefix, ip_prefix = ip_prefix, max_age = max_age)
+        page = []
+        for (index, (hwaddr, ipaddr, renewal_time)) in enumerate(leases):
+            if index < offset:
+                continue
+            if limit is not None and len(page) >= limit:
+                break
+            page.append({'mac': hwaddr, 'ip': ipaddr, 'renewed': renewal_time})
+        return page
+    
+    def set_lease_event_log_summary_threshold(self, threshold = 100):
+        """Set the maximum number of lease events (lease added, updated or deleted) that are logged one by one between two keywords
+        Above this threshold, lease events are summarized in the logs (eg: 'Got 4312 DhcpLeaseUpdated signal(s) for 812 MAC(s)')
+        If threshold is set to None, lease events are never summarized
+        
+        Example:
+        | Set Lease Event Log Summary Threshold | 20 |
+        """
+        if threshold is None or str(threshold) == 'None':
+            self._handler_log_summary_threshold = None
+        else:
+            self._handler_log_summary_threshold = int(threshold)
+        if not self._dnsmasq_wrapper is None:
+            self._dnsmasq_wrapper.handler_log.summary_threshold = self._handler_log_summary_threshold
+    
+    def get_backend_load_time(self):
+        """ Get the time (in seconds) that it took to load the DHCP server backend and its dependencies, or None if the backend has not been loaded yet
+        The backend is loaded when the DHCP server is first started or monitored
+        
+        Example:
+        | Start | eth0 |
+        | ${load_time}= | Get Backend Load Time |
+        """
+        return BACKEND_LOAD_TIMES.get(self._backend)
+    
+    def _drain_handler_logs(self):
+        """
+        Private method to send all messages logged from the D-Bus thread since the last keyword to the RobotFramework logs
+        """
+        if not self._dnsmasq_wrapper is None:
+            self._dnsmasq_wrapper.handler_log.drain()
+        if not self._supervisor is None:
+            self._supervisor.log.drain()
+        if not getattr(self._slave_dhcp_process, 'handler_log', None) is None:  # Messages logged from the embedded DHCP server thread
+            self._slave_dhcp_process.handler_log.drain()
+        self._capture_log.drain()
+    
+    def create_client_swarm_namespace(self, netns, host_ifname, netns_ifname, address = None):
+        """Create a network namespace netns linked to the host by a veth pair, to run a DHCP client swarm (see Run Dhcp Client Swarm)
+        host_ifname is the end of the veth pair that stays on the host (the DHCP server should be started on this interface), and netns_ifname is the end moved into netns
+        address, if provided (eg 192.168.0.1/24), is configured on host_ifname
+        This requires sudo permissions on the ip command
+        
+        Example:
+        | Create Client Swarm Namespace | swarm | veth-dhcp | veth-swarm | 192.168.0.1/24 |
+        | Start | veth-dhcp |
+        """
+        subprocess.check_call(['sudo', 'ip', 'netns', 'add', netns])
+        subprocess.check_call(['sudo', 'ip', 'link', 'add', host_ifname, 'type', 'veth', 'peer', 'name', netns_ifname])
+        subprocess.check_call(['sudo', 'ip', 'link', 'set', netns_ifname, 'netns', netns])
+        subprocess.check_call(['sudo', 'ip', 'netns', 'exec', netns, 'ip', 'link', 'set', netns_ifname, 'up'])
+        if not address is None:
+            subprocess.check_call(['sudo', 'ip', 'addr', 'add', address, 'dev', host_ifname])
+        subprocess.check_call(['sudo', 'ip', 'link', 'set', host_ifname, 'up'])
+    
+    def delete_client_swarm_namespace(self, netns, host_ifname):
+        """Delete a network namespace and veth pair created using Create Client Swarm Namespace
+        
+        Example:
+        | Delete Client Swarm Namespace | swarm | veth-dhcp |
+        """
+        subprocess.call(['sudo', 'ip', 'link', 'del', host_ifname], stdout=open(os.devnull, 'wb'), stderr=subprocess.STDOUT)   # The peer in netns is deleted as well
+        subprocess.check_call(['sudo', 'ip', 'netns', 'del', netns])
+    
+    def run_dhcp_client_swarm(self, clients = 100, rate = 100, renews = 0, renew_interval = 1, release = True, netns = None, interface = None, server_address = None, server_port = None, timeout = 2, retries = 3, results_file = None, python = 'python3'):
+        """Emulate a swarm of DHCP clients (with distinct MAC addresses) against the DHCP server, and return a summary of the measured latencies
+        clients clients are started at a rate of rate clients per second. Each client performs a DISCOVER/OFFER/REQUEST/ACK handshake, then renews its lease renews times (every renew_interval seconds), and then releases it (unless release is False)
+        If netns is provided, the clients run (via sudo) inside this network namespace, broadcasting on interface (see Create Client Swarm Namespace)
+        Otherwise, the clients send their requests to server_address:server_port (by default 127.0.0.1 and the port of the asyncio backend)
+        The clients are written for Python 3 (asyncio). When they run in a network namespace, or when RobotFramework runs on Python 2 (eg with the dnsmasq backend), they are run in a subprocess using the Python 3 interpreter python. Otherwise, they run within this process
+        Requests are retransmitted up to retries times when no answer is received within timeout seconds
+        The returned dictionary contains the number of 'clients', 'bound' clients, 'errors', 'handshakes_per_second', 'retransmissions', and the latencies 'offer_latency', 'dora_latency', 'renew_latency' and 'lease_db_latency' (time between the DHCP server sending the ACK and the lease being seen in the lease database), each as a dictionary with keys min, p50, p90, p99 and max (in s)
+        The time at which the DHCP server sent each ACK is reported by the asyncio backend. With other backends, lease_db_latency is only measured while handshakes are captured (see Start Handshake Capture), from the ACKs seen on the wire
+        If results_file is provided, per-client results are written to this file (as JSON)
+        
+        Example:
+        | ${summary}= | Run Dhcp Client Swarm | clients=1000 | rate=200 | renews=1 |
+        | Should Be Equal As Integers | ${summary['bound']} | 1000 |
+        """
+        Statistics = _import_submodule('Statistics')
+        lease_db_times = {} # Time at which the first lease of each client has been seen in the lease database, and at which the DHCP server sent the corresponding ACK (if known), as hwaddr: (lease_db_time, ack_time)
+        process = self._slave_dhcp_process
+        def record_lease_db_time(ipaddr, hwaddr):   # Invoked from the event thread, right after the ACK has been sent for the asyncio backend
+            if not hwaddr in lease_db_times:
+                lease_db_times[hwaddr] = (time.time(), None if process is None else process.getAckTime(hwaddr))
+        if netns is None:
+            if server_address is None:
+                server_address = '127.0.0.1'
+            if server_port is None:
+                server_port = self._backend_options.get('port', 67)
+        self.lease_listeners.append(record_lease_db_time)
+        try:
+            if netns is None and sys.version_info[0] >= 3:
+                DhcpClientSwarm = _import_submodule('DhcpClientSwarm')
+                swarm = DhcpClientSwarm.DhcpClientSwarm(server_address = server_address, server_port = server_port, clients = clients, rate = rate,
+                                                        renews = renews, renew_interval = renew_interval, release = (str(release).lower() != 'false'),
+                                                        timeout = timeout, retries = retries, interface = interface)
+                (summary, results) = swarm.run()
+            else:
+                cmd = []
+                if not netns is None:
+                    cmd += ['sudo', 'ip', 'netns', 'exec', netns]
+                cmd += [python, DhcpServerLibrary.CLIENT_SWARM_SCRIPT]
+                cmd += ['--clients', str(clients), '--rate', str(rate), '--renews', str(renews), '--renew-interval', str(renew_interval)]
+                cmd += ['--timeout', str(timeout), '--retries', str(retries), '--json', '-']
+                if str(release).lower() == 'false':
+                    cmd += ['--no-release']
+                if not interface is None:
+                    cmd += ['--interface', interface]
+                if not server_address is None:
+                    cmd += ['--server', server_address]
+                if not server_port is None:
+                    cmd += ['--port', str(server_port)]
+                (summary, results) = self._run_client_swarm_process(cmd)
+            time.sleep(0.1) # Leave some time for the last lease events to reach the lease database
+        finally:
+            self.lease_listeners.remove(record_lease_db_time)
+        
+        lease_db_latencies = []
+        for result in results:
+            if result['ack_time'] is None or not result['mac'] in lease_db_times:
+                continue
+            (lease_db_time, ack_time) = lease_db_times[result['mac']]
+            if ack_time is None and not self._dnsmasq_wrapper is None:  # Use the ACK sent by the DHCP server as captured on the wire, if any (the ACK received by the client cannot be used, as the lease database may well see the lease first)
+                timing = self._dnsmasq_wrapper.getHandshakeTiming(result['mac'], 'dora')
+                if not timing is None and timing['result'] == 'ACK':
+                    ack_time = timing['ack_time']
+            if ack_time is None:
+                continue
+            result['lease_db_latency'] = lease_db_time - ack_time
+            lease_db_latencies.append(result['lease_db_latency'])
+        summary['lease_db_latency'] = Statistics.percentiles(lease_db_latencies)
+        self._drain_handler_logs()
+        if not results_file is None:
+            with open(results_file, 'w') as f:
+                json.dump(results, f)
+        logger.info('DHCP client swarm: ' + str(summary['bound']) + '/' + str(summary['clients']) + ' clients bound, ' + str(summary['handshakes_per_second']) + ' handshakes/s, DORA latency: ' + str(summary['dora_latency']))
+        return summary
+    
+    def _run_client_swarm_process(self, cmd):
         """
+        Private method running the DHCP client swarm command cmd (that writes its JSON report on stdout, see DhcpClientSwarm.main()) and returning the tuple (summary, results) of its report
+        """
+        logger.debug('Running command ' + str(cmd))
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (output, errors) = proc.communicate()
+        if proc.returncode != 0:
+            raise Exception('DHCP client swarm failed with return code ' + str(proc.returncode) + ': ' + errors.decode('utf-8', 'replace').strip())
+        report = json.loads(output.decode())
+        return (report['summary'], report['clients'])
+    
+    def start_handshake_capture(self, ifname = None, ring_frames = 1024):
+        """Start capturing DHCP messages on the wire, to measure the timing of DHCP handshakes for each client (see Get Handshake Timing)
+        DHCP messages are captured on the interface of the DHCP server (or ifname if provided) using a kernel filter, so that the capture has a negligible cost even on busy networks
+        This requires CAP_NET_RAW, and the lease database must already be monitored (see Start)
+        
+        Example:
+        | Start | eth1 |
+        | Start Handshake Capture |
+        """
+        if not self._capture is None:
+            raise Exception('CaptureAlreadyStarted')
+        if ifname is None:
+            ifname = self._ifname
+        if ifname is None:
+            raise Exception('NoInterfaceProvided')
+        DhcpPacketCapture = _import_submodule('DhcpPacketCapture')
+        capture = DhcpPacketCapture.DhcpPacketCapture(ifname, self._record_handshake_timing, ring_frames = int(ring_frames), logger = self._capture_log)
+        capture.start()
+        self._capture = capture
+        logger.debug('Capturing DHCP handshakes on ' + ifname)
+    
+    def stop_handshake_capture(self):
+        """Stop capturing DHCP messages (see Start Handshake Capture)
+        Handshake timings captured so far are kept in the lease database
+        
+        Example:
+        | Stop Handshake Capture |
+        """
+        if not self._capture is None:
+            self._capture.stop()
+            self._capture = None
+        self._capture_log.drain()
+    
+    def _record_handshake_timing(self, hwaddr, timing):
+        """
+        Private method invoked (from the capture thread) for each DHCP handshake captured on the wire
+        """
+        wrapper = self._dnsmasq_wrapper
+        if not wrapper is None:
+            wrapper.recordHandshakeTiming(hwaddr, timing)
+    
+    def get_handshake_timing(self, mac, kind = 'dora'):
+        """Get the timing of the last DHCP handshake captured for the host with the MAC address provided as argument mac (see Start Handshake Capture)
+        kind is the type of handshake: dora (starting with a DISCOVER), renew (REQUEST from a client that has an address) or reboot (REQUEST from a client without address)
+        Returns a dictionary with the following keys:
+        - 'result': ACK or NAK, and 'ip': the address acknowledged
+        - 'duration': time from the first DISCOVER (or the first REQUEST if there was no DISCOVER) to the ACK (in s)
+        - 'offer_latency': time from the first DISCOVER to the OFFER, and 'request_latency': time from the first REQUEST to the ACK (in s)
+        - 'discover_retransmissions' and 'request_retransmissions'
+        - 'discover_time', 'offer_time', 'request_time' and 'ack_time' (in seconds since the epoch)
+        Will fail if no such handshake has been captured
+        
+        Example:
+        | ${timing}= | Get Handshake Timing | 00:04:74:02:19:77 |
+        """
+        self._drain_handler_logs()
+        timing = self._dnsmasq_wrapper.getHandshakeTiming(mac, kind)
+        if timing is None:
+            raise Exception('No ' + str(kind) + ' handshake captured for ' + str(mac))
+        return timing
+    
+    def handshake_duration_should_be_below(self, mac, max_duration, kind = 'dora'):
+        """Fail if the last DHCP handshake captured for the host with MAC address mac took max_duration seconds or more (see Get Handshake Timing)
+        
+        Example:
+        | Wait Lease | 00:04:74:02:19:77 | 30 |
+        | Handshake Duration Should Be Below | 00:04:74:02:19:77 | 2.5 |
+        """
+        timing = self.get_handshake_timing(mac, kind)
+        if timing['duration'] >= float(max_duration):
+            raise Exception('DHCP ' + str(kind) + ' handshake for ' + str(mac) + ' took ' + str(timing['duration']) + 's (should be below ' + str(max_duration) + 's)')
+        return timing['duration']
+    
+    def handshake_retransmissions_should_be_at_most(self, mac, max_retransmissions, kind = 'dora'):
+        """Fail if the last DHCP handshake captured for the host with MAC address mac needed more than max_retransmissions retransmissions (DISCOVER and REQUEST retransmissions are added)
+        
+        Example:
+        | Handshake Retransmissions Should Be At Most | 00:04:74:02:19:77 | 0 |
+        """
+        timing = self.get_handshake_timing(mac, kind)
+        retransmissions = timing['discover_retransmissions'] + timing['request_retransmissions']
+        if retransmissions > int(max_retransmissions):
+            raise Exception('DHCP ' + str(kind) + ' handshake for ' + str(mac) + ' needed ' + str(retransmissions) + ' retransmission(s) (should be at most ' + str(max_retransmissions) + ')')
+        return retransmissions
+    
+    def get_renewal_statistics(self, mac):
+        """Get statistics on the intervals between lease renewals by the host with the MAC address provided as argument mac (the first interval is measured from the allocation of the lease)
+        For leases already held when the lease database has been synchronised with the DHCP server (eg after a supervised restart), the allocation time is unknown, so the first interval is measured from the first renewal seen after the sync
+        Returns a dictionary with the following keys:
+        - 'count': the number of intervals measured, that is the number of renewals seen with an unchanged IP address
+        - 'mean', 'stddev', 'min' and 'max': the mean, standard deviation, minimum and maximum interval (in s)
+        - 'variance': the variance of the interval (in s²)
+        - 'expected': the expected interval (in s), that is half of the lease time set using keyword Set Lease Time (T1), or None if the lease time is unknown or infinite
+        - 'drift': the difference between the mean and the expected interval (in s), or None if the expected interval is unknown
+        Will fail if this host has not renewed its lease at least once since it has been allocated (or since the last Reset Lease Database)
+        
+        Example:
+        | ${stats}= | Get Renewal Statistics | 00:04:74:02:19:77 |
+        """
+        self._drain_handler_logs()
+        stats = self._dnsmasq_wrapper.getRenewalStatistics(mac)
+        if stats is None:
+            raise Exception('No renewal interval known for ' + str(mac))
+        stats['stddev'] = stats['variance'] ** 0.5
+        stats['expected'] = None
+        stats['drift'] = None
+        if not self._lease_time is None:
+            lease_time = parse_lease_time(self._lease_time)
+            if not lease_time is None:
+                stats['expected'] = lease_time / 2.0
+                stats['drift'] = stats['mean'] - stats['expected']
+        return stats
+    
+    def renewal_drift_should_be_below(self, mac, max_drift, min_renewals = 1):
+        """Fail if the host with MAC address mac does not renew its lease at T1 (half of the lease time set using keyword Set Lease Time)
+        The keyword fails if the mean interval between two renewals (or between the allocation and the first renewal) differs from T1 by max_drift seconds or more (either earlier or later), or if the host has renewed its lease fewer than min_renewals times
+        Returns the drift (in s, negative when renewing early)
+        
+        Example:
+        | Set Lease Time | 2m |
+        | Start | eth1 |
+        | Sleep | 10m |
+        | Renewal Drift Should Be Below | 00:04:74:02:19:77 | 5 | min_renewals=4 |
+        """
+        stats = self.get_renewal_statistics(mac)
+        if stats['drift'] is None:
+            raise Exception('NoLeaseTimeProvided')
+        if stats['count'] < int(min_renewals):
+            raise Exception('Only ' + str(stats['count']) + ' renewal(s) seen for ' + str(mac) + ' (expected at least ' + str(min_renewals) + ')')
+        if abs(stats['drift']) >= float(max_drift):
+            raise Exception('Host ' + str(mac) + ' renews its lease every ' + str(stats['mean']) + 's on average, drifting by ' + str(stats['drift']) + 's from T1=' + str(stats['expected']) + 's (should be below ' + str(max_drift) + 's)')
+        return stats['drift']
+    
+    def get_profiling_report(self, path = None):
+        """Get the durations measured since the library has been imported with profiling=True
+        Returns a dictionary with the keys 'keyword', 'handler' (lease event handlers, run from the D-Bus or DHCP server thread) and 'process' (operations on the DHCP server process), each containing one entry per keyword, handler or operation, as a dictionary with the following keys:
+        - 'count': the number of calls
+        - 'total': the total duration of these calls (in s)
+        - 'p50' and 'p99': the median and 99th percentile of the duration of a call (in s)
+        If profiling_sample_interval was provided, the key 'samples' also contains the functions most often seen when sampling the handler stacks
+        If path is provided, the report is also written to this file (as JSON if path ends with .json, or as a text table otherwise). A text report is anyway written next to output.xml at the end of the execution
+        
+        Example:
+        | Library | DhcpServerLibrary | /usr/sbin/dnsmasq | profiling=True |
+        | ${report}= | Get Profiling Report | ${OUTPUT DIR}/profile.json |
+        """
+        if self._profiler is None:
+            raise Exception('ProfilingNotEnabled')
+        if path is None:
+            report = self._profiler.getReport()
+        else:
+            report = self._profiler.writeReport(path)
+        logger.info(self._profiler.formatReport(report))
+        return report
+    
+    def get_lease_update_counters(self):
+        """ Get the counters of lease renewals (DhcpLeaseUpdated events) handled since the DHCP server is being monitored
+        Returns a dictionary with the following keys:
+        - 'received': the number of renewals received
+        - 'deduplicated': the number of renewals for which the IP address did not change (only the renewal time has been updated)
+        - 'coalesced': the number of renewals that have been superseded by a later renewal of the same MAC address within the coalescing window, so that they did not cause a database update of their own (see Set Lease Update Coalescing)
+        - 'published': the number of batched database updates
         
-        logger.info('Current leases in DHCP server database (printed as [(hwaddr, ipv4addr),...] tuple list):\n' + str(self._dnsmasq_wrapper.getLeasesList()))
+        Example:
+        | ${counters}= | Get Lease Update Counters |
+        """
+        self._drain_handler_logs()
+        return self._dnsmasq_wrapper.getUpdateCounters()
 
     
+    def get_pool_occupancy(self):
+        """ Get the occupancy of the address pool of the DHCP server, as a dictionary with the following keys:
+        - 'leases': the number of leases currently known
+        - 'pool_size': the number of addresses in the pool
+        - 'used' and 'free': the number of addresses of the pool that are allocated to a host or not
+        - 'utilisation': the percentage of the pool that is used
+        
+        Example:
+        | ${occupancy}= | Get Pool Occupancy |
+        """
+        self._drain_handler_logs()
+        return self._dnsmasq_wrapper.getPoolOccupancy()
+    
+    def wait_lease_count(self, count, timeout = 0):
+        """ Wait until at least count hosts have a lease
+        Will return as soon as this number of leases is reached (or immediately if it already is), and fail if it is not reached within timeout seconds
+        Returns the number of leases
+        
+        Example:
+        | Wait Lease Count | 180 | 90 |
+        """
+        got_leases = self._dnsmasq_wrapper.waitLeaseCount(int(count), float(timeout))
+        self._drain_handler_logs()
+        leases = self._dnsmasq_wrapper.getLeasesCount()
+        if not got_leases:
+            raise Exception('Only ' + str(leases) + ' lease(s) known after ' + str(timeout) + 's (expected at least ' + str(count) + ')')
+        return leases
+    
+    def wait_pool_utilisation(self, percentage, timeout = 0):
+        """ Wait until at least percentage % of the address pool of the DHCP server is allocated (percentage can be written as 95 or 95%)
+        Will return as soon as this utilisation is reached (or immediately if it already is), and fail if it is not reached within timeout seconds
+        Returns the pool utilisation (in %)
+        
+        Example:
+        | Wait Pool Utilisation | 95% | 120 |
+        """
+        percentage = float(str(percentage).rstrip('%'))
+        reached = self._dnsmasq_wrapper.waitPoolUtilisation(percentage, float(timeout))
+        self._drain_handler_logs()
+        utilisation = self._dnsmasq_wrapper.getPoolOccupancy()['utilisation']
+        if not reached:
+            raise Exception('Pool utilisation is ' + str(utilisation) + '% after ' + str(timeout) + 's (expected at least ' + str(percentage) + '%)')
+        return utilisation
+    
+    def get_filtered_lease_event_counts(self):
+        """ Get the number of lease events ignored because they concern addresses outside of the range served by our DHCP server (eg published by another dnsmasq instance with enable-dbus on the same host)
+        Returns a dictionary with the number of ignored events for each event name (DhcpLeaseAdded, DhcpLeaseUpdated and DhcpLeaseDeleted)
+        
+        Example:
+        | ${filtered}= | Get Filtered Lease Event Counts |
+        """
+        self._drain_handler_logs()
+        return self._dnsmasq_wrapper.getFilteredCounters()
+    
     def find_ip_for_mac(self, mac):
         """ Find the IP address allocated by the DHCP server to the machine with the MAC address provided as argument
         Will return None if the MAC address is not known by the DHCP server 
@@ -788,6 +2538,7 @@ class DhcpServerLibrary:
         =>
         | '192.168.0.2' |
         """
+        self._drain_handler_logs()
         return self._dnsmasq_wrapper.getIpForMac(mac)
     
     
@@ -798,6 +2549,7 @@ class DhcpServerLibrary:
         | Reset Lease Database |
         | Check Dhcp Client On | 00:04:74:02:19:77 | 30 |
         """
+        self._drain_handler_logs()
         self._dnsmasq_wrapper.reset()
         
     
@@ -816,7 +2568,7 @@ class DhcpServerLibrary:
             if self._lease_time is None:
                 raise Exception('NoLeaseTimeProvided')
             else:
-                timeout = int((DhcpServerLibrary.LEASE_DURATION_MARGIN+1.0) * float(self._lease_time)/ 2) # Calculate the timeout based on lease time and predefined margin
+                timeout = int((DhcpServerLibrary.LEASE_DURATION_MARGIN+1.0) * parse_lease_time(self._lease_time)/ 2) # Calculate the timeout based on lease time and predefined margin
         
         self.wait_lease(mac, timeout)
     
@@ -836,7 +2588,7 @@ class DhcpServerLibrary:
             if self._lease_time is None:
                 raise Exception('NoLeaseTimeProvided')
             else:
-                timeout = int((DhcpServerLibrary.LEASE_DURATION_MARGIN+1.0) * float(self._lease_time)/ 2) # Calculate the timeout based on lease time and predefined margin
+                timeout = int((DhcpServerLibrary.LEASE_DURATION_MARGIN+1.0) * parse_lease_time(self._lease_time)/ 2) # Calculate the timeout based on lease time and predefined margin
         
         try:   # We work reverse, so we will fail if the lease was obtained. In order to do this, catch exceptions from wait_lease()
             self.wait_lease(mac, timeout)
@@ -856,64 +2608,28 @@ class DhcpServerLibrary:
         =>
         | '192.168.0.2' |
         """
+        self._drain_handler_logs()
         ip = self._dnsmasq_wrapper.getIpForMac(mac)
         if not ip is None:
             logger.info('There is a lease previously seen for device ' + str(mac) + ' associated with IP address ' + str(ip))
             return ip # Succeed
-        try:
-            if timeout is None:
-                raise Exception('NoLeaseFound')   # Should fail, we are not allowed to wait
-            timeout = int(timeout)
-            if timeout <= 0:
-                raise Exception('NoLeaseFound')   # Should fail, we are not allowed to wait
-            else:   # There is a timeout, so carry on waiting for this lease during this timeout
-                self._dnsmasq_wrapper.setMacAddrToWatch(mac)
-                if not self._dnsmasq_wrapper.watched_macaddr_got_lease_event.wait(timeout):
-                    raise Exception('NoLeaseFound')
-        except Exception as e:
-            if e.message != 'NoLeaseFound':   # If we got an exception related to anything else than the no lease found case
-                raise   # Raise the exception
-            else:	# Raise this unexpected exception
-                raise Exception('No lease known for ' + str(mac))
+        if timeout is None or int(timeout) <= 0:
+            raise Exception('No lease known for ' + str(mac))   # Should fail, we are not allowed to wait
+        # There is a timeout, so carry on waiting for this lease during this timeout
+        self._dnsmasq_wrapper.setMacAddrToWatch(mac)
+        got_lease = self._dnsmasq_wrapper.watched_macaddr_got_lease_event.wait(int(timeout))
+        self._drain_handler_logs()  # Flush the lease events logged while we were waiting
+        if not got_lease:
+            raise Exception('No lease known for ' + str(mac))
+        return self._dnsmasq_wrapper.getIpForMac(mac)
     
 
-dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)    # Use Glib's mainloop as the default loop for all subsequent code
-
-if __name__ == '__main__':
-    atexit.register(cleanupAtExit)
-    
-    try:
-        input = raw_input
-    except NameError:
-        pass
+register_backend('dnsmasq', _load_dnsmasq_backend)
+register_backend('asyncio', _load_asyncio_backend)
 
-    DHCP_SERVER_DAEMON = '/usr/sbin/dnsmasq'
-    client = DhcpServerLibrary(DHCP_SERVER_DAEMON, 'eth1')
-    client.start()
+if __name__ == '__main__':  # Running this file directly starts the live lease monitor (see LeaseMonitor, the same as python -m rfdhcpserverlib)
     try:
-        print('New DHCP events will be displayed in real time on the console')
-        print('Press Ctrl+C or enter exit to stop this program')
-        print('Press enter to dump all DHCP leases or enter a MAC address to search the corresponding lease')
-        while True:
-            mac_address = input()
-            if mac_address == 'exit':
-                raise Exception('ExitOnCLI')
-            elif mac_address == '':
-                print("Dumping current leases:")
-                client.log_leases()
-            else:
-                ipv4 = client.find_ip_for_mac(mac_address)
-                if ipv4 is None:
-                    print('MAC address ' + mac_address + ' is not known by DHCP server')
-                else:
-                    print('Host with MAC address ' + mac_address + ' has IPv4 address ' + str(ipv4))
-                    client.reset_lease_database()
-                    print('Checking that lease is renewed within 240s')
-                    client.check_dhcp_client_on(mac_address, 240)
-                    print('DHCP client is On')
-                    client.reset_lease_database()
-                    print('Checking that lease is not renewed within the next 240s')
-                    client.check_dhcp_client_off(mac_address, 240)
-                    print('DHCP client is Off')
-    finally:
-        client.stop()
+        from rfdhcpserverlib import LeaseMonitor
+    except ImportError:
+        import LeaseMonitor
+    sys.exit(LeaseMonitor.main())
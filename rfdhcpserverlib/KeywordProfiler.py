@@ -0,0 +1,205 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Opt-in profiling of DhcpServerLibrary
+Measures the duration of each keyword, of each lease event handler and of each DHCP server process operation with a high-resolution timer, and optionally samples the Python stacks of threads while they run a lease event handler
+"""
+
+from __future__ import print_function
+
+import collections
+import functools
+import inspect
+import json
+import sys
+import threading
+import time
+
+try:
+    from rfdhcpserverlib.Statistics import percentiles
+except ImportError: # When run as a script, we are not imported as part of the rfdhcpserverlib package
+    from Statistics import percentiles
+
+try:
+    perf_counter = time.perf_counter
+except AttributeError:  # Python 2
+    perf_counter = time.time
+
+def copy_signature(function, wrapper):
+    """
+    Returns a callable invoking wrapper (built using functools.wraps(function)) that has the same signature as function
+    On Python 3, this is wrapper itself: functools.wraps() sets its __wrapped__ attribute, which inspect.signature() (and thus RobotFramework) follows
+    On Python 2, __wrapped__ is not set and not followed, so RobotFramework would see the (*args, **kwargs) of wrapper (wrong Libdoc signatures, and wrong argument counts reported as Python errors instead of RobotFramework errors). A forwarding function with the argument list of function is generated instead
+    """
+    if hasattr(wrapper, '__wrapped__'):
+        return wrapper
+    try:
+        argspec = inspect.getargspec(function)
+    except TypeError:   # Not a Python function (eg a builtin), there is no signature to copy
+        return wrapper
+    args = argspec.args
+    if inspect.ismethod(function) and not function.__self__ is None:
+        args = args[1:] # self is already bound
+    parameters = list(args)
+    if argspec.varargs:
+        parameters.append('*' + argspec.varargs)
+    if argspec.keywords:
+        parameters.append('**' + argspec.keywords)
+    namespace = {'__profiled_wrapper': wrapper}
+    exec('def forwarder(%s):\n    return __profiled_wrapper(%s)\n' % (', '.join(parameters), ', '.join(parameters)), namespace)
+    forwarder = namespace['forwarder']
+    forwarder.__defaults__ = argspec.defaults   # Default values are copied as is, rather than written in the generated source
+    functools.update_wrapper(forwarder, function)
+    forwarder.__wrapped__ = function
+    return forwarder
+
+class KeywordProfiler:
+    """
+    This class accumulates the durations of profiled calls, grouped by category ('keyword', 'handler' or 'process') and name
+    Only the last MAX_SAMPLES durations of each call are kept to compute percentiles, while count and total cover all calls
+    If sample_interval is provided (in seconds), a background thread samples the stack of each thread running a profiled handler at this interval
+    """
+
+    MAX_SAMPLES = 100000
+    MAX_REPORTED_FUNCTIONS = 50 # Number of functions listed in the sampling part of the report
+
+    def __init__(self, sample_interval = None):
+        self._timings = {}  # Durations of profiled calls, as (category, name): [count, total, deque of durations]
+        self._timings_mutex = threading.Lock()  # Calls can be recorded from any thread
+        self._sample_interval = sample_interval
+        self._active_handlers = {}  # Depth of profiled handler calls currently running in each thread, as thread ident: depth (only when sampling)
+        self._samples = 0
+        self._self_samples = collections.Counter()  # Number of samples where each function was running, as function: count
+        self._total_samples = collections.Counter() # Number of samples where each function was on the stack
+        self._sampler_stop = threading.Event()
+        self._sampler_thread = None
+        if not sample_interval is None:
+            self._sampler_thread = threading.Thread(target = self._sample)
+            self._sampler_thread.daemon = True
+            self._sampler_thread.start()
+
+    def record(self, category, name, duration):
+        """
+        Record that a call to name (of category category) lasted duration seconds
+        """
+        key = (category, name)
+        with self._timings_mutex:
+            timing = self._timings.get(key)
+            if timing is None:
+                timing = [0, 0.0, collections.deque(maxlen = KeywordProfiler.MAX_SAMPLES)]
+                self._timings[key] = timing
+            timing[0] += 1
+            timing[1] += duration
+            timing[2].append(duration)
+
+    def wrap(self, category, name, function):
+        """
+        Returns a callable with the signature of function (see copy_signature()), that invokes function and records the duration of each call under category and name
+        Calls to handlers (category 'handler') are also visible to the stack sampler
+        """
+        sampled = (category == 'handler' and not self._sampler_thread is None)
+        @functools.wraps(function)
+        def profiled(*args, **kwargs):
+            if sampled:
+                ident = threading.current_thread().ident
+                self._active_handlers[ident] = self._active_handlers.get(ident, 0) + 1
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(category, name, perf_counter() - start)
+                if sampled:
+                    self._active_handlers[ident] -= 1
+        return copy_signature(function, profiled)
+
+    def instrument(self, obj, method_names, category):
+        """
+        Replace the methods method_names of object obj by profiled versions (named after the class of obj), for this instance only
+        This must be done before the bound methods are handed over to anyone (eg stored as callbacks)
+        """
+        for method_name in method_names:
+            setattr(obj, method_name, self.wrap(category, obj.__class__.__name__ + '.' + method_name, getattr(obj, method_name)))
+
+    def _sample(self):
+        """
+        Body of the sampler thread
+        """
+        while not self._sampler_stop.wait(self._sample_interval):
+            frames = sys._current_frames()
+            for (ident, depth) in list(self._active_handlers.items()):
+                if depth <= 0 or not ident in frames:
+                    continue
+                self._samples += 1
+                frame = frames[ident]
+                self._self_samples[self._describeFrame(frame)] += 1
+                seen = set()
+                while not frame is None:
+                    function = self._describeFrame(frame)
+                    if not function in seen:   # Recursive functions are only counted once per sample
+                        seen.add(function)
+                        self._total_samples[function] += 1
+                    frame = frame.f_back
+
+    @staticmethod
+    def _describeFrame(frame):
+        code = frame.f_code
+        return '%s (%s:%d)' % (code.co_name, code.co_filename, code.co_firstlineno)
+
+    def stop(self):
+        """
+        Stop the sampler thread (if any)
+        """
+        self._sampler_stop.set()
+        if not self._sampler_thread is None:
+            self._sampler_thread.join()
+            self._sampler_thread = None
+
+    def getReport(self):
+        """
+        Returns the profiling results as a dict (that can be serialized to JSON) with one key per category ('keyword', 'handler' and 'process'), each containing name: {'count', 'total', 'p50', 'p99'}
+        When sampling, the 'samples' key also contains the number of samples and the functions seen the most often on top of the stack ('self') and anywhere in the stack ('total')
+        """
+        report = {'keyword': {}, 'handler': {}, 'process': {}}
+        with self._timings_mutex:
+            timings = [(key, timing[0], timing[1], list(timing[2])) for (key, timing) in self._timings.items()]
+        for ((category, name), count, total, durations) in timings:
+            ranks = percentiles(durations)
+            report.setdefault(category, {})[name] = {'count': count, 'total': total, 'p50': ranks['p50'], 'p99': ranks['p99']}
+        if not self._sample_interval is None:
+            report['samples'] = {'interval': self._sample_interval,
+                                 'count': self._samples,
+                                 'functions': [{'function': function, 'self': count, 'total': self._total_samples[function]} for (function, count) in self._self_samples.most_common(KeywordProfiler.MAX_REPORTED_FUNCTIONS)]}
+        return report
+
+    def formatReport(self, report = None):
+        """
+        Returns the profiling results as a text table, sorted by total duration within each category
+        """
+        if report is None:
+            report = self.getReport()
+        lines = []
+        for category in ['keyword', 'handler', 'process']:
+            if not report.get(category):
+                continue
+            lines.append('%-60s %8s %12s %12s %12s' % (category, 'count', 'total (s)', 'p50 (ms)', 'p99 (ms)'))
+            for (name, timing) in sorted(report[category].items(), key = lambda item: -item[1]['total']):
+                lines.append('%-60s %8d %12.6f %12.3f %12.3f' % (name, timing['count'], timing['total'], timing['p50'] * 1000, timing['p99'] * 1000))
+            lines.append('')
+        if 'samples' in report:
+            lines.append('%d handler stack sample(s) every %ss, most frequent functions (self/total):' % (report['samples']['count'], report['samples']['interval']))
+            for function in report['samples']['functions']:
+                lines.append('%8d %8d  %s' % (function['self'], function['total'], function['function']))
+        return '\n'.join(lines)
+
+    def writeReport(self, path):
+        """
+        Write the profiling results to path, as JSON if path ends with .json, or as a text table otherwise
+        """
+        report = self.getReport()
+        with open(path, 'w') as f:
+            if path.endswith('.json'):
+                json.dump(report, f, indent = 2)
+            else:
+                f.write(self.formatReport(report) + '\n')
+        return report
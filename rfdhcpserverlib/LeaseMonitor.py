@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Live DHCP lease monitor
+Runs a DHCP server through DhcpServerLibrary (outside of RobotFramework) and displays a refreshing view of the lease activity: lease events per second, active leases, new and renewing clients, and the latency between a lease event and the wake up of a thread waiting for it
+A JSON summary is written on exit
+This is the entry point of python -m rfdhcpserverlib
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import logging
+import signal
+import sys
+import threading
+import time
+
+try:
+    from rfdhcpserverlib import DhcpServerLibrary
+    from rfdhcpserverlib.Statistics import percentiles
+except ImportError: # When run as a script, we are not imported as part of the rfdhcpserverlib package
+    import DhcpServerLibrary
+    from Statistics import percentiles
+
+CLEAR_SCREEN = '\x1b[H\x1b[2J'
+
+class LeaseMonitor:
+    """
+    This class follows the lease events of the DHCP server started by a DhcpServerLibrary instance, and renders them as a periodically refreshed view
+    Lease events are queued by a listener invoked from the event thread, and consumed by run() from the main thread
+    """
+
+    RECENT_EVENTS = 10  # Number of recent lease events displayed
+    MAX_LATENCY_SAMPLES = 100000    # Number of wait latencies kept to compute the percentiles of the summary
+
+    def __init__(self, library, refresh = 1.0, output = sys.stdout):
+        self._library = library
+        self._refresh = refresh
+        self._output = output
+        self._clear_screen = hasattr(output, 'isatty') and output.isatty()
+        self._events = collections.deque()  # Lease events not consumed yet, as (time, ipaddr, hwaddr) tuples
+        self._events_available = threading.Condition()
+        self._seen_macs = set()
+        self._recent_events = collections.deque(maxlen = LeaseMonitor.RECENT_EVENTS)
+        self._latencies = collections.deque(maxlen = LeaseMonitor.MAX_LATENCY_SAMPLES)
+        self._totals = {'events': 0, 'new': 0, 'renewed': 0}
+        self._peak_events_per_second = 0.0
+        self._start_time = None
+        self._library.lease_listeners.append(self._handleLease)
+
+    def _handleLease(self, ipaddr, hwaddr):
+        """
+        Lease listener invoked from the event thread each time a lease allocation or renewal is recorded in the lease database
+        """
+        with self._events_available:
+            self._events.append((time.time(), ipaddr, hwaddr))
+            self._events_available.notify()
+
+    def _consumeEvents(self, interval):
+        """
+        Consume the queued lease events, and account them in interval (the counters of the current refresh interval)
+        """
+        now = time.time()
+        with self._events_available:
+            events = list(self._events)
+            self._events.clear()
+        for (event_time, ipaddr, hwaddr) in events:
+            latency = now - event_time
+            interval['latencies'].append(latency)
+            self._latencies.append(latency)
+            if hwaddr in self._seen_macs:
+                kind = 'renewed'
+            else:
+                self._seen_macs.add(hwaddr)
+                kind = 'new'
+            interval[kind] += 1
+            interval['events'] += 1
+            self._totals[kind] += 1
+            self._totals['events'] += 1
+            self._recent_events.append((event_time, kind, hwaddr, ipaddr))
+
+    def run(self, duration = None):
+        """
+        Monitor lease events until duration seconds have elapsed (or forever if duration is None)
+        """
+        self._start_time = time.time()
+        if duration is None:
+            end_time = None
+        else:
+            end_time = self._start_time + duration
+        while end_time is None or time.time() < end_time:
+            interval_start = time.time()
+            interval_end = interval_start + self._refresh
+            if not end_time is None:
+                interval_end = min(interval_end, end_time)
+            interval = {'events': 0, 'new': 0, 'renewed': 0, 'latencies': []}
+            while True:
+                remaining = interval_end - time.time()
+                if remaining <= 0:
+                    break
+                with self._events_available:
+                    if not self._events:
+                        self._events_available.wait(remaining)
+                self._consumeEvents(interval)
+            events_per_second = interval['events'] / max(time.time() - interval_start, 1e-6)
+            self._peak_events_per_second = max(self._peak_events_per_second, events_per_second)
+            self._render(interval, events_per_second)
+
+    def _render(self, interval, events_per_second):
+        occupancy = self._library.get_pool_occupancy()  # This also sends the pending library logs to the logger
+        lines = []
+        lines.append('DHCP lease monitor on %s - up %ds' % (self._library.get_dhcp_server_settings()['interface'], time.time() - self._start_time))
+        lines.append('Events/s: %.1f (peak %.1f)    Active leases: %d' % (events_per_second, self._peak_events_per_second, occupancy['leases']))
+        if occupancy['utilisation'] is not None:
+            lines.append('Pool: %d/%d addresses used (%.1f%%)' % (occupancy['used'], occupancy['pool_size'], occupancy['utilisation']))
+        lines.append('New clients: %d (total %d)    Renewals: %d (total %d)' % (interval['new'], self._totals['new'], interval['renewed'], self._totals['renewed']))
+        latency = percentiles(interval['latencies'])
+        if latency is None:
+            lines.append('Wait latency: -')
+        else:
+            lines.append('Wait latency: p50=%.3fms p99=%.3fms max=%.3fms' % (latency['p50'] * 1000, latency['p99'] * 1000, latency['max'] * 1000))
+        if self._clear_screen:
+            lines.append('')
+            lines.append('Recent lease events:')
+            for (event_time, kind, hwaddr, ipaddr) in reversed(self._recent_events):
+                lines.append('  %s  %-7s  %s  %s' % (time.strftime('%H:%M:%S', time.localtime(event_time)), kind, hwaddr, ipaddr))
+            self._output.write(CLEAR_SCREEN + '\n'.join(lines) + '\n')
+        else:   # Not a terminal, only print one block per refresh
+            self._output.write('\n'.join(lines) + '\n\n')
+        self._output.flush()
+
+    def getSummary(self):
+        """
+        Returns a summary of the monitoring session as a dict (that can be serialized to JSON)
+        """
+        self._consumeEvents({'events': 0, 'new': 0, 'renewed': 0, 'latencies': []})
+        duration = time.time() - self._start_time if not self._start_time is None else 0.0
+        settings = self._library.get_dhcp_server_settings()
+        return {'interface': settings['interface'],
+                'backend': settings['backend'],
+                'lease_time': settings['lease_time'],
+                'start_time': self._start_time,
+                'duration': duration,
+                'events': self._totals['events'],
+                'new_clients': self._totals['new'],
+                'renewals': self._totals['renewed'],
+                'events_per_second': self._totals['events'] / duration if duration > 0 else None,
+                'peak_events_per_second': self._peak_events_per_second,
+                'wait_latency': percentiles(list(self._latencies)),
+                'pool': self._library.get_pool_occupancy(),
+                'update_counters': self._library.get_lease_update_counters(),
+                'filtered_events': self._library.get_filtered_lease_event_counts(),
+                'leases': [{'mac': lease['mac'], 'ip': lease['ip']} for lease in self._library.get_leases()]}
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = 'python -m rfdhcpserverlib', description = 'Run a DHCP server and monitor its leases live')
+    parser.add_argument('-i', '--interface', required = True, help = 'network interface to serve DHCP on')
+    parser.add_argument('-b', '--binary', default = '/usr/sbin/dnsmasq', help = 'DHCP server executable (default: /usr/sbin/dnsmasq)')
+    parser.add_argument('-l', '--lease-time', help = 'lease duration, in dnsmasq syntax (eg: 120, 5m, 1h)')
+    parser.add_argument('--backend', default = 'dnsmasq', choices = sorted(DhcpServerLibrary.DHCP_SERVER_BACKENDS), help = 'DHCP server backend (default: dnsmasq)')
+    parser.add_argument('-o', '--backend-option', action = 'append', default = [], metavar = 'NAME=VALUE', help = 'option passed to the backend (eg port=6767 for the asyncio backend), can be repeated')
+    parser.add_argument('-r', '--refresh', type = float, default = 1.0, help = 'refresh interval (in s)')
+    parser.add_argument('-d', '--duration', type = float, help = 'stop after this duration (in s), default is to run until interrupted')
+    parser.add_argument('--json', metavar = 'FILE', default = 'lease-monitor.json', help = "write the summary as JSON to FILE on exit ('-' for stdout, default: lease-monitor.json)")
+    parser.add_argument('--log-file', metavar = 'FILE', help = 'write the library logs to FILE (they are discarded otherwise)')
+    args = parser.parse_args(argv)
+
+    backend_options = {}
+    for option in args.backend_option:
+        (name, separator, value) = option.partition('=')
+        if not separator:
+            parser.error('invalid backend option ' + option + ' (expected NAME=VALUE)')
+        backend_options[name] = value
+
+    # Library logs would garble the view, so they are sent to a log file (or discarded) instead of RobotFramework's logger
+    monitor_logger = logging.getLogger('rfdhcpserverlib')
+    monitor_logger.propagate = False
+    if args.log_file is None:
+        monitor_logger.addHandler(logging.NullHandler())
+    else:
+        handler = logging.FileHandler(args.log_file)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        monitor_logger.addHandler(handler)
+        monitor_logger.setLevel(logging.DEBUG)
+    DhcpServerLibrary.logger = monitor_logger
+    DhcpServerLibrary.DEFER_HANDLER_LOGS = False    # Python's logging is thread-safe
+
+    signal.signal(signal.SIGTERM, _terminate)
+    library = DhcpServerLibrary.DhcpServerLibrary(args.binary, args.interface, backend = args.backend, **backend_options)
+    library.start(lease_time = args.lease_time)
+    try:
+        monitor = LeaseMonitor(library, refresh = args.refresh)
+        try:
+            monitor.run(duration = args.duration)
+        except KeyboardInterrupt:
+            pass
+        summary = monitor.getSummary()
+    finally:
+        library.stop()
+
+    if args.json == '-':
+        json.dump(summary, sys.stdout, indent = 2)
+        print()
+    else:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent = 2)
+        print('Summary written to ' + args.json)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,18 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Statistics helpers shared by the load generator, the lease monitor and the profiler
+This module must stay importable by Python 2 (the dnsmasq backend relies on gobject), so it should not depend on DhcpClientSwarm or asyncio
+"""
+
+def percentiles(values):
+    """
+    Returns a dict with the min, p50, p90, p99 and max of the list values (or None if values is empty)
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    def rank(fraction):
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+    return {'min': values[0], 'p50': rank(0.5), 'p90': rank(0.9), 'p99': rank(0.99), 'max': values[-1]}
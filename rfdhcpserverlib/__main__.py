@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Live DHCP lease monitor (see LeaseMonitor), run as python -m rfdhcpserverlib
+"""
+
+import sys
+
+from rfdhcpserverlib.LeaseMonitor import main
+
+sys.exit(main())
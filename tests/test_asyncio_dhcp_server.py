@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+import queue
+import socket
+import struct
+import time
+import unittest
+
+from rfdhcpserverlib.AsyncioDhcpServer import AsyncioDhcpServer
+from rfdhcpserverlib.DhcpPacket import DhcpPacket, int_to_ip
+from rfdhcpserverlib.DhcpPacket import BOOTREPLY, DHCPDISCOVER, DHCPOFFER, DHCPREQUEST, DHCPACK, DHCPNAK, DHCPRELEASE
+from rfdhcpserverlib.DhcpPacket import OPTION_MESSAGE_TYPE, OPTION_SERVER_ID, OPTION_REQUESTED_IP, OPTION_LEASE_TIME
+
+SERVER_ADDRESS = '127.0.0.1'
+POOL_START = '10.0.0.10'
+POOL_END = '10.0.0.13'
+TIMEOUT = 2
+NO_REPLY_TIMEOUT = 0.5
+
+def mac(index):
+    return struct.pack('!HI', 0x0200, index)
+
+
+class AsyncioDhcpServerTestCase(unittest.TestCase):
+    """
+    The server listens on an ephemeral port of the loopback interface, so it sends its replies back to the source address and port of each request
+    """
+
+    LEASE_TIME = None
+
+    def setUp(self):
+        self.server = self.makeServer()
+        self.server.start()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((SERVER_ADDRESS, 0))
+        self.sock.settimeout(TIMEOUT)
+        self.xid = 0
+
+    def tearDown(self):
+        self.sock.close()
+        self.server.stop()
+
+    def makeServer(self, port = 0):
+        """
+        Build a server (not started yet) whose lease events are queued in self.events
+        """
+        server = AsyncioDhcpServer('lo', POOL_START, POOL_END, lease_time = self.LEASE_TIME, server_address = SERVER_ADDRESS, netmask = '255.255.255.0', port = port, bind_address = SERVER_ADDRESS, bind_to_device = False)
+        self.events = queue.Queue()
+        server.listeners.append(lambda signal, ipaddr, hwaddr, hostname: self.events.put((signal, ipaddr, hwaddr)))
+        return server
+
+    def send(self, message_type, chaddr, ciaddr = '0.0.0.0', server_id = None, requested_ip = None):
+        self.xid += 1
+        packet = DhcpPacket()
+        packet.xid = self.xid
+        packet.ciaddr = ciaddr
+        packet.chaddr = chaddr
+        packet.setOption(OPTION_MESSAGE_TYPE, struct.pack('!B', message_type))
+        if not server_id is None:
+            packet.setIpOption(OPTION_SERVER_ID, server_id)
+        if not requested_ip is None:
+            packet.setIpOption(OPTION_REQUESTED_IP, requested_ip)
+        self.sock.sendto(packet.pack(), (SERVER_ADDRESS, self.server.getPort()))
+        return packet
+
+    def exchange(self, message_type, chaddr, **kwargs):
+        """
+        Send a request and return the reply of the server
+        """
+        packet = self.send(message_type, chaddr, **kwargs)
+        while True:
+            reply = DhcpPacket.parse(self.sock.recv(2048))
+            if reply.xid == packet.xid:
+                self.assertEqual(reply.op, BOOTREPLY)
+                self.assertEqual(reply.chaddr, chaddr)
+                return reply
+
+    def assertNoReply(self, message_type, chaddr, **kwargs):
+        self.sock.settimeout(NO_REPLY_TIMEOUT)
+        try:
+            self.assertRaises(socket.timeout, self.exchange, message_type, chaddr, **kwargs)
+        finally:
+            self.sock.settimeout(TIMEOUT)
+
+    def getLease(self, chaddr, requested_ip = None):
+        """
+        Perform a DISCOVER/OFFER/REQUEST/ACK handshake and return the address allocated
+        """
+        offer = self.exchange(DHCPDISCOVER, chaddr, requested_ip = requested_ip)
+        self.assertEqual(offer.getMessageType(), DHCPOFFER)
+        ack = self.exchange(DHCPREQUEST, chaddr, server_id = SERVER_ADDRESS, requested_ip = offer.yiaddr)
+        self.assertEqual(ack.getMessageType(), DHCPACK)
+        self.assertEqual(ack.yiaddr, offer.yiaddr)
+        return ack.yiaddr
+
+    def assertFreeAddresses(self, addresses):
+        """
+        Check the addresses that the server will allocate next, in order (each free address must be listed exactly once)
+        """
+        self.assertEqual([int_to_ip(ip) for ip in self.server._free], addresses)
+
+    def assertEvent(self, signal, ipaddr, chaddr):
+        self.assertEqual(self.events.get(timeout = TIMEOUT), (signal, ipaddr, ':'.join('%02x' % byte for byte in bytearray(chaddr))))
+
+
+class AsyncioDhcpServerTest(AsyncioDhcpServerTestCase):
+
+    LEASE_TIME = 3600
+
+    def test_discover_request(self):
+        offer = self.exchange(DHCPDISCOVER, mac(1))
+        self.assertEqual(offer.getMessageType(), DHCPOFFER)
+        self.assertEqual(offer.yiaddr, POOL_START)
+        self.assertEqual(offer.getIpOption(OPTION_SERVER_ID), SERVER_ADDRESS)
+        self.assertEqual(struct.unpack('!I', offer.options[OPTION_LEASE_TIME])[0], self.LEASE_TIME)
+        self.assertTrue(self.events.empty())    # An offer is not a lease
+        ack = self.exchange(DHCPREQUEST, mac(1), server_id = SERVER_ADDRESS, requested_ip = offer.yiaddr)
+        self.assertEqual(ack.getMessageType(), DHCPACK)
+        self.assertEqual(ack.yiaddr, POOL_START)
+        self.assertEvent('DhcpLeaseAdded', POOL_START, mac(1))
+        self.assertEqual(self.server.getLeases(), [('02:00:00:00:00:01', POOL_START, '')])
+
+    def test_renew(self):
+        ipaddr = self.getLease(mac(1))
+        self.assertEvent('DhcpLeaseAdded', ipaddr, mac(1))
+        ack = self.exchange(DHCPREQUEST, mac(1), ciaddr = ipaddr)
+        self.assertEqual(ack.getMessageType(), DHCPACK)
+        self.assertEqual(ack.yiaddr, ipaddr)
+        self.assertEvent('DhcpLeaseUpdated', ipaddr, mac(1))
+
+    def test_listeners_are_notified_after_ack(self):
+        latencies = []
+        self.server.listeners.insert(0, lambda signal, ipaddr, hwaddr, hostname: latencies.append(time.time() - self.server.getAckTime(hwaddr)))
+        ipaddr = self.getLease(mac(1))
+        self.assertEvent('DhcpLeaseAdded', ipaddr, mac(1))
+        self.exchange(DHCPREQUEST, mac(1), ciaddr = ipaddr)
+        self.assertEvent('DhcpLeaseUpdated', ipaddr, mac(1))
+        self.assertEqual(len(latencies), 2)
+        for latency in latencies:
+            self.assertGreaterEqual(latency, 0)
+        self.send(DHCPRELEASE, mac(1), ciaddr = ipaddr)
+        self.assertEvent('DhcpLeaseDeleted', ipaddr, mac(1))
+        self.assertIsNone(self.server.getAckTime('02:00:00:00:00:01'))
+
+    def test_request_for_leased_address_is_naked(self):
+        ipaddr = self.getLease(mac(1))
+        nak = self.exchange(DHCPREQUEST, mac(2), requested_ip = ipaddr)   # INIT-REBOOT with the address of another host
+        self.assertEqual(nak.getMessageType(), DHCPNAK)
+        nak = self.exchange(DHCPREQUEST, mac(2), requested_ip = '192.168.1.1')  # Outside of the pool
+        self.assertEqual(nak.getMessageType(), DHCPNAK)
+        self.assertEqual([hwaddr for (hwaddr, ipaddr, hostname) in self.server.getLeases()], ['02:00:00:00:00:01'])
+
+    def test_request_for_another_server(self):
+        offer = self.exchange(DHCPDISCOVER, mac(1))
+        self.assertNoReply(DHCPREQUEST, mac(1), server_id = '127.0.0.2', requested_ip = offer.yiaddr)
+        addresses = [self.getLease(mac(index)) for index in range(2, 6)]
+        self.assertIn(offer.yiaddr, addresses)  # The offer has been withdrawn
+
+    def test_release(self):
+        ipaddr = self.getLease(mac(1))
+        self.assertEvent('DhcpLeaseAdded', ipaddr, mac(1))
+        self.send(DHCPRELEASE, mac(1), ciaddr = ipaddr)
+        self.assertEvent('DhcpLeaseDeleted', ipaddr, mac(1))
+        self.assertEqual(self.server.getLeases(), [])
+
+    def test_pool_exhaustion(self):
+        addresses = [self.getLease(mac(index)) for index in range(4)]
+        self.assertEqual(addresses, ['10.0.0.10', '10.0.0.11', '10.0.0.12', '10.0.0.13'])
+        self.assertNoReply(DHCPDISCOVER, mac(4))
+
+    def test_requested_address_is_not_allocated_twice(self):
+        self.assertEqual(self.getLease(mac(1), requested_ip = POOL_END), POOL_END)
+        self.assertFreeAddresses(['10.0.0.10', '10.0.0.11', '10.0.0.12'])
+        self.assertEvent('DhcpLeaseAdded', POOL_END, mac(1))
+        self.send(DHCPRELEASE, mac(1), ciaddr = POOL_END)
+        self.assertEvent('DhcpLeaseDeleted', POOL_END, mac(1))
+        self.assertFreeAddresses(['10.0.0.10', '10.0.0.11', '10.0.0.12', '10.0.0.13'])
+        self.assertEqual(self.getLease(mac(2), requested_ip = POOL_START), POOL_START)  # Requested addresses can also be at the head of the free addresses
+        addresses = [self.getLease(mac(index)) for index in range(3, 6)]
+        self.assertEqual(sorted(addresses), ['10.0.0.11', '10.0.0.12', '10.0.0.13'])
+        self.assertNoReply(DHCPDISCOVER, mac(6))
+        self.send(DHCPRELEASE, mac(2), ciaddr = POOL_START)
+        self.assertEqual(self.getLease(mac(6)), POOL_START)
+        self.assertNoReply(DHCPDISCOVER, mac(7))
+
+    def test_restart(self):
+        self.getLease(mac(1))
+        self.assertEvent('DhcpLeaseAdded', POOL_START, mac(1))
+        self.server.stop()
+        self.assertEqual(self.server.getLeases(), [])
+        self.server.start()
+        self.assertEqual(self.getLease(mac(2)), POOL_START)    # Leases are lost on restart
+        self.assertEvent('DhcpLeaseAdded', POOL_START, mac(2)) # Listeners are kept
+
+
+class AsyncioDhcpServerExpiryTest(AsyncioDhcpServerTestCase):
+
+    LEASE_TIME = 1
+
+    def test_lease_expiry(self):
+        ipaddr = self.getLease(mac(1))
+        self.assertEvent('DhcpLeaseAdded', ipaddr, mac(1))
+        self.assertEvent('DhcpLeaseDeleted', ipaddr, mac(1))
+        self.assertEqual(self.server.getLeases(), [])
+        self.assertEqual(self.getLease(mac(2)), '10.0.0.11')   # Expired addresses are allocated last
+
+    def test_renew_postpones_expiry(self):
+        ipaddr = self.getLease(mac(1))
+        self.assertEvent('DhcpLeaseAdded', ipaddr, mac(1))
+        self.exchange(DHCPREQUEST, mac(1), ciaddr = ipaddr)
+        self.assertEvent('DhcpLeaseUpdated', ipaddr, mac(1))
+        self.assertEvent('DhcpLeaseDeleted', ipaddr, mac(1))
+
+
+class AsyncioDhcpServerStartTest(AsyncioDhcpServerTestCase):
+
+    LEASE_TIME = 3600
+
+    def setUp(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((SERVER_ADDRESS, 0))
+        self.sock.settimeout(TIMEOUT)
+        self.xid = 0
+        self.server = None
+
+    def tearDown(self):
+        self.sock.close()
+        if not self.server is None:
+            self.server.stop()
+
+    def test_failed_bind(self):
+        blocker = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)    # Without SO_REUSEADDR, so the server cannot bind to the same port
+        try:
+            blocker.bind((SERVER_ADDRESS, 0))
+            self.server = self.makeServer(port = blocker.getsockname()[1])
+            with self.assertRaises(Exception) as context:
+                self.server.start()
+            self.assertEqual(str(context.exception), 'DhcpPortAlreadyUsed')
+            self.assertFalse(self.server.isRunning())
+        finally:
+            blocker.close()
+        self.server.start()
+        self.assertEqual(self.getLease(mac(1)), POOL_START)
+
+    def test_failed_endpoint_creation(self):
+        self.server = self.makeServer()
+        self.server._createSocket = lambda: socket.socket(socket.AF_INET, socket.SOCK_STREAM)   # asyncio refuses to create a datagram endpoint on this socket
+        self.assertRaises(ValueError, self.server.start)    # The error of the server thread is raised, not a timeout
+        self.assertFalse(self.server.isRunning())
+        del self.server._createSocket
+        self.server.start()
+        self.assertEqual(self.getLease(mac(1)), POOL_START)
+
+
+if __name__ == '__main__':
+    unittest.main()
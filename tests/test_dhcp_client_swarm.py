@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import unittest
+
+from rfdhcpserverlib import DhcpServerLibrary
+from rfdhcpserverlib.AsyncioDhcpServer import AsyncioDhcpServer
+
+SERVER_ADDRESS = '127.0.0.1'
+
+
+class DhcpClientSwarmProcessTest(unittest.TestCase):
+    """
+    Run the client swarm as a subprocess, as done by Run Dhcp Client Swarm in a network namespace or when RobotFramework runs on Python 2
+    """
+
+    def setUp(self):
+        self.library = DhcpServerLibrary.DhcpServerLibrary(None, backend = 'asyncio')
+
+    def test_report_is_read(self):
+        server = AsyncioDhcpServer('lo', '10.0.0.10', '10.0.0.20', server_address = SERVER_ADDRESS, netmask = '255.255.255.0', port = 0, bind_address = SERVER_ADDRESS, bind_to_device = False)
+        server.start()
+        try:
+            cmd = [sys.executable, DhcpServerLibrary.DhcpServerLibrary.CLIENT_SWARM_SCRIPT, '--server', SERVER_ADDRESS, '--port', str(server.getPort()), '--clients', '3', '--json', '-']
+            (summary, results) = self.library._run_client_swarm_process(cmd)
+        finally:
+            server.stop()
+        self.assertEqual(summary['bound'], 3)
+        self.assertEqual(sorted(result['ip'] for result in results), ['10.0.0.10', '10.0.0.11', '10.0.0.12'])
+
+    def test_failure_is_reported(self):
+        cmd = [sys.executable, '-c', 'import sys; sys.stderr.write("Cannot open network namespace"); sys.exit(1)']
+        with self.assertRaises(Exception) as context:
+            self.library._run_client_swarm_process(cmd)
+        self.assertEqual(str(context.exception), 'DHCP client swarm failed with return code 1: Cannot open network namespace')
+
+
+if __name__ == '__main__':
+    unittest.main()
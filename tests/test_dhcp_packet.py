@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import struct
+import unittest
+
+from rfdhcpserverlib import DhcpPacket
+
+CLIENT_MAC = b'\x02\x00\x00\x00\x00\x01'
+
+
+class DhcpPacketTest(unittest.TestCase):
+    """
+    These tests must also pass on Python 2, as the handshake capture parses DHCP packets with the dnsmasq backend
+    """
+
+    def test_pack_and_parse(self):
+        packet = DhcpPacket.DhcpPacket()
+        packet.xid = 0x12345678
+        packet.ciaddr = '192.168.0.128'
+        packet.chaddr = CLIENT_MAC
+        packet.setOption(DhcpPacket.OPTION_MESSAGE_TYPE, struct.pack('!B', DhcpPacket.DHCPREQUEST))
+        packet.setIpOption(DhcpPacket.OPTION_SERVER_ID, '192.168.0.1')
+        packet.setOption(DhcpPacket.OPTION_HOSTNAME, b'client')
+        parsed = DhcpPacket.DhcpPacket.parse(packet.pack())
+        self.assertEqual(parsed.op, DhcpPacket.BOOTREQUEST)
+        self.assertEqual(parsed.xid, 0x12345678)
+        self.assertEqual(parsed.ciaddr, '192.168.0.128')
+        self.assertEqual(parsed.getMacAddress(), '02:00:00:00:00:01')
+        self.assertEqual(parsed.getMessageType(), DhcpPacket.DHCPREQUEST)
+        self.assertEqual(parsed.getIpOption(DhcpPacket.OPTION_SERVER_ID), '192.168.0.1')
+        self.assertEqual(parsed.getHostname(), 'client')
+
+    def test_reply(self):
+        request = DhcpPacket.DhcpPacket()
+        request.xid = 7
+        request.chaddr = CLIENT_MAC
+        reply = DhcpPacket.DhcpPacket.parse(request.makeReply(DhcpPacket.DHCPACK).pack())
+        self.assertEqual(reply.op, DhcpPacket.BOOTREPLY)
+        self.assertEqual(reply.xid, 7)
+        self.assertEqual(reply.getMessageType(), DhcpPacket.DHCPACK)
+
+    def test_invalid_packets_are_rejected(self):
+        data = DhcpPacket.DhcpPacket().pack()
+        self.assertRaises(ValueError, DhcpPacket.DhcpPacket.parse, data[:100])
+        self.assertRaises(ValueError, DhcpPacket.DhcpPacket.parse, data[:DhcpPacket.BOOTP_HEADER.size + 4] + struct.pack('!B', DhcpPacket.OPTION_HOSTNAME))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import unittest
+
+from rfdhcpserverlib import DhcpPacket
+from rfdhcpserverlib import DhcpPacketCapture
+
+CLIENT_MAC = b'\x02\x00\x00\x00\x00\x01'
+SERVER_ADDRESS = '192.168.0.1'
+
+def make_packet(message_type, xid, op = DhcpPacket.BOOTREQUEST, ciaddr = '0.0.0.0', yiaddr = '0.0.0.0'):
+    packet = DhcpPacket.DhcpPacket()
+    packet.op = op
+    packet.xid = xid
+    packet.ciaddr = ciaddr
+    packet.yiaddr = yiaddr
+    packet.chaddr = CLIENT_MAC
+    packet.setOption(DhcpPacket.OPTION_MESSAGE_TYPE, bytes(bytearray([message_type])))
+    return packet
+
+
+class HandshakeTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.timings = []
+        self.tracker = DhcpPacketCapture.HandshakeTracker(lambda hwaddr, timing: self.timings.append((hwaddr, timing)))
+
+    def test_dora(self):
+        self.tracker.process(10.0, make_packet(DhcpPacket.DHCPDISCOVER, 1))
+        self.tracker.process(11.0, make_packet(DhcpPacket.DHCPDISCOVER, 1))
+        self.tracker.process(11.5, make_packet(DhcpPacket.DHCPOFFER, 1, op = DhcpPacket.BOOTREPLY, yiaddr = '192.168.0.128'))
+        self.tracker.process(12.0, make_packet(DhcpPacket.DHCPREQUEST, 1))
+        self.tracker.process(12.5, make_packet(DhcpPacket.DHCPACK, 1, op = DhcpPacket.BOOTREPLY, yiaddr = '192.168.0.128'))
+        self.assertEqual(len(self.timings), 1)
+        (hwaddr, timing) = self.timings[0]
+        self.assertEqual(hwaddr, '02:00:00:00:00:01')
+        self.assertEqual(timing['kind'], 'dora')
+        self.assertEqual(timing['result'], 'ACK')
+        self.assertEqual(timing['ip'], '192.168.0.128')
+        self.assertEqual(timing['duration'], 2.5)
+        self.assertEqual(timing['offer_latency'], 1.5)
+        self.assertEqual(timing['request_latency'], 0.5)
+        self.assertEqual(timing['discover_retransmissions'], 1)
+        self.assertEqual(timing['request_retransmissions'], 0)
+
+    def test_renew(self):
+        self.tracker.process(20.0, make_packet(DhcpPacket.DHCPREQUEST, 2, ciaddr = '192.168.0.128'))
+        self.tracker.process(20.25, make_packet(DhcpPacket.DHCPACK, 2, op = DhcpPacket.BOOTREPLY, ciaddr = '192.168.0.128', yiaddr = '192.168.0.128'))
+        self.assertEqual(len(self.timings), 1)
+        timing = self.timings[0][1]
+        self.assertEqual(timing['kind'], 'renew')
+        self.assertEqual(timing['result'], 'ACK')
+        self.assertEqual(timing['duration'], 0.25)
+        self.assertIsNone(timing['discover_time'])
+
+    def test_ack_for_another_transaction_is_ignored(self):
+        self.tracker.process(20.0, make_packet(DhcpPacket.DHCPREQUEST, 2, ciaddr = '192.168.0.128'))
+        self.tracker.process(20.25, make_packet(DhcpPacket.DHCPACK, 3, op = DhcpPacket.BOOTREPLY, yiaddr = '192.168.0.128'))
+        self.assertEqual(self.timings, [])
+
+
+class DhcpPacketCaptureImportTest(unittest.TestCase):
+
+    def test_import_does_not_load_asyncio(self):
+        """
+        Handshake capture is also used with the dnsmasq backend, which runs on Python 2, so it must not depend on asyncio
+        """
+        environment = dict(os.environ, PYTHONPATH = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] + [path for path in [os.environ.get('PYTHONPATH')] if path]))
+        output = subprocess.check_output([sys.executable, '-c', 'import sys, rfdhcpserverlib.DhcpPacketCapture; print("asyncio" in sys.modules)'], env = environment)
+        self.assertEqual(output.decode().strip(), 'False')
+
+
+# DHCP client run inside the network namespace: it performs a DORA handshake by broadcast, configures the address it got, and then renews its lease by unicast
+CLIENT_SCRIPT = textwrap.dedent('''
+    import socket, subprocess, sys
+    from rfdhcpserverlib.DhcpPacket import *
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.setsockopt(socket.SOL_SOCKET, 25, sys.argv[1].encode())  # SO_BINDTODEVICE
+    sock.bind(('0.0.0.0', DHCP_CLIENT_PORT))
+    sock.settimeout(5)
+
+    def exchange(message_type, xid, destination, expected, ciaddr = '0.0.0.0', options = {}):
+        packet = DhcpPacket()
+        packet.xid = xid
+        packet.ciaddr = ciaddr
+        packet.chaddr = %r
+        packet.setOption(OPTION_MESSAGE_TYPE, bytes([message_type]))
+        for (code, ipaddr) in options.items():
+            packet.setIpOption(code, ipaddr)
+        sock.sendto(packet.pack(), (destination, DHCP_SERVER_PORT))
+        while True:
+            reply = DhcpPacket.parse(sock.recv(2048))
+            if reply.xid == xid and reply.getMessageType() == expected:
+                return reply
+
+    offer = exchange(DHCPDISCOVER, 1, '255.255.255.255', DHCPOFFER)
+    ack = exchange(DHCPREQUEST, 1, '255.255.255.255', DHCPACK, options = {OPTION_SERVER_ID: %r, OPTION_REQUESTED_IP: offer.yiaddr})
+    subprocess.check_call(['ip', 'addr', 'add', ack.yiaddr + '/24', 'dev', sys.argv[1]])
+    exchange(DHCPREQUEST, 2, %r, DHCPACK, ciaddr = ack.yiaddr)
+''') % (CLIENT_MAC, SERVER_ADDRESS, SERVER_ADDRESS)
+
+
+class DhcpPacketCaptureTest(unittest.TestCase):
+    """
+    Capture on the server end of a veth pair whose other end is in a network namespace, so that frames really go through the wire (contrary to the loopback interface, where transmitted frames are also received)
+    """
+
+    NETNS = 'rfdhcpcapturetest'
+    SERVER_IFNAME = 'rfdcap0'
+    CLIENT_IFNAME = 'rfdcap1'
+
+    @classmethod
+    def setUpClass(cls):
+        if os.geteuid() != 0:
+            raise unittest.SkipTest('Requires root (network namespaces and CAP_NET_RAW)')
+        commands = [['ip', 'netns', 'add', cls.NETNS],
+                    ['ip', 'link', 'add', cls.SERVER_IFNAME, 'type', 'veth', 'peer', 'name', cls.CLIENT_IFNAME],
+                    ['ip', 'link', 'set', cls.CLIENT_IFNAME, 'netns', cls.NETNS],
+                    ['ip', 'addr', 'add', SERVER_ADDRESS + '/24', 'dev', cls.SERVER_IFNAME],
+                    ['ip', 'link', 'set', cls.SERVER_IFNAME, 'up'],
+                    ['ip', 'netns', 'exec', cls.NETNS, 'ip', 'link', 'set', cls.CLIENT_IFNAME, 'up']]
+        for command in commands:
+            if subprocess.call(command) != 0:
+                cls.tearDownClass()
+                raise unittest.SkipTest('Cannot set up a veth pair in a network namespace')
+
+    @classmethod
+    def tearDownClass(cls):
+        subprocess.call(['ip', 'link', 'del', cls.SERVER_IFNAME], stderr = subprocess.DEVNULL)
+        subprocess.call(['ip', 'netns', 'del', cls.NETNS], stderr = subprocess.DEVNULL)
+
+    def test_dora_and_renew_are_timed(self):
+        timings = {}
+        got_renew = threading.Event()
+        def record(hwaddr, timing):
+            timings[timing['kind']] = timing
+            if timing['kind'] == 'renew':
+                got_renew.set()
+        from rfdhcpserverlib.AsyncioDhcpServer import AsyncioDhcpServer  # Only the handshake capture must work on Python 2, not the embedded DHCP server
+        server = AsyncioDhcpServer(self.SERVER_IFNAME, '192.168.0.128', '192.168.0.254', server_address = SERVER_ADDRESS, netmask = '255.255.255.0')
+        server.start()
+        capture = DhcpPacketCapture.DhcpPacketCapture(self.SERVER_IFNAME, record)
+        capture.start()
+        try:
+            environment = dict(os.environ, PYTHONPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            subprocess.check_call(['ip', 'netns', 'exec', self.NETNS, sys.executable, '-c', CLIENT_SCRIPT, self.CLIENT_IFNAME], env = environment, timeout = 30)
+            self.assertTrue(got_renew.wait(5), 'No renew captured (timings: %s, counters: %s)' % (timings, capture.counters))
+        finally:
+            capture.stop()
+            server.stop()
+        self.assertEqual(capture.counters['dhcp'], 6)   # Client and server frames are both captured
+        self.assertEqual(timings['dora']['result'], 'ACK')
+        self.assertEqual(timings['dora']['ip'], '192.168.0.128')
+        self.assertIsNotNone(timings['dora']['offer_time'])
+        self.assertEqual(timings['renew']['result'], 'ACK')
+        self.assertEqual(timings['renew']['ip'], '192.168.0.128')
+        self.assertGreaterEqual(timings['renew']['duration'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
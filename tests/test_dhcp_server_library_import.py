@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import unittest
+
+# Imports the library in a fresh interpreter, and reports how long it took and which of the backend dependencies got imported
+IMPORT_SCRIPT = textwrap.dedent('''
+    import json, sys, time
+    start = time.time()
+    import rfdhcpserverlib.DhcpServerLibrary
+    duration = time.time() - start
+    json.dump({'duration': duration, 'modules': [name for name in %r if name in sys.modules]}, sys.stdout)
+''') % (['dbus', 'gobject', 'gi', 'asyncio', 'rfdhcpserverlib.AsyncioDhcpServer'],)
+
+
+class DhcpServerLibraryImportTest(unittest.TestCase):
+
+    def test_import_does_not_load_backends(self):
+        """
+        Neither dbus-python and gobject (dnsmasq backend) nor asyncio (embedded backend) should be imported with the library, and RobotFramework is optional
+        """
+        environment = dict(os.environ, PYTHONPATH = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] + [path for path in [os.environ.get('PYTHONPATH')] if path]))
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT], env = environment)
+        result = json.loads(output.decode())
+        sys.stderr.write('Importing rfdhcpserverlib.DhcpServerLibrary took %.3fms\n' % (result['duration'] * 1000))
+        self.assertEqual(result['modules'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+
+try:
+    from rfdhcpserverlib import DhcpServerLibrary
+except ImportError: # RobotFramework is not installed
+    DhcpServerLibrary = None
+
+TIMEOUT = 5
+
+
+class RecordingLogger:
+    """
+    Logger recording the messages it gets, and the thread that logged each of them
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def log(self, level, message):
+        self.messages.append((level, message, threading.current_thread()))
+
+    def debug(self, message):
+        self.log('debug', message)
+
+    def info(self, message):
+        self.log('info', message)
+
+    def warn(self, message):
+        self.log('warn', message)
+
+
+class FakeProcess:
+    """
+    Slave DHCP server process without PID (so that the supervisor polls isSlaveAlive())
+    """
+
+    def __init__(self):
+        self.alive = True
+        self.restarts = []
+        self.restarted = threading.Event()
+
+    def getPid(self):
+        return None
+
+    def isSlaveAlive(self):
+        return self.alive
+
+    def restart(self, logger = None, slave_dead = False):
+        logger.info('Restarting slave')
+        self.restarts.append(slave_dead)
+        self.alive = True
+        self.restarted.set()
+
+
+@unittest.skipIf(DhcpServerLibrary is None, 'RobotFramework is not installed')
+class SlaveDhcpServerSupervisorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.owner_wait_timeout = DhcpServerLibrary.SlaveDhcpServerSupervisor.OWNER_WAIT_TIMEOUT
+        DhcpServerLibrary.SlaveDhcpServerSupervisor.OWNER_WAIT_TIMEOUT = 0.2
+        self.logger = RecordingLogger()
+        self.process = FakeProcess()
+        self.supervisor = DhcpServerLibrary.SlaveDhcpServerSupervisor(self.process, logger = self.logger)
+
+    def tearDown(self):
+        self.supervisor.stop()
+        DhcpServerLibrary.SlaveDhcpServerSupervisor.OWNER_WAIT_TIMEOUT = self.owner_wait_timeout
+
+    def test_dead_slave_is_restarted_without_kill(self):
+        self.process.alive = False
+        self.assertTrue(self.process.restarted.wait(TIMEOUT))
+        self.supervisor.stop()
+        self.assertEqual(self.process.restarts, [True])
+        self.assertEqual(self.supervisor.getMetrics()['restarts'], 1)
+
+    def test_slave_without_dbus_name_is_killed(self):
+        self.supervisor.notifyOwnerChanged(False)
+        self.assertTrue(self.process.restarted.wait(TIMEOUT))
+        self.supervisor.notifyOwnerChanged(True)
+        self.supervisor.stop()
+        self.assertEqual(self.process.restarts, [False])
+
+    def test_restart_logs_are_deferred(self):
+        if not DhcpServerLibrary.DEFER_HANDLER_LOGS:
+            self.skipTest('Logs are not deferred')
+        self.process.alive = False
+        self.assertTrue(self.process.restarted.wait(TIMEOUT))
+        self.supervisor.stop()
+        self.assertEqual(self.logger.messages, [])  # Nothing is logged from the supervisor thread
+        self.supervisor.log.drain()
+        self.assertIn(('info', 'Restarting slave'), [(level, message) for (level, message, thread) in self.logger.messages])
+        for (level, message, thread) in self.logger.messages:
+            self.assertIs(thread, threading.current_thread())
+
+
+@unittest.skipIf(DhcpServerLibrary is None, 'RobotFramework is not installed')
+class SlaveDhcpServerProcessRestartTest(unittest.TestCase):
+
+    def setUp(self):
+        self.process = DhcpServerLibrary.SlaveDhcpServerProcess('/usr/sbin/dnsmasq', 'eth0')
+        self.process._slave_dhcp_server_pid = 4242
+        self.process._all_processes_pid = [4242]
+        self.killed = []
+        self.started = []
+        self.process._sudoKillSubprocessFromPid = lambda pid, **kwargs: self.killed.append(pid)
+        self.process.start = lambda keep_leases = False: self.started.append(keep_leases)
+
+    def test_restart(self):
+        self.process.restart()
+        self.assertEqual(self.killed, [4242])
+        self.assertEqual(self.started, [True])
+
+    def test_restart_dead_slave(self):
+        logger = RecordingLogger()
+        self.process.restart(logger = logger, slave_dead = True)
+        self.assertEqual(self.killed, [])   # The PID may have been reused
+        self.assertEqual(self.started, [True])
+        self.assertFalse(self.process.hasBeenStarted())
+        self.assertEqual(len(logger.messages), 1)
+        self.assertIsNone(self.process._logger)
+
+
+if __name__ == '__main__':
+    unittest.main()
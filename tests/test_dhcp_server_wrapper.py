@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+try:
+    from rfdhcpserverlib import DhcpServerLibrary
+except ImportError: # RobotFramework is not installed
+    DhcpServerLibrary = None
+
+
+def make_wrapper(scheduling_fails = False, coalesce_window = None):
+    """
+    Build a DhcpServerWrapper whose event thread is emulated: calls scheduled with _scheduleCall() are queued in wrapper.scheduled, and run by the test
+    """
+    class Wrapper(DhcpServerLibrary.DhcpServerWrapper):
+        def _scheduleCall(self, delay, callback):
+            if scheduling_fails:
+                raise RuntimeError('Event loop is closed')
+            self.scheduled.append(callback)
+        def runScheduled(self):
+            while self.scheduled:
+                self.scheduled.pop(0)()
+    wrapper = Wrapper('eth0', coalesce_window = coalesce_window)
+    wrapper.scheduled = []
+    return wrapper
+
+
+def make_synced_wrapper(leases, coalesce_window = None):
+    """
+    Build a DhcpServerWrapper (see make_wrapper()) whose lease database holds leases, a list of (hwaddr, ipaddr) tuples
+    """
+    wrapper = make_wrapper(coalesce_window = coalesce_window)
+    wrapper.syncLeases(lambda: leases)
+    wrapper.runScheduled()
+    return wrapper
+
+
+@unittest.skipIf(DhcpServerLibrary is None, 'RobotFramework is not installed')
+class SyncLeasesTest(unittest.TestCase):
+
+    def test_sync(self):
+        wrapper = make_wrapper()
+        wrapper.syncLeases(lambda: [('02:00:00:00:00:01', '192.168.0.128')])
+        wrapper._handleDhcpLeaseAdded('192.168.0.129', '02:00:00:00:00:02', '')   # Received during the sync
+        self.assertEqual(wrapper.getLeasesCount(), 0)
+        wrapper.runScheduled()
+        self.assertTrue(wrapper.synced_event.is_set())
+        self.assertEqual(sorted(wrapper.getLeasesList()), [('02:00:00:00:00:01', '192.168.0.128'), ('02:00:00:00:00:02', '192.168.0.129')])
+
+    def test_read_failure_replays_queued_events(self):
+        wrapper = make_wrapper()
+        wrapper._sync_backlog.append((wrapper._handleDhcpLeaseAdded, '192.168.0.129', '02:00:00:00:00:02', ''))
+        def read_leases():
+            raise IOError('Permission denied')
+        self.assertRaises(IOError, wrapper.syncLeases, read_leases)
+        wrapper.runScheduled()
+        self.assertFalse(wrapper.synced_event.is_set())
+        self.assertIsNone(wrapper._sync_backlog)
+        self.assertEqual(list(wrapper.getLeasesList()), [('02:00:00:00:00:02', '192.168.0.129')])
+        wrapper._handleDhcpLeaseAdded('192.168.0.130', '02:00:00:00:00:03', '')    # Not queued anymore
+        self.assertEqual(wrapper.getLeasesCount(), 2)
+
+    def test_scheduling_failure_replays_queued_events(self):
+        wrapper = make_wrapper(scheduling_fails = True)
+        wrapper._sync_backlog.append((wrapper._handleDhcpLeaseAdded, '192.168.0.129', '02:00:00:00:00:02', ''))
+        self.assertRaises(RuntimeError, wrapper.syncLeases, list)
+        self.assertFalse(wrapper.synced_event.is_set())
+        self.assertIsNone(wrapper._sync_backlog)
+        self.assertEqual(list(wrapper.getLeasesList()), [('02:00:00:00:00:02', '192.168.0.129')])
+
+
+@unittest.skipIf(DhcpServerLibrary is None, 'RobotFramework is not installed')
+class LeaseUpdateDeduplicationTest(unittest.TestCase):
+
+    def test_unchanged_binding_is_deduplicated(self):
+        wrapper = make_synced_wrapper([('02:00:00:00:00:01', '192.168.0.128')])
+        notified = []
+        wrapper.lease_listeners.append(lambda ipaddr, hwaddr: notified.append((hwaddr, ipaddr)))
+        wrapper._handleDhcpLeaseUpdated('192.168.0.128', '02:00:00:00:00:01', '')
+        wrapper._handleDhcpLeaseUpdated('192.168.0.129', '02:00:00:00:00:01', '')
+        self.assertEqual(wrapper.getIpForMac('02:00:00:00:00:01'), '192.168.0.129')
+        self.assertEqual(notified, [('02:00:00:00:00:01', '192.168.0.128'), ('02:00:00:00:00:01', '192.168.0.129')])    # Listeners are notified of renewals as well
+        self.assertEqual(wrapper.getUpdateCounters(), {'received': 2, 'deduplicated': 1, 'coalesced': 0, 'published': 0})
+
+    def test_unchanged_binding_is_not_coalesced(self):
+        wrapper = make_synced_wrapper([('02:00:00:00:00:01', '192.168.0.128')], coalesce_window = 1)
+        wrapper._handleDhcpLeaseUpdated('192.168.0.128', '02:00:00:00:00:01', '')
+        self.assertEqual(wrapper.scheduled, [])  # Nothing to publish
+        self.assertEqual(wrapper.getUpdateCounters(), {'received': 1, 'deduplicated': 1, 'coalesced': 0, 'published': 0})
+
+
+@unittest.skipIf(DhcpServerLibrary is None, 'RobotFramework is not installed')
+class LeaseUpdateCoalescingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wrapper = make_synced_wrapper([('02:00:00:00:00:01', '192.168.0.128'), ('02:00:00:00:00:02', '192.168.0.129')], coalesce_window = 1)
+        self.database = self.wrapper._lease_database
+
+    def test_updates_are_batched_within_window(self):
+        self.wrapper._handleDhcpLeaseUpdated('192.168.0.130', '02:00:00:00:00:01', '')
+        self.wrapper._handleDhcpLeaseUpdated('192.168.0.131', '02:00:00:00:00:02', '')
+        self.wrapper._handleDhcpLeaseUpdated('192.168.0.132', '02:00:00:00:00:01', '')
+        self.wrapper._handleDhcpLeaseUpdated('192.168.0.128', '02:00:00:00:00:01', '')  # Back to the IP address in the database, but this must still overwrite the pending binding
+        self.assertEqual(len(self.wrapper.scheduled), 1)   # Only one flush is scheduled for the whole window
+        self.assertEqual(self.database.get_ipv4address_for_hwaddress('02:00:00:00:00:02'), '192.168.0.129') # Not published yet
+        self.wrapper.runScheduled()
+        self.assertEqual(self.database.get_ipv4address_for_hwaddress('02:00:00:00:00:01'), '192.168.0.128')
+        self.assertEqual(self.database.get_ipv4address_for_hwaddress('02:00:00:00:00:02'), '192.168.0.131')
+        self.assertEqual(self.wrapper.getUpdateCounters(), {'received': 4, 'deduplicated': 0, 'coalesced': 2, 'published': 1})
+
+    def test_pending_updates_are_flushed_before_read(self):
+        self.wrapper._handleDhcpLeaseUpdated('192.168.0.130', '02:00:00:00:00:01', '')
+        self.assertEqual(self.wrapper.getIpForMac('02:00:00:00:00:01'), '192.168.0.130')
+        self.assertEqual(self.wrapper.getUpdateCounters()['published'], 1)
+        self.wrapper._handleDhcpLeaseUpdated('192.168.0.131', '02:00:00:00:00:02', '')
+        self.assertEqual(len(self.wrapper.scheduled), 1)   # The flush scheduled for the first update is still pending, and will publish the second one
+        self.assertEqual(sorted(self.wrapper.getLeasesList()), [('02:00:00:00:00:01', '192.168.0.130'), ('02:00:00:00:00:02', '192.168.0.131')])
+        self.wrapper.runScheduled()
+        self.wrapper._handleDhcpLeaseUpdated('192.168.0.132', '02:00:00:00:00:01', '')
+        self.assertEqual(len(self.wrapper.scheduled), 1)   # Once the scheduled flush has run, a new one can be scheduled
+        self.assertEqual(self.wrapper.getUpdateCounters(), {'received': 3, 'deduplicated': 0, 'coalesced': 0, 'published': 2})
+
+    def test_superseded_updates_are_not_counted(self):
+        self.wrapper._handleDhcpLeaseUpdated('192.168.0.130', '02:00:00:00:00:01', '')
+        self.wrapper._handleDhcpLeaseUpdated('192.168.0.132', '02:00:00:00:00:01', '')
+        self.wrapper._handleDhcpLeaseUpdated('192.168.0.131', '02:00:00:00:00:02', '')
+        self.wrapper._handleDhcpLeaseDeleted('192.168.0.132', '02:00:00:00:00:01', '')
+        self.wrapper.runScheduled()
+        self.assertIsNone(self.database.get_ipv4address_for_hwaddress('02:00:00:00:00:01'))  # The deleted lease is not resurrected
+        self.assertEqual(self.database.get_ipv4address_for_hwaddress('02:00:00:00:00:02'), '192.168.0.131')
+        self.assertEqual(self.wrapper.getUpdateCounters(), {'received': 3, 'deduplicated': 0, 'coalesced': 0, 'published': 1})
+
+
+@unittest.skipIf(DhcpServerLibrary is None, 'RobotFramework is not installed')
+class RenewalStatisticsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = DhcpServerLibrary.DhcpServerLeaseList()
+
+    def test_first_interval_starts_at_allocation(self):
+        self.database.addLease('192.168.0.128', '02:00:00:00:00:01')
+        self.assertTrue(self.database.renewLease('192.168.0.128', '02:00:00:00:00:01'))
+        self.assertEqual(self.database.get_renewal_stats_for_hwaddress('02:00:00:00:00:01')['count'], 1)
+
+    def test_first_interval_of_synced_lease_starts_at_first_renewal(self):
+        self.database.replaceLeases([('02:00:00:00:00:01', '192.168.0.128')])
+        self.assertTrue(self.database.renewLease('192.168.0.128', '02:00:00:00:00:01'))
+        self.assertIsNone(self.database.get_renewal_stats_for_hwaddress('02:00:00:00:00:01'))   # The interval since the sync is not a renewal interval
+        self.database.replaceLeases([('02:00:00:00:00:01', '192.168.0.128')])  # Unchanged binding, the renewal time is kept
+        self.assertTrue(self.database.renewLease('192.168.0.128', '02:00:00:00:00:01'))
+        self.assertEqual(self.database.get_renewal_stats_for_hwaddress('02:00:00:00:00:01')['count'], 1)
+
+    def test_allocated_lease_is_not_reset_by_sync(self):
+        self.database.addLease('192.168.0.128', '02:00:00:00:00:01')
+        self.database.replaceLeases([('02:00:00:00:00:01', '192.168.0.128')])
+        self.assertTrue(self.database.renewLease('192.168.0.128', '02:00:00:00:00:01'))
+        self.assertEqual(self.database.get_renewal_stats_for_hwaddress('02:00:00:00:00:01')['count'], 1)
+
+
+@unittest.skipIf(DhcpServerLibrary is None, 'RobotFramework is not installed')
+class PoolOccupancyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = DhcpServerLibrary.DhcpServerLeaseList()
+        self.database.setPool([(DhcpServerLibrary.ipv4_to_int('192.168.0.128'), DhcpServerLibrary.ipv4_to_int('192.168.0.131')),
+                               (DhcpServerLibrary.ipv4_to_int('192.168.1.128'), DhcpServerLibrary.ipv4_to_int('192.168.1.131'))])
+
+    def assertOccupancy(self, leases, used):
+        self.assertEqual(self.database.get_pool_occupancy(), {'leases': leases, 'pool_size': 8, 'used': used, 'free': 8 - used, 'utilisation': 100.0 * used / 8})
+
+    def test_addresses_outside_of_pool_are_not_counted(self):
+        self.database.addLeases([('02:00:00:00:00:01', '192.168.0.128'), ('02:00:00:00:00:02', '192.168.1.131'), ('02:00:00:00:00:03', '192.168.2.128')])
+        self.assertOccupancy(3, 2)
+        self.database.addLease('192.168.0.129', '02:00:00:00:00:03')  # Moved into the pool
+        self.assertOccupancy(3, 3)
+        self.database.addLease('192.168.0.130', '02:00:00:00:00:01')  # Moved within the pool
+        self.assertOccupancy(3, 3)
+        self.database.deleteLease('02:00:00:00:00:02')
+        self.assertOccupancy(2, 2)
+
+    def test_address_is_freed_by_last_holder(self):
+        holders = ['02:00:00:00:%02x:%02x' % (index // 256, index % 256) for index in range(300)]    # More holders than an 8 bit counter can count
+        self.database.addLeases([(hw_address, '192.168.0.128') for hw_address in holders])
+        self.assertOccupancy(300, 1)
+        for hw_address in holders[:-1]:
+            self.database.deleteLease(hw_address)
+        self.assertOccupancy(1, 1)
+        self.database.deleteLease(holders[-1])
+        self.assertOccupancy(0, 0)
+
+    def test_replace_leases_rebuilds_occupancy(self):
+        self.database.addLeases([('02:00:00:00:00:01', '192.168.0.128'), ('02:00:00:00:00:02', '192.168.0.129')])
+        self.database.replaceLeases([('02:00:00:00:00:02', '192.168.0.129'), ('02:00:00:00:00:03', '192.168.0.129'), ('02:00:00:00:00:04', '192.168.1.128')])
+        self.assertOccupancy(3, 2)
+
+
+@unittest.skipIf(DhcpServerLibrary is None, 'RobotFramework is not installed')
+class WaitLeasesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wrapper = make_synced_wrapper([('02:00:00:00:00:01', '192.168.0.128')])
+        self.wrapper.setServedRanges([('192.168.0.128', '192.168.0.131')])
+        self.timers = []
+
+    def tearDown(self):
+        for timer in self.timers:
+            timer.cancel()
+
+    def later(self, delay, callback, *args):
+        """
+        Invoke callback(*args) from another thread (standing for the event thread) after delay seconds
+        """
+        timer = threading.Timer(delay, callback, args)
+        self.timers.append(timer)
+        timer.start()
+
+    def test_lease_count_already_reached(self):
+        self.assertTrue(self.wrapper.waitLeaseCount(1, 0))
+
+    def test_lease_count_wakes_up_when_reached(self):
+        self.later(0.1, self.wrapper._handleDhcpLeaseAdded, '192.168.0.129', '02:00:00:00:00:02', '')
+        self.later(0.2, self.wrapper._handleDhcpLeaseAdded, '192.168.0.130', '02:00:00:00:00:03', '')
+        start = time.time()
+        self.assertTrue(self.wrapper.waitLeaseCount(3, 10))
+        self.assertLess(time.time() - start, 5)  # Woken up by the lease events, not by the timeout
+        self.assertEqual(self.wrapper.getLeasesCount(), 3)
+
+    def test_lease_count_times_out(self):
+        start = time.time()
+        self.assertFalse(self.wrapper.waitLeaseCount(2, 0.2))
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+    def test_lease_count_is_not_reached_by_deletes(self):
+        self.later(0.1, self.wrapper._handleDhcpLeaseAdded, '192.168.0.129', '02:00:00:00:00:02', '')
+        self.later(0.1, self.wrapper._handleDhcpLeaseDeleted, '192.168.0.128', '02:00:00:00:00:01', '')
+        self.assertFalse(self.wrapper.waitLeaseCount(2, 0.5))
+        self.assertEqual(self.wrapper.getLeasesCount(), 1)
+
+    def test_pool_utilisation_wakes_up_when_reached(self):
+        self.later(0.1, self.wrapper._handleDhcpLeaseAdded, '192.168.0.129', '02:00:00:00:00:02', '')
+        start = time.time()
+        self.assertTrue(self.wrapper.waitPoolUtilisation(50, 10))
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(self.wrapper.getPoolOccupancy()['utilisation'], 50.0)
+
+    def test_pool_utilisation_times_out_after_deletes(self):
+        self.later(0.1, self.wrapper._handleDhcpLeaseDeleted, '192.168.0.128', '02:00:00:00:00:01', '')
+        self.later(0.2, self.wrapper._handleDhcpLeaseAdded, '192.168.0.129', '02:00:00:00:00:02', '')
+        self.assertFalse(self.wrapper.waitPoolUtilisation(50, 0.5))
+        self.assertEqual(self.wrapper.getPoolOccupancy()['used'], 1)
+
+    def test_pool_utilisation_needs_a_pool(self):
+        self.wrapper.setServedRanges(None)
+        self.assertRaises(Exception, self.wrapper.waitPoolUtilisation, 50, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from rfdhcpserverlib import DhcpServerLibrary
+
+try:
+    from shutil import which
+except ImportError: # Python 2
+    from distutils.spawn import find_executable as which
+
+TIMEOUT = 5
+
+BUS_CONFIG = textwrap.dedent('''\
+    <!DOCTYPE busconfig PUBLIC "-//freedesktop//DTD D-Bus Bus Configuration 1.0//EN" "http://www.freedesktop.org/standards/dbus/1.0/busconfig.dtd">
+    <busconfig>
+      <type>session</type>
+      <listen>unix:tmpdir=%s</listen>
+      <policy context="default">
+        <allow send_destination="*"/>
+        <allow own="*"/>
+      </policy>
+    </busconfig>
+''')
+
+# Fake dnsmasq: owns dnsmasq's D-Bus name, answers GetVersion(), and emits a DhcpLeaseAdded signal for each "ipaddr hwaddr" line read on stdin
+FAKE_DNSMASQ_SCRIPT = textwrap.dedent('''
+    import sys
+    import dbus, dbus.service, dbus.mainloop.glib
+    import gobject
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default = True)
+
+    class Dnsmasq(dbus.service.Object):
+        @dbus.service.method('uk.org.thekelleys.dnsmasq', out_signature = 's')
+        def GetVersion(self):
+            return 'fake'
+
+        @dbus.service.signal('uk.org.thekelleys.dnsmasq', signature = 'sss')
+        def DhcpLeaseAdded(self, ipaddr, hwaddr, hostname):
+            pass
+
+    def emit(source, condition):
+        line = sys.stdin.readline()
+        if not line:
+            loop.quit()
+            return False
+        (ipaddr, hwaddr) = line.split()
+        dnsmasq.DhcpLeaseAdded(ipaddr, hwaddr, '')
+        return True
+
+    bus = dbus.SystemBus()
+    name = dbus.service.BusName('uk.org.thekelleys.dnsmasq', bus)
+    dnsmasq = Dnsmasq(bus, '/uk/org/thekelleys/dnsmasq')
+    gobject.io_add_watch(sys.stdin, gobject.IO_IN | gobject.IO_HUP, emit)
+    sys.stdout.write(bus.get_unique_name() + '\\n')
+    sys.stdout.flush()
+    loop = gobject.MainLoop()
+    loop.run()
+''')
+
+
+class FakeDnsmasq:
+    """
+    Fake dnsmasq process connected to the bus at bus_address
+    """
+
+    def __init__(self, bus_address):
+        environment = dict(os.environ, DBUS_SYSTEM_BUS_ADDRESS = bus_address)
+        self._proc = subprocess.Popen([sys.executable, '-c', FAKE_DNSMASQ_SCRIPT], stdin = subprocess.PIPE, stdout = subprocess.PIPE, env = environment, universal_newlines = True)
+        self.unique_name = self._proc.stdout.readline().strip()    # Written once the D-Bus name is owned
+
+    def emitLeaseAdded(self, ipaddr, hwaddr):
+        self._proc.stdin.write(ipaddr + ' ' + hwaddr + '\n')
+        self._proc.stdin.flush()
+
+    def stop(self):
+        self._proc.stdin.close()
+        self._proc.wait()
+
+
+@unittest.skipIf(which('dbus-daemon') is None, 'dbus-daemon is not installed')
+class DnsmasqDhcpServerWrapperRestartTest(unittest.TestCase):
+    """
+    Run the wrapper against fake dnsmasq processes on a private D-Bus daemon, used as system bus
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            DhcpServerLibrary.load_backend('dnsmasq')
+        except ImportError:
+            raise unittest.SkipTest('dbus-python or gobject is not installed')
+        cls.tmpdir = tempfile.mkdtemp()
+        config = os.path.join(cls.tmpdir, 'bus.conf')
+        with open(config, 'w') as f:
+            f.write(BUS_CONFIG % cls.tmpdir)
+        cls.bus_daemon = subprocess.Popen(['dbus-daemon', '--config-file=' + config, '--nofork', '--print-address'], stdout = subprocess.PIPE, universal_newlines = True)
+        cls.bus_address = cls.bus_daemon.stdout.readline().strip()
+        cls.system_bus_address = os.environ.get('DBUS_SYSTEM_BUS_ADDRESS')
+        os.environ['DBUS_SYSTEM_BUS_ADDRESS'] = cls.bus_address    # Read by dbus.SystemBus()
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.system_bus_address is None:
+            del os.environ['DBUS_SYSTEM_BUS_ADDRESS']
+        else:
+            os.environ['DBUS_SYSTEM_BUS_ADDRESS'] = cls.system_bus_address
+        cls.bus_daemon.terminate()
+        cls.bus_daemon.wait()
+        shutil.rmtree(cls.tmpdir)
+
+    def assertLeaseReceived(self, dnsmasq, ipaddr, hwaddr):
+        self.wrapper.setMacAddrToWatch(hwaddr)
+        dnsmasq.emitLeaseAdded(ipaddr, hwaddr)
+        self.assertTrue(self.wrapper.watched_macaddr_got_lease_event.wait(TIMEOUT), 'No lease event received from ' + dnsmasq.unique_name)
+        self.assertEqual(self.wrapper.getIpForMac(hwaddr), ipaddr)
+
+    def test_lease_events_are_received_after_restart(self):
+        dnsmasq = FakeDnsmasq(self.bus_address)
+        self.wrapper = DhcpServerLibrary.DnsmasqDhcpServerWrapper('eth0')
+        try:
+            self.assertLeaseReceived(dnsmasq, '192.168.0.128', '02:00:00:00:00:01')
+            dnsmasq.stop()
+            restarted_dnsmasq = FakeDnsmasq(self.bus_address)
+            try:
+                self.assertNotEqual(restarted_dnsmasq.unique_name, dnsmasq.unique_name)
+                self.assertLeaseReceived(restarted_dnsmasq, '192.168.0.129', '02:00:00:00:00:02')
+            finally:
+                restarted_dnsmasq.stop()
+        finally:
+            self.wrapper.exit()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import inspect
+import sys
+import unittest
+
+from rfdhcpserverlib import DhcpServerLibrary
+from rfdhcpserverlib.KeywordProfiler import KeywordProfiler
+
+
+def keyword_signature(function):
+    """
+    Format the arguments of function as RobotFramework sees them: inspect.signature() follows __wrapped__ on Python 3, while Python 2 inspects function itself
+    """
+    if sys.version_info[0] >= 3:
+        return str(inspect.signature(function))
+    argspec = inspect.getargspec(function)
+    args = argspec.args
+    if inspect.ismethod(function):
+        args = args[1:]
+    return inspect.formatargspec(args, argspec.varargs, argspec.keywords, argspec.defaults)
+
+
+class Keywords:
+
+    def keyword(self, mac, count = 1, *args, **kwargs):
+        return (mac, count, args, kwargs)
+
+
+class KeywordProfilerWrapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = KeywordProfiler()
+
+    def test_signature_is_preserved(self):
+        profiled = self.profiler.wrap('keyword', 'Keyword', Keywords().keyword)
+        self.assertEqual(keyword_signature(profiled), '(mac, count=1, *args, **kwargs)')
+        self.assertEqual(profiled.__name__, 'keyword')
+
+    def test_calls_are_forwarded_and_recorded(self):
+        profiled = self.profiler.wrap('keyword', 'Keyword', Keywords().keyword)
+        self.assertEqual(profiled('02:00:00:00:00:01'), ('02:00:00:00:00:01', 1, (), {}))
+        self.assertEqual(profiled('02:00:00:00:00:01', 2, 3, option = 4), ('02:00:00:00:00:01', 2, (3,), {'option': 4}))
+        self.assertEqual(self.profiler.getReport()['keyword']['Keyword']['count'], 2)
+
+    def test_wrong_argument_count_is_reported_before_call(self):
+        profiled = self.profiler.wrap('keyword', 'Keyword', Keywords().keyword)
+        self.assertRaises(TypeError, profiled)
+        if sys.version_info[0] < 3:
+            self.assertEqual(self.profiler.getReport()['keyword'], {})  # Rejected by the generated forwarder, as RobotFramework would do
+
+
+class ProfiledLibraryTest(unittest.TestCase):
+
+    def test_keyword_signatures_are_preserved(self):
+        library = DhcpServerLibrary.DhcpServerLibrary(None, backend = 'asyncio', profiling = True)
+        try:
+            self.assertEqual(keyword_signature(library.wait_lease_count), '(count, timeout=0)')
+            self.assertEqual(keyword_signature(library.get_profiling_report), '(path=None)')
+            self.assertEqual(library.wait_lease_count.__doc__, DhcpServerLibrary.DhcpServerLibrary.wait_lease_count.__doc__)
+        finally:
+            library._profiler.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()